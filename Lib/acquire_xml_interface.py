@@ -43,6 +43,7 @@ def game_state_in_progress(players, board):
         if state.shares_map[h] < 0:
             raise XMLError("too many shares have been allocated in this game state")
 
+    state.rehash()
     return state
 
 ################################################################################
@@ -69,17 +70,16 @@ def elt_to_board(e):
     if e.tag.lower() != 'board':
         raise XMLError('tried to parse a board without a board tag')
 
-    board = Board()
+    square_coords = []
     for child in e:
         if child.tag.lower() == 'tile':
-            board.board[elt_to_tile(child)] = NoHotel
+            square_coords.append((NoHotel, [elt_to_tile(child)]))
         elif child.tag.lower() == 'hotel':
             hotel = elt_to_hotel(child)
-            for hotel_child in child:
-                board.board[elt_to_tile(hotel_child)] = hotel
+            square_coords.append((hotel, [elt_to_tile(hotel_child) for hotel_child in child]))
         else:
             raise XMLError('unexpected tag in board: '+child.tag)
-    return board
+    return Board._board_in_play(square_coords)
 
 def elt_to_game_state(e):
     if e.tag.lower() != 'state':
@@ -290,8 +290,7 @@ def hotel_to_xml(hotel, tiles):
 
 def board_to_xml(board):
     """ return xml for the given board """
-    tiles = [c for c, s in board.board.items() if s == NoHotel]
-    tiles.sort(key=tile_sortkey)
+    tiles = sorted(board[NoHotel], key=tile_sortkey)
 
     b = et.Element('board')
 
@@ -307,23 +306,25 @@ def board_to_xml(board):
 
     return b
 
-def query_response_to_xml(qr):
-    """ given a query_response from Board.query(), return` an XML response """
-    if qr == 'singleton':
+def query_response_to_xml(board, tile):
+    """ return an XML response to querying the given tile on the given board """
+    movetypes, adjacent = board.query_all()
+    qr = movetypes[coord_index[tile]]
+    if qr == SINGLETON:
         return et.Element('singleton')
-    elif qr == 'found':
+    elif qr == FOUND:
         return et.Element('founding')
-    elif qr == 'invalid':
+    elif qr == INVALID:
         r = et.Element('invalid')
         # TODO perhaps update this with an actual reason?
         r.attrib['msg'] = "no valid moves at this tile location"
         return r
-    elif 'grow' in qr:
+    elif qr == GROW:
         r = et.Element('growing')
-        r.attrib['name'] = qr[1]
+        r.attrib['name'] = adjacent[coord_index[tile]][0][0]
         return r
-    elif 'merge' in qr:
-        merge, hotels = qr
+    elif qr == MERGE:
+        hotels = adjacent[coord_index[tile]]
         acquirer, acquirees = hotels[0][0], [h for h, s in hotels[1:]]
         m = et.Element('merging')
         m.attrib['acquirer'] = acquirer
@@ -84,6 +84,9 @@ cols = range(1,13)
 # array of valid coordinates in an Acquire board, eg '12C'
 coords = [str(__c) + __r for __r in rows for __c in cols]
 
+# set of valid coordinates, for constant time membership tests
+coord_set = frozenset(coords)
+
 def _dist(a, b):
     """
     Arguments : a - coord
@@ -102,9 +105,24 @@ for __c1 in coords:
         if _dist(__c1, __c2) == 1:
             adjacencies[__c1].add(__c2)
 
+# map of coords to their index in coords (0..107), used by the integer
+#   representations of tiles. Converting between the two should only happen
+#   at the edges (XML, GUI, Board's public API)
+coord_index = dict([(__c, __i) for __i, __c in enumerate(coords)])
+
+# bitmask of the coords adjacent to each coord, indexed by coord_index
+adjacency_masks = [sum([1 << coord_index[__a] for __a in adjacencies[__c]]) for __c in coords]
+
+# indices of the coords adjacent to each coord, in the same order that
+#   iterating over adjacencies[coord] gives them
+adjacency_indices = [tuple([coord_index[__a] for __a in adjacencies[__c]]) for __c in coords]
+
 # array of all hotel names
 hotels = [A, C, F, I, S, T, W]
 
+# map of hotels to their index in hotels, for the per hotel arrays
+hotel_index = dict([(__h, __i) for __i, __h in enumerate(hotels)])
+
 # array of all possible buy moves
 ALL_LEGAL_BUYS = [[]] + \
                  [[__h] for __h in hotels] + [[__h, __h] for __h in hotels]
@@ -118,6 +136,29 @@ hotel_color_map = dict(zip(hotels, colors))
 # array of valid squares
 squares = hotels + [Empty, NoHotel]
 
+# the smallest hotel size for each price, from MINIMUM_PRICE up in steps of
+#   PRICE_DIFFERENCE, for each of the three hotel categories
+_price_levels = {W: [2, 3, 4, 5, 6, 11, 21, 31, 41],
+                 S: [2, 3, 4, 5, 6, 11, 21, 31, 41],
+                 F: [0, 2, 3, 4, 5, 6, 11, 21, 31, 41],
+                 I: [0, 2, 3, 4, 5, 6, 11, 21, 31, 41],
+                 A: [0, 2, 3, 4, 5, 6, 11, 21, 31, 41],
+                 T: [0, 0, 2, 3, 4, 5, 6, 11, 21, 31, 41],
+                 C: [0, 0, 2, 3, 4, 5, 6, 11, 21, 31, 41]}
+
+def _price_row(levels):
+    """ the prices of a hotel with the given price levels, for every hotel size """
+    row = [None] * (len(coords) + 1)
+    for step, min_count in enumerate(levels):
+        price = MINIMUM_PRICE + step * PRICE_DIFFERENCE
+        for count in range(min_count, len(row)):
+            row[count] = price
+    return row
+
+# the stock price of each hotel for each size, indexed by hotel_index then
+#   size, None where the stock can not be bought
+price_table = [_price_row(_price_levels[__h]) for __h in hotels]
+
 def calculate_stock_price(hotel, count):
     """
     Calculate the stock price for a hotel based on its size
@@ -128,22 +169,7 @@ def calculate_stock_price(hotel, count):
         Natural Number or None (representing this stock can not be bought)
 
     """
-    # smallest number of tiles associated with a particular price - used for
-    #   all hotel categories, excluding the N/A cases
-    prices = range(MINIMUM_PRICE, MAXIMUM_PRICE+PRICE_DIFFERENCE, PRICE_DIFFERENCE)
-
-    if hotel in ['Worldwide', 'Sackson']:
-        count_levels = [2, 3, 4, 5, 6, 11, 21, 31, 41]
-    elif hotel in ['Festival', 'Imperial', 'American']:
-        count_levels = [0, 2, 3, 4, 5, 6, 11, 21, 31, 41]
-    elif hotel in ['Tower', 'Continental']:
-        count_levels = [0, 0, 2, 3, 4, 5, 6, 11, 21, 31, 41]
-
-    count_price_list = zip(count_levels, prices)
-    for min_count, price in reversed(count_price_list):
-        if count >= min_count:
-            return price
-    return None # Nobody can buy these
+    return price_table[hotel_index[hotel]][count]
 
 def tile_to_colrow(tile):
     """ returns a pair that is the strings (col, row) """
@@ -179,6 +205,10 @@ class TestBasics(ut.TestCase):
         self.assertEquals(calculate_stock_price(S, 1), None)
         self.assertEquals(calculate_stock_price(F, 0), MINIMUM_PRICE)
         self.assertEquals(calculate_stock_price(T, 12), 900)
+        self.assertEquals(calculate_stock_price(S, 2), MINIMUM_PRICE)
+        self.assertEquals(calculate_stock_price(C, 41), MAXIMUM_PRICE)
+        self.assertEquals(calculate_stock_price(W, len(coords)), 1000)
+        self.assertEquals(calculate_stock_price(A, 7), 700)
 
     def test_tile_to_colrow(self):
         self.assertEquals(tile_to_colrow("11C"), (11, 'C'))
@@ -197,6 +227,16 @@ class TestBasics(ut.TestCase):
             for j in range(i+1, len(colrows)):
                 self.assertTrue(colrow_sortkey(colrows[i]) < colrow_sortkey(colrows[j]))
 
+    def test_coord_index(self):
+        for i, c in enumerate(coords):
+            self.assertEquals(coords[coord_index[c]], c)
+
+    def test_adjacency_masks(self):
+        for c in coords:
+            adjacent = [coords[i] for i in range(len(coords)) if adjacency_masks[coord_index[c]] >> i & 1]
+            self.assertEquals(set(adjacent), adjacencies[c])
+            self.assertEquals([coords[i] for i in adjacency_indices[coord_index[c]]], list(adjacencies[c]))
+
     def test_divide_and_round_integers(self):
         self.assertEquals(divide_and_round_integers(5,3), 2)
 
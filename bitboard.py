@@ -0,0 +1,735 @@
+from copy import copy
+from basics import *
+from board import Board, square_keys, byte_squares, BOARD_BYTES
+from Lib.decontractors import Precondition, Postcondition
+import unittest as ut
+
+################################################################################
+#### Bit Layout ################################################################
+################################################################################
+# Every coord is handled as its coord_index (0..107), counting along the rows:
+# '1A' is 0, '12A' is 11, '1B' is 12 ... '12I' is 107. A set of coords is an
+# int with the bit for each of its coords turned on, so moving one column over
+# is a shift by 1 and moving one row over is a shift by ROW_WIDTH.
+#
+#   bit:  0   1   2  ...  11
+#        1A  2A  3A  ... 12A
+#        1B  2B  3B  ... 12B    <- bits 12..23
+#        ...
+################################################################################
+ROW_WIDTH = len(cols)
+
+ALL_TILES = (1 << len(coords)) - 1
+FIRST_COLUMN = sum([1 << (r * ROW_WIDTH) for r in range(len(rows))])
+LAST_COLUMN = FIRST_COLUMN << (ROW_WIDTH - 1)
+
+# slot of each square's mask in BitBoard._masks
+hotel_slots = dict([(h, i) for i, h in enumerate(hotels)])
+NOHOTEL_SLOT = len(hotels)
+
+# Board's square_keys by slot and coord_index, so that equal Boards and
+#   BitBoards hash the same
+slot_keys = [[square_keys[(c, s)] for c in coords] for s in hotels + [NoHotel]]
+
+
+def spread(mask):
+    """ the mask of all tiles orthogonally adjacent to some tile in mask """
+    return (((mask << 1) & ~FIRST_COLUMN) |
+            ((mask >> 1) & ~LAST_COLUMN) |
+            (mask << ROW_WIDTH) |
+            (mask >> ROW_WIDTH)) & ALL_TILES
+
+
+def popcount(mask):
+    """ the number of tiles in mask """
+    return bin(mask).count('1')
+
+
+def mask_to_coords(mask):
+    """ the set of coords in mask """
+    tiles = set()
+    while mask:
+        low = mask & -mask
+        tiles.add(coords[low.bit_length() - 1])
+        mask ^= low
+    return tiles
+
+
+def mask_to_indices(mask):
+    """ the coord_index of every tile in mask, lowest first """
+    indices = []
+    while mask:
+        low = mask & -mask
+        indices.append(low.bit_length() - 1)
+        mask ^= low
+    return indices
+
+
+def mask_key(slot, mask):
+    """ the xor of the slot's keys for the tiles in mask """
+    keys = slot_keys[slot]
+    key = 0
+    while mask:
+        low = mask & -mask
+        key ^= keys[low.bit_length() - 1]
+        mask ^= low
+    return key
+
+
+def coords_to_mask(tiles):
+    """ the mask of the given coords """
+    mask = 0
+    for tile in tiles:
+        mask |= 1 << coord_index[tile]
+    return mask
+
+
+class BitBoard(Board):
+    """
+    Bitboard engine for Acquire boards, a drop-in for Board
+
+    Internally a tile is its coord_index and the board is one mask per hotel
+    plus one for NoHotel, so the placement predicates are a few shifts and ANDs
+    instead of set building over the board dict. Coords are only converted at
+    the public API, which is the same as Board's.
+
+    Fields:
+        _masks    - [int] the tiles of each square, indexed by hotel_slots and NOHOTEL_SLOT
+        _occupied - int, the tiles that are not Empty
+        _zobrist  - the same hash Board keeps, from slot_keys
+    """
+    def __init__(self):
+        """ initializes an empty board """
+        self._masks = [0] * (NOHOTEL_SLOT + 1)
+        self._occupied = 0
+        self._zobrist = 0
+
+    @staticmethod
+    @Postcondition(lambda: isinstance(__return__, BitBoard), globals=globals())
+    def from_board(board):
+        """ Construct a BitBoard with the same squares as the given Board """
+        b = BitBoard()
+        for coord, square in board.board.items():
+            b._set(coord_index[coord], square)
+        return b
+
+    def to_board(self):
+        """ Construct a dict backed Board with the same squares as this board """
+        return Board._board_in_play(self._to_board_in_play())
+
+    @staticmethod
+    @Postcondition(lambda: isinstance(__return__, BitBoard), globals=globals())
+    def _board_in_play(square_coords):
+        """
+        Construct a testable BitBoard, see Board._board_in_play
+        Arguments : dict[(square => [coord])]
+        Return    : BitBoard
+
+        """
+        b = BitBoard()
+        for s, cs in square_coords:
+            for c in cs:
+                b._set(coord_index[c], s)
+        return b
+
+    @property
+    def board(self):
+        """
+        The dict from coords to squares for the tiles on this board, for code
+        that reads Board.board directly. Built on every access.
+        Returns   : dict([(coord, square)])
+
+        """
+        squares_by_slot = hotels + [NoHotel]
+        board = {}
+        for slot, mask in enumerate(self._masks):
+            for coord in mask_to_coords(mask):
+                board[coord] = squares_by_slot[slot]
+        return board
+
+    @Precondition(lambda: item in coords or item in squares, globals=globals())
+    def __getitem__(self, item):
+        """
+        Reference lookup into boards.
+        Arguments : item - coord|square
+        Returns   : square if item is a coord
+                    set([coord]) if item is a square
+
+        """
+        if item in coord_index:
+            return self._square(coord_index[item])
+        elif item == Empty:
+            return mask_to_coords(ALL_TILES & ~self._occupied)
+        elif item == NoHotel:
+            return mask_to_coords(self._masks[NOHOTEL_SLOT])
+        else:
+            return mask_to_coords(self._masks[hotel_slots[item]])
+
+    def __eq__(self, other):
+        """
+        Is this board equal to the given object
+        Arguments : other - object
+        Returns   : bool
+
+        """
+        if isinstance(other, BitBoard):
+            return self._zobrist == other._zobrist and self._masks == other._masks
+        return Board.__eq__(self, other)
+
+    def __iter__(self):
+        """ Returns an iterator for this board's (coord, square) pairs ordered by coord. """
+        return iter([(coord, self._square(i)) for i, coord in enumerate(coords)])
+
+    def __copy__(self):
+        b = BitBoard()
+        b._masks = list(self._masks)
+        b._occupied = self._occupied
+        b._zobrist = self._zobrist
+        return b
+
+    def to_bytes(self):
+        """ Pack this board into the same bytes as Board.to_bytes """
+        # a slot's square code is the slot + 1
+        codes = [0] * len(coords)
+        for slot, mask in enumerate(self._masks):
+            for i in mask_to_indices(mask):
+                codes[i] = slot + 1
+        return str(bytearray([codes[i] | codes[i + 1] << 4 for i in xrange(0, len(coords), 2)]))
+
+    @staticmethod
+    @Postcondition(lambda: isinstance(__return__, BitBoard), globals=globals())
+    def from_bytes(data):
+        """ Unpack bytes from to_bytes (or Board.to_bytes), raising a ValueError on bad data """
+        if len(data) != BOARD_BYTES:
+            raise ValueError("a board is {0} bytes, got {1}".format(BOARD_BYTES, len(data)))
+        masks = [0] * (NOHOTEL_SLOT + 1)
+        for i, byte in enumerate(bytearray(data)):
+            if byte_squares[byte] is None:
+                raise ValueError("bad square code in byte {0}".format(i))
+            for j, code in ((2 * i, byte & 15), (2 * i + 1, byte >> 4)):
+                if code:
+                    masks[code - 1] |= 1 << j
+
+        b = BitBoard()
+        b._masks = masks
+        for slot, mask in enumerate(masks):
+            b._occupied |= mask
+            b._zobrist ^= mask_key(slot, mask)
+        return b
+
+    def fork(self):
+        """ a BitBoard is a handful of ints, so a fork is just a copy """
+        return self.__copy__()
+
+    ###########################################################################
+    ### Board Query Functions: ################################################
+    ###########################################################################
+    @Precondition(lambda: coord in coords, globals=globals())
+    def is_space_free(self, coord):
+        """
+        Is the space at the given coordinate currently unused on this board
+        Arguments : coord
+        Returns   : bool
+
+        """
+        return not self._occupied >> coord_index[coord] & 1
+
+    @property
+    def hotels_in_play(self):
+        """
+        Get the hotels that are currently placed on this board
+        Returns   : set([hotel])
+
+        """
+        masks = self._masks
+        return set([h for h in hotels if masks[hotel_slots[h]]])
+
+    @property
+    def hotels_not_in_play(self):
+        """
+        Get the hotels not currently placed on this board
+        Returns   : set([hotel])
+
+        """
+        masks = self._masks
+        return set([h for h in hotels if not masks[hotel_slots[h]]])
+
+    @property
+    def tiles_for_hotels(self):
+        """
+        Get the hotels currently placed on this board, mapped to the tiles currently associated with those hotels
+        Returns   : dict([(hotel, set([tile])...])
+
+        """
+        masks = self._masks
+        return dict([(h, mask_to_coords(masks[hotel_slots[h]])) for h in hotels if masks[hotel_slots[h]]])
+
+    @Precondition(lambda: coord in coords, globals=globals())
+    def adjacent_squares(self, coord):
+        """
+        Get the set of squares one unit away from the given coord.
+        Arguments : coord
+        Returns   : set([square])
+
+        """
+        adj = adjacency_masks[coord_index[coord]]
+        adj_squares = set([s for s in hotels + [NoHotel] if self._masks[self._slot(s)] & adj])
+        if adj & ~self._occupied:
+            adj_squares.add(Empty)
+        return adj_squares
+
+    @Precondition(lambda: coord in coords, globals=globals())
+    def adjacent_hotels(self, coord):
+        """
+        Get the set of all hotels adjacent to given coord
+        Arguments : coord
+        Returns   : set([hotel])
+
+        """
+        return set([hotels[slot] for slot in self._adjacent_hotel_slots(adjacency_masks[coord_index[coord]])])
+
+    @Precondition(lambda: coord in coords, globals=globals())
+    def adjacent_nohotel_count(self, coord):
+        """
+        Count the number of NoHotel squares around the given coord
+        Arguments : coord
+        Returns   : integer
+
+        """
+        return popcount(self._masks[NOHOTEL_SLOT] & adjacency_masks[coord_index[coord]])
+
+    @Precondition(lambda: hotel in hotels, globals=globals())
+    def hotel_size(self, hotel):
+        """
+        Calculate the size of the given hotel
+        Arguments : hotel
+        Returns   : int
+        """
+        return popcount(self._masks[hotel_slots[hotel]])
+
+    @Precondition(lambda: hotel in hotels, globals=globals())
+    def stock_price(self, hotel):
+        """
+        Calculate the stock price of the given hotel for this board.
+
+        Arguments:
+            hotel - the hotel
+        Returns:
+            int or None - the cost of None if impossible to buy.
+        """
+        return price_table[hotel_index[hotel]][popcount(self._masks[hotel_slots[hotel]])]
+
+    def price_vector(self):
+        """
+        Get the stock prices of all the hotels on this board at once
+        Returns : [int or None], indexed by hotel_index
+
+        """
+        return [row[popcount(mask)] for mask, row in zip(self._masks, price_table)]
+
+    @Precondition(lambda: tile in coords, globals=globals())
+    def query(self, tile):
+        """
+        Ask this board what can be done what effect placing the given tile will have
+        Arguments:
+            tile
+        Returns:
+            movetype
+        """
+        i = coord_index[tile]
+        if self._occupied >> i & 1:
+            return INVALID
+
+        adj = adjacency_masks[i]
+        adj_slots = self._adjacent_hotel_slots(adj)
+        if not adj_slots:
+            if self._founds(i) and not all(self._masks[:NOHOTEL_SLOT]):
+                return FOUND
+            return SINGLETON
+        elif len(adj_slots) == 1:
+            return GROW
+        elif self._merges(adj, adj_slots):
+            return MERGE
+        else:
+            return INVALID
+
+    def query_all(self):
+        """
+        Ask this board what placing each of its tiles would do, see Board.query_all.
+        Tiles next to one, two or more hotels, NoHotels and safe hotels are
+        found for the whole board at once by spreading each mask.
+
+        Returns:
+            movetypes - [movetype] indexed by coord_index
+            adjacent  - dict(coord_index => [(hotel, size)]) for GROW and MERGE tiles
+        """
+        masks = self._masks
+        sizes = [popcount(mask) for mask in masks]
+        near_one = near_two = near_safe = 0
+        for slot in xrange(NOHOTEL_SLOT):
+            near = spread(masks[slot])
+            near_two |= near_one & near
+            near_one |= near
+            if sizes[slot] >= HOTEL_SAFE_SIZE:
+                near_safe |= near
+        near_nohotel = spread(masks[NOHOTEL_SLOT])
+        free = ALL_TILES & ~self._occupied
+
+        movetypes = [INVALID] * len(coords)
+        can_found = not all(masks[:NOHOTEL_SLOT])
+        for i in mask_to_indices(free & ~near_one):
+            if can_found and near_nohotel >> i & 1 and self._founds(i):
+                movetypes[i] = FOUND
+            else:
+                movetypes[i] = SINGLETON
+
+        adjacent = {}
+        grows = free & near_one & ~near_two
+        merges = free & near_two & ~near_nohotel & ~near_safe
+        for movetype, mask in [(GROW, grows), (MERGE, merges)]:
+            for i in mask_to_indices(mask):
+                movetypes[i] = movetype
+                adjacent[i] = sorted([(hotels[slot], sizes[slot])
+                                      for slot in self._adjacent_hotel_slots(adjacency_masks[i])],
+                                     key=lambda (h, size): -size)
+        return movetypes, adjacent
+
+    ###########################################################################
+    ### Board modifying commands: #############################################
+    ###########################################################################
+    @Precondition(lambda: self.valid_singleton_placement(tile), globals=globals())
+    def singleton(self, tile):
+        """
+        Place the given tile on this board, with no other effects
+        Arguments : tile
+
+        """
+        self._singleton(tile)
+
+    @Precondition(lambda: self.valid_found_placement(tile, hotel), globals=globals())
+    def found(self, tile, hotel):
+        """
+        Place the given tile on this board to found the given hotel
+        Arguments : tile
+                    hotel
+
+        """
+        self._found(tile, hotel)
+
+    @Precondition(lambda: self.valid_merge_placement(tile, hotel), globals=globals())
+    def merge(self, tile, hotel):
+        """
+        Place the given tile on the board and merge the adjacent hotels with the given hotel
+        Arguments : tile
+                    hotel
+        """
+        self._merge(tile, hotel, self.acquirees(tile, hotel))
+
+    @Precondition(lambda: self.valid_grow_placement(tile), globals=globals())
+    def grow(self, tile):
+        """
+        Place the given tile on the board and add the square on which it is placed to the adjacent hotel.
+        Arguments : tile
+
+        """
+        slot = self._adjacent_hotel_slots(adjacency_masks[coord_index[tile]])[0]
+        self._grow(tile, hotels[slot])
+
+    def restore(self, squares):
+        """
+        Undo board modifying commands by putting back the squares they changed
+        Arguments : squares - [(coord, square)], the squares before the commands
+
+        """
+        for coord, square in squares:
+            self._set(coord_index[coord], square)
+
+    ###########################################################################
+    ### Tile Placement Assertions: ############################################
+    ###########################################################################
+    @Precondition(lambda: tile in coords, globals=globals())
+    def valid_singleton_placement(self, tile):
+        """
+        Can the given tile be placed to make a singleton move on this board?
+        Arguments : tile
+        Returns   : bool
+
+        """
+        i = coord_index[tile]
+        return not self._occupied >> i & 1 and \
+            not self._adjacent_hotel_slots(adjacency_masks[i]) and \
+            not (not all(self._masks[:NOHOTEL_SLOT]) and self._founds(i))
+
+    @Precondition(lambda: tile in coords, globals=globals())
+    @Precondition(lambda: hotel in hotels or hotel is None, globals=globals())
+    def valid_found_placement(self, tile, hotel):
+        """
+        Can the given tile be placed to found the given hotel on this board?
+        Arguments : tile
+                    hotel
+        Returns   : bool
+
+        """
+        if hotel == None : return False
+        i = coord_index[tile]
+        return not self._occupied >> i & 1 and \
+            not self._masks[hotel_slots[hotel]] and \
+            not self._adjacent_hotel_slots(adjacency_masks[i]) and \
+            self._founds(i)
+
+    @Precondition(lambda: tile in coords, globals=globals())
+    @Precondition(lambda: hotel in hotels or hotel is None, globals=globals())
+    def valid_merge_placement(self, tile, hotel):
+        """
+        Can the given tile be placed to merge adjacent hotels with the given hotel on this board?
+        Arguments : tile
+                    hotel (acquirer)
+        Returns   : bool
+
+        """
+        if hotel == None : return False
+        i = coord_index[tile]
+        adj = adjacency_masks[i]
+        adj_slots = self._adjacent_hotel_slots(adj)
+        return not self._occupied >> i & 1 and \
+            hotel_slots[hotel] in adj_slots and \
+            self._merges(adj, adj_slots)
+
+    @Precondition(lambda: tile in coords, globals=globals())
+    def valid_grow_placement(self, tile):
+        """
+        Can the given tile be placed to grow the adjacent hotel on this board
+        Arguments : tile
+        Returns   : bool
+
+        """
+        i = coord_index[tile]
+        return not self._occupied >> i & 1 and \
+            len(self._adjacent_hotel_slots(adjacency_masks[i])) == 1
+
+    ###########################################################################
+    ### Internal Function: ####################################################
+    ###########################################################################
+    @staticmethod
+    def _slot(square):
+        """ the index of the given (non Empty) square's mask """
+        return NOHOTEL_SLOT if square == NoHotel else hotel_slots[square]
+
+    def _square(self, i):
+        """ the square of the tile at index i """
+        if not self._occupied >> i & 1:
+            return Empty
+        for slot, mask in enumerate(self._masks):
+            if mask >> i & 1:
+                return NoHotel if slot == NOHOTEL_SLOT else hotels[slot]
+
+    def _set(self, i, square):
+        """ put the given square on the tile at index i, whatever was there before """
+        bit = 1 << i
+        old = self._square(i)
+        if old != Empty:
+            self._masks[self._slot(old)] &= ~bit
+            self._occupied &= ~bit
+            self._zobrist ^= slot_keys[self._slot(old)][i]
+        if square != Empty:
+            self._masks[self._slot(square)] |= bit
+            self._occupied |= bit
+            self._zobrist ^= slot_keys[self._slot(square)][i]
+
+    # The board modifying commands without their checks, as Board has them for
+    # GameState._play_unchecked. A fork is a copy, so there is nothing to own.
+    def _singleton(self, tile):
+        """ singleton, unchecked """
+        i = coord_index[tile]
+        self._masks[NOHOTEL_SLOT] |= 1 << i
+        self._occupied |= 1 << i
+        self._zobrist ^= slot_keys[NOHOTEL_SLOT][i]
+
+    def _found(self, tile, hotel):
+        """ found, unchecked """
+        i = coord_index[tile]
+        adj_nohot = self._masks[NOHOTEL_SLOT] & adjacency_masks[i]
+        founded = (1 << i) | adj_nohot
+        self._masks[NOHOTEL_SLOT] &= ~founded
+        self._masks[hotel_slots[hotel]] |= founded
+        self._occupied |= founded
+        self._zobrist ^= mask_key(NOHOTEL_SLOT, adj_nohot) ^ mask_key(hotel_slots[hotel], founded)
+
+    def _merge(self, tile, hotel, acquirees):
+        """ merge, unchecked, with the given acquirees (see acquirees) """
+        merged = 1 << coord_index[tile]
+        for acquiree in acquirees:
+            slot = hotel_slots[acquiree]
+            merged |= self._masks[slot]
+            self._zobrist ^= mask_key(slot, self._masks[slot])
+            self._masks[slot] = 0
+        self._masks[hotel_slots[hotel]] |= merged
+        self._occupied |= merged
+        self._zobrist ^= mask_key(hotel_slots[hotel], merged)
+
+    def _grow(self, tile, hotel):
+        """ grow, unchecked, given the adjacent hotel """
+        i = coord_index[tile]
+        slot = hotel_slots[hotel]
+        self._masks[slot] |= 1 << i
+        self._occupied |= 1 << i
+        self._zobrist ^= slot_keys[slot][i]
+
+    def _adjacent_hotel_slots(self, adj):
+        """ the slots of the hotels touching the tiles in the mask adj """
+        masks = self._masks
+        return [slot for slot in xrange(NOHOTEL_SLOT) if masks[slot] & adj]
+
+    def _founds(self, i):
+        """
+        Does placing a tile at index i make a hotel's worth of tiles, regardless of
+        which hotels are left? Like Board, only the first adjacent NoHotel tile
+        (in adjacencies order) is considered, and it may not touch anything else.
+
+        """
+        nohotel = self._masks[NOHOTEL_SLOT]
+        for n in adjacency_indices[i]:
+            if nohotel >> n & 1:
+                return not adjacency_masks[n] & self._occupied
+        return False
+
+    def _merges(self, adj, adj_slots):
+        """ do the (at least two) hotels in adj_slots merge when a tile with neighbors adj is placed? """
+        masks = self._masks
+        return len(adj_slots) >= 2 and \
+            not masks[NOHOTEL_SLOT] & adj and \
+            all([popcount(masks[slot]) < HOTEL_SAFE_SIZE for slot in adj_slots])
+
+
+from random import Random
+class TestBitBoard(ut.TestCase):
+    def setUp(self):
+        self.empty_board = BitBoard()
+        self.board_1_hotel = BitBoard._board_in_play([(A, ['3D','4E','3C'])])
+        self.board_2_hotels = BitBoard._board_in_play([(W,['1A','2A','3A']),
+                                                       (S,['1C','2C','3C'])])
+        self.board_3_hotels = BitBoard._board_in_play([(F,['1C','2C']),
+                                                       (S,['3A','3B']),
+                                                       (I,['3D','3E'])])
+        self.board_found_hotel = BitBoard._board_in_play([(NoHotel, ['2A'])])
+
+    def assertSameBoard(self, bitboard, board):
+        """ every query on the two boards has the same answer """
+        self.assertEqual(bitboard.board, board.board)
+        self.assertEqual(bitboard, BitBoard.from_board(board))
+        self.assertEqual(hash(bitboard), hash(board))
+        self.assertEqual(bitboard.hotels_in_play, board.hotels_in_play)
+        self.assertEqual(bitboard.tiles_for_hotels, board.tiles_for_hotels)
+        self.assertEqual(sorted(bitboard.hotels_with_sizes), sorted(board.hotels_with_sizes))
+        self.assertEqual(bitboard.price_vector(), board.price_vector())
+        self.assertEqual([bitboard.stock_price(h) for h in hotels], [board.stock_price(h) for h in hotels])
+        bit_movetypes, bit_adjacent = bitboard.query_all()
+        movetypes, adjacent = board.query_all()
+        self.assertEqual(bit_movetypes, movetypes)
+        self.assertEqual(sorted(bit_adjacent.keys()), sorted(adjacent.keys()))
+        for i in adjacent:
+            self.assertEqual(sorted(bit_adjacent[i]), sorted(adjacent[i]))
+        for square in squares:
+            self.assertEqual(bitboard[square], board[square])
+        for c in coords:
+            self.assertEqual(bitboard[c], board[c])
+            self.assertEqual(bitboard.query(c), board.query(c))
+            self.assertEqual(bitboard.adjacent_squares(c), board.adjacent_squares(c))
+            self.assertEqual(bitboard.adjacent_nohotel_count(c), board.adjacent_nohotel_count(c))
+            self.assertEqual(sorted(bitboard.acquirers(c)), sorted(board.acquirers(c)))
+            self.assertEqual(bitboard.valid_singleton_placement(c), board.valid_singleton_placement(c))
+            self.assertEqual(bitboard.valid_grow_placement(c), board.valid_grow_placement(c))
+            for h in hotels:
+                self.assertEqual(bool(bitboard.valid_found_placement(c, h)), bool(board.valid_found_placement(c, h)))
+                self.assertEqual(bool(bitboard.valid_merge_placement(c, h)), bool(board.valid_merge_placement(c, h)))
+
+    def test_spread(self):
+        for c in coords:
+            self.assertEqual(spread(1 << coord_index[c]), adjacency_masks[coord_index[c]])
+
+    def test_mask_to_coords(self):
+        self.assertEqual(mask_to_coords(coords_to_mask(['1A', '12C', '12I'])), set(['1A', '12C', '12I']))
+        self.assertEqual(mask_to_coords(0), set())
+
+    def test___getitem__(self):
+        self.assertEquals(self.empty_board['1A'], Empty)
+        self.empty_board.singleton('1A')
+        self.assertEquals(self.empty_board['1A'], NoHotel)
+        self.assertEquals(self.board_2_hotels[W], set(['1A', '2A', '3A']))
+        self.assertEquals(len(self.board_2_hotels[Empty]), len(coords) - 6)
+
+    def test___eq__(self):
+        self.assertEqual(self.board_2_hotels, Board._board_in_play([(W,['1A','2A','3A']), (S,['1C','2C','3C'])]))
+        self.assertNotEqual(self.board_2_hotels, self.board_3_hotels)
+        self.assertNotEqual(self.board_2_hotels, "notaboard")
+
+    def test___copy__(self):
+        b = copy(self.board_2_hotels)
+        self.assertEqual(b, self.board_2_hotels)
+        b.singleton('12I')
+        self.assertNotEqual(b, self.board_2_hotels)
+
+    def test_to_board(self):
+        board = self.board_3_hotels.to_board()
+        self.assertFalse(isinstance(board, BitBoard))
+        self.assertSameBoard(self.board_3_hotels, board)
+
+    def test_query(self):
+        self.assertEquals(self.empty_board.query('1A'),SINGLETON)
+        self.assertEquals(self.board_found_hotel.query('2A'),INVALID)
+        self.assertEquals(self.board_found_hotel.query('2B'),FOUND)
+        self.assertEquals(self.board_1_hotel.query('3B'), GROW)
+        self.assertEquals(self.board_2_hotels.query('2B'), MERGE)
+
+    def test_merge(self):
+        self.board_2_hotels.merge('2B',W)
+        self.assertEquals(self.board_2_hotels[W], set(['1A','2A','3A','1C','2C','2B','3C']))
+        self.assertEquals(self.board_2_hotels.hotels_in_play, set([W]))
+
+    def test_found(self):
+        self.board_found_hotel.found('1A',S)
+        self.assertEqual(self.board_found_hotel[S], set(['1A', '2A']))
+
+    def test_to_bytes(self):
+        for board in [self.empty_board, self.board_2_hotels, self.board_3_hotels, self.board_found_hotel]:
+            self.assertEqual(board.to_bytes(), board.to_board().to_bytes())
+            self.assertEqual(BitBoard.from_bytes(board.to_bytes()), board)
+            self.assertSameBoard(BitBoard.from_bytes(board.to_board().to_bytes()), board.to_board())
+        self.assertRaises(ValueError, BitBoard.from_bytes, '\xff' * BOARD_BYTES)
+
+    def test_same_as_board_through_random_games(self):
+        rand = Random(6515)
+        for _ in range(2):
+            board, bitboard = Board(), BitBoard()
+            for n, tile in enumerate(rand.sample(coords, 80)):
+                self.assertEqual(bitboard.board, board.board)
+                if n % 20 == 0:
+                    self.assertSameBoard(bitboard, board)
+                move = board.query(tile)
+                if move == SINGLETON:
+                    board.singleton(tile); bitboard.singleton(tile)
+                elif move == FOUND:
+                    hotel = rand.choice(sorted(board.hotels_not_in_play))
+                    board.found(tile, hotel); bitboard.found(tile, hotel)
+                elif move == GROW:
+                    board.grow(tile); bitboard.grow(tile)
+                elif move == MERGE:
+                    hotel = rand.choice(board.acquirers(tile))
+                    board.merge(tile, hotel); bitboard.merge(tile, hotel)
+            self.assertSameBoard(bitboard, board)
+
+    def test_drop_in_for_game_state(self):
+        from state import GameState
+        from gametree import GameTree
+        gs = GameState("abc")
+        gs.board = BitBoard()
+        gt = GameTree(gs)
+        for _ in range(10):
+            tile, hotel, sellbacks, shares, next_tile = gt.playable_moves().next()
+            gt = gt.apply(tile, hotel, sellbacks, shares, next_tile)
+            self.assertTrue(isinstance(gt.game_state.board, BitBoard))
+        self.assertEqual(len(gt.game_state.board.board), 10)
+
+
+if __name__ == '__main__':
+    ut.main()
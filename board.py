@@ -2,6 +2,38 @@ from copy import copy, deepcopy
 from basics import *
 from Lib.decontractors import Precondition, Postcondition
 import unittest as ut
+from random import Random
+
+# random keys for every (coord, square) of a non Empty square, a Board's hash
+#   is the xor of the keys of its squares. 63 bits keeps them plain ints
+_zobrist = Random(108)
+square_keys = dict([((c, s), _zobrist.getrandbits(63)) for c in coords for s in hotels + [NoHotel]])
+
+def squares_key(square, tiles):
+    """ the xor of the keys for putting square on each of the tiles """
+    key = 0
+    for tile in tiles:
+        key ^= square_keys.get((tile, square), 0)
+    return key
+
+# Board.to_bytes packs each square into 4 bits, two coords (in coords order)
+#   to a byte, low bits first. Code 0 is Empty, hotels are 1..7 in hotels
+#   order and NoHotel is 8
+code_squares = [Empty] + hotels + [NoHotel]
+square_codes = dict([(s, i) for i, s in enumerate(code_squares)])
+BOARD_BYTES = len(coords) // 2
+
+# the pair of squares each byte of Board.to_bytes stands for, None if invalid
+byte_squares = [(code_squares[b & 15], code_squares[b >> 4])
+                if b & 15 < len(code_squares) and b >> 4 < len(code_squares) else None
+                for b in range(256)]
+
+# the coords whose movetype can change when the square at a coord changes:
+#   a query looks at the tile's neighbors, and at the neighbors of a NoHotel
+#   neighbor to see if it would found a hotel
+query_neighborhoods = dict([(c, frozenset([c]).union(adjacencies[c],
+                                                     *[adjacencies[a] for a in adjacencies[c]]))
+                            for c in coords])
 
 class Board:
     """
@@ -20,27 +52,57 @@ class Board:
                      found
     """
     def __init__(self):
-        """ initializes an empty board """
+        """
+        initializes an empty board
+
+        Fields:
+            board               - dict from coords to squares, for the tiles on this board
+            _square_tiles       - dict from the hotels and NoHotel to the coords with
+                                  that square: a set this board alone writes to, frozen
+                                  once it is read, copied or forked (see _frozen) and
+                                  thawed by the next write
+            _empty              - frozenset of the Empty coords, the ones not in board,
+                                  or None until it is asked for after a write
+            _hotels_in_play     - frozenset of the hotels with tiles on this board
+            _hotels_not_in_play - frozenset of the other hotels
+            _movetypes          - dict from coords to their last query result,
+                                  forgotten when a nearby square changes
+            _all_moves          - the last query_all result, or None once the board changes
+            _zobrist            - the xor of square_keys for the tiles on this board
+            _shared             - whether board, _square_tiles and _movetypes may
+                                  also belong to a fork of this board
+
+        The fields are kept in sync by the board modifying commands; don't
+        write to board directly.
+        """
         self.board = {}
-
-
-    @Precondition(lambda: item in coords or item in squares, globals=globals())
-    @Postcondition(lambda: __return__ in squares or all([c in coords for c in __return__]), globals=globals())
+        self._square_tiles = dict([(s, frozenset()) for s in squares if s is not Empty])
+        self._empty = None
+        self._hotels_in_play = frozenset()
+        self._hotels_not_in_play = frozenset(hotels)
+        self._movetypes = {}
+        self._all_moves = None
+        self._zobrist = 0
+        self._shared = False
+
+    @Precondition(lambda: item in coord_set or item in squares, globals=globals())
+    @Postcondition(lambda: __return__ in squares or all([c in coord_set for c in __return__]), globals=globals())
     def __getitem__(self, item):
         """
         Reference lookup into boards.
         Arguments : item - coord|square
         Returns   : square if item is a coord
-                    set([coord]) if item is a square
+                    frozenset([coord]) if item is a square
 
         """
-        if item in coords:
-            if item in self.board:
-                return self.board[item]
-            else:
-                return Empty
+        if item in coord_set:
+            return self.board.get(item, Empty)
+        elif item is Empty:
+            if self._empty is None:
+                self._empty = coord_set.difference(self.board)
+            return self._empty
         else:
-            return set([coord for coord in coords if self[coord] == item])
+            return self._frozen(item)
 
     def __eq__(self, other):
         """
@@ -50,9 +112,21 @@ class Board:
 
         """
         if isinstance(other, Board):
-            return self.board == other.board
+            return self._zobrist == other._zobrist and self.board == other.board
         return False
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        """
+        Zobrist hash of this board, kept up to date by the modifying commands.
+        Boards are mutable: don't change one while it is used as a key.
+        Returns   : int
+
+        """
+        return self._zobrist
+
     def __iter__(self):
         """ Returns an iterator for this board's (coord, square) pairs ordered by coord. """
         return iter(sorted(((coord, self[coord]) for coord in coords), key=lambda (c, s): tile_sortkey(c)))
@@ -73,7 +147,7 @@ class Board:
         b = Board()
         for s, cs in square_coords:
             for c in cs:
-                b.board[c] = s
+                b._set_square(c, s)
         return b
 
     def _to_board_in_play(self):
@@ -83,13 +157,86 @@ class Board:
         return board_data
 
     def __copy__(self):
+        self._freeze()
         b = Board()
         b.board = copy(self.board)
+        b._square_tiles = copy(self._square_tiles)
+        b._empty = self._empty
+        b._hotels_in_play = self._hotels_in_play
+        b._hotels_not_in_play = self._hotels_not_in_play
+        b._movetypes = copy(self._movetypes)
+        b._all_moves = self._all_moves
+        b._zobrist = self._zobrist
         return b
 
     def __deepcopy__(self, _):
         return self.__copy__()
 
+    def to_bytes(self):
+        """
+        Pack this board into BOARD_BYTES bytes, see square_codes
+        Returns   : str
+
+        """
+        get = self.board.get
+        codes = [square_codes[get(c, Empty)] for c in coords]
+        return str(bytearray([codes[i] | codes[i + 1] << 4 for i in xrange(0, len(coords), 2)]))
+
+    @staticmethod
+    @Postcondition(lambda: isinstance(__return__, Board), globals=globals())
+    def from_bytes(data):
+        """
+        Unpack a board packed by to_bytes, raising a ValueError on bad data
+        Arguments : data - str of BOARD_BYTES bytes
+        Returns   : Board
+
+        """
+        if len(data) != BOARD_BYTES:
+            raise ValueError("a board is {0} bytes, got {1}".format(BOARD_BYTES, len(data)))
+        board = {}
+        tiles = dict([(s, []) for s in squares])
+        i = 0
+        for byte in bytearray(data):
+            pair = byte_squares[byte]
+            if pair is None:
+                raise ValueError("bad square code in byte {0}".format(i // 2))
+            for square in pair:
+                tiles[square].append(coords[i])
+                if square is not Empty:
+                    board[coords[i]] = square
+                i += 1
+
+        b = Board()
+        b.board = board
+        b._square_tiles = dict([(s, frozenset(cs)) for s, cs in tiles.items() if s is not Empty])
+        b._hotels_in_play = frozenset([h for h in hotels if tiles[h]])
+        b._hotels_not_in_play = frozenset(hotels) - b._hotels_in_play
+        for s in hotels + [NoHotel]:
+            b._zobrist ^= squares_key(s, tiles[s])
+        return b
+
+    def fork(self):
+        """
+        Copy this board for applying a move to, without copying its squares:
+        the copy shares them with this board until one of the two is changed,
+        which then copies them first (see _own). Unlike copy, the result must
+        only be changed through the board modifying commands.
+        Returns   : Board
+
+        """
+        self._freeze()
+        b = Board()
+        b.board = self.board
+        b._square_tiles = self._square_tiles
+        b._empty = self._empty
+        b._hotels_in_play = self._hotels_in_play
+        b._hotels_not_in_play = self._hotels_not_in_play
+        b._movetypes = self._movetypes
+        b._all_moves = self._all_moves
+        b._zobrist = self._zobrist
+        self._shared = b._shared = True
+        return b
+
     def __str__(self):
         inv_map = {}
         for k, v in self.board.iteritems():
@@ -100,7 +247,7 @@ class Board:
     ###########################################################################
     ### Board Query Functions: ################################################
     ###########################################################################
-    @Precondition(lambda: coord in coords, globals=globals())
+    @Precondition(lambda: coord in coord_set, globals=globals())
     def is_space_free(self, coord):
         """
         Is the space at the given coordinate currently unused on this board
@@ -115,29 +262,28 @@ class Board:
     def hotels_in_play(self):
         """
         Get the hotels that are currently placed on this board
-        Returns   : set([hotel])
+        Returns   : frozenset([hotel])
 
         """
-        return set([s for s in self.board.values() if s in hotels])
+        return self._hotels_in_play
 
     @property
     def hotels_not_in_play(self):
         """
         Get the hotels not currently placed on this board
-        Returns   : set([hotel])
+        Returns   : frozenset([hotel])
 
         """
-        return set(hotels) - self.hotels_in_play
+        return self._hotels_not_in_play
 
     @property
     def tiles_for_hotels(self):
         """
         Get the hotels currently placed on this board, mapped to the tiles currently associated with those hotels
-        Returns   : dict([(hotel, set([tile])...])
+        Returns   : dict([(hotel, frozenset([tile])...])
 
         """
-        hip = self.hotels_in_play
-        return dict([(h, set([c for c, s in self.board.items() if s == h])) for h in hip])
+        return dict([(h, self._frozen(h)) for h in self._hotels_in_play])
 
     @property
     def hotels_with_sizes(self):
@@ -150,7 +296,7 @@ class Board:
         hotels_with_sizes.sort(key=lambda hs: -hs[1])  # sort from biggest to smallest
         return hotels_with_sizes
 
-    @Precondition(lambda: coord in coords, globals=globals())
+    @Precondition(lambda: coord in coord_set, globals=globals())
     def adjacent_coords(self, coord):
         """
         Get the set of coords one unit away from the given coord
@@ -160,7 +306,7 @@ class Board:
         """
         return adjacencies[coord]
 
-    @Precondition(lambda: coord in coords, globals=globals())
+    @Precondition(lambda: coord in coord_set, globals=globals())
     def adjacent_squares(self, coord):
         """
         Get the set of squares one unit away from the given coord.
@@ -170,7 +316,7 @@ class Board:
         """
         return set([self[c] for c in self.adjacent_coords(coord)])
 
-    @Precondition(lambda: coord in coords, globals=globals())
+    @Precondition(lambda: coord in coord_set, globals=globals())
     def adjacent_hotels(self, coord):
         """
         Get the set of all hotels adjacent to given coord
@@ -180,7 +326,7 @@ class Board:
         """
         return set([s for s in self.adjacent_squares(coord) if s in hotels])
 
-    @Precondition(lambda: coord in coords, globals=globals())
+    @Precondition(lambda: coord in coord_set, globals=globals())
     def adjacent_nohotel_count(self, coord):
         """
         Count the number of NoHotel squares around the given coord
@@ -197,7 +343,7 @@ class Board:
         Arguments : hotel
         Returns   : int
         """
-        return len([s for _, s in self.board.items() if s == hotel])
+        return len(self._square_tiles[hotel])
 
     @Precondition(lambda: hotel in hotels, globals=globals())
     def stock_price(self, hotel):
@@ -209,7 +355,43 @@ class Board:
         Returns:
             int or None - the cost of None if impossible to buy.
         """
-        return calculate_stock_price(hotel, self.hotel_size(hotel))
+        return price_table[hotel_index[hotel]][len(self._square_tiles[hotel])]
+
+    def price_vector(self):
+        """
+        Get the stock prices of all the hotels on this board at once
+        Returns : [int or None], indexed by hotel_index
+
+        """
+        tiles = self._square_tiles
+        return [row[len(tiles[h])] for h, row in zip(hotels, price_table)]
+
+    @Precondition(lambda: tile in coord_set and (hotel in hotels or hotel is None), globals=globals())
+    def price_vector_after(self, tile, hotel=None):
+        """
+        Get the stock prices of all the hotels on this board as they would be
+        after the given tile move, without making it
+        Arguments : tile
+                    hotel - the hotel founded or acquiring, or None
+        Returns   : [int or None], indexed by hotel_index
+
+        """
+        prices = self.price_vector()
+        movetypes, adjacent = self.query_all()
+        i = coord_index[tile]
+        movetype = movetypes[i]
+        if movetype == FOUND:
+            size = 1 + len([c for c in adjacencies[tile] if self.board.get(c) == NoHotel])
+        elif movetype == GROW or movetype == MERGE:
+            # the acquirees end up empty, the acquirer (or grown hotel) with their tiles
+            size = 1 + sum([s for _, s in adjacent[i]])
+            hotel = hotel if movetype == MERGE else adjacent[i][0][0]
+            for h, _ in adjacent[i]:
+                prices[hotel_index[h]] = price_table[hotel_index[h]][0]
+        else:
+            return prices
+        prices[hotel_index[hotel]] = price_table[hotel_index[hotel]][size]
+        return prices
 
     @Precondition(lambda: hotel in hotels, globals=globals())
     def is_hotel_safe(self, hotel):
@@ -221,7 +403,7 @@ class Board:
         """
         return self.hotel_size(hotel) >= HOTEL_SAFE_SIZE
 
-    @Precondition(lambda: tile in coords, globals=globals())
+    @Precondition(lambda: tile in coord_set, globals=globals())
 
     def acquirers(self, tile):
         """ returns a list of the largest hotels adjacent to this coord """
@@ -237,7 +419,7 @@ class Board:
         """ returns the list of hotels that would be acquired in this tile merger """
         return [h for h in self.adjacent_hotels(tile) if h != hotel]
 
-    @Precondition(lambda: tile in coords, globals=globals())
+    @Precondition(lambda: tile in coord_set, globals=globals())
     def query(self, tile):
         """
         Ask this board what can be done what effect placing the given tile will have
@@ -246,6 +428,59 @@ class Board:
         Returns:
             movetype
         """
+        movetype = self._movetypes.get(tile)
+        if movetype is None:
+            movetype = self._movetypes[tile] = self._classify(tile)
+        return movetype
+
+    def query_all(self):
+        """
+        Ask this board what placing each of its tiles would do, all in one pass
+        over the board rather than a query per tile. The result is kept until
+        the board changes, so don't modify it.
+
+        Returns:
+            movetypes - [movetype] indexed by coord_index
+            adjacent  - dict(coord_index => [(hotel, size)]) for GROW and MERGE tiles,
+                        the hotels next to the tile ordered from biggest to smallest;
+                        the acquirers of a MERGE are the ones with the first size
+        """
+        if self._all_moves is None:
+            self._all_moves = self._classify_all()
+        return self._all_moves
+
+    def _classify_all(self):
+        """ query_all without the cache """
+        board = self.board
+        tile_squares = [board.get(c, Empty) for c in coords]
+        sizes = dict([(h, len(self._square_tiles[h])) for h in hotels])
+        can_found = bool(self._hotels_not_in_play)
+
+        movetypes = [INVALID] * len(coords)
+        adjacent = {}
+        for i, square in enumerate(tile_squares):
+            if square is not Empty:
+                continue
+
+            adj_squares = [tile_squares[n] for n in adjacency_indices[i]]
+            adj_hotels = set([s for s in adj_squares if s is not Empty and s != NoHotel])
+            if not adj_hotels:
+                # like valid_found_placement, only the first NoHotel neighbor may found
+                movetypes[i] = SINGLETON
+                for n in adjacency_indices[i]:
+                    if tile_squares[n] == NoHotel:
+                        if can_found and all([tile_squares[m] is Empty for m in adjacency_indices[n]]):
+                            movetypes[i] = FOUND
+                        break
+            elif len(adj_hotels) == 1 or \
+                    (NoHotel not in adj_squares and all([sizes[h] < HOTEL_SAFE_SIZE for h in adj_hotels])):
+                movetypes[i] = GROW if len(adj_hotels) == 1 else MERGE
+                adjacent[i] = sorted([(h, sizes[h]) for h in adj_hotels], key=lambda (h, size): -size)
+
+        return movetypes, adjacent
+
+    def _classify(self, tile):
+        """ query without the movetype cache """
         acquirers = self.acquirers(tile)
 
         if not self.is_space_free(tile):
@@ -271,9 +506,7 @@ class Board:
         Arguments : tile
 
         """
-        # assert self.valid_singleton_placement(tile)
-        # tile as coordinate
-        self.board[tile] = NoHotel
+        self._singleton(tile)
 
     @Precondition(lambda: self.valid_found_placement(tile, hotel), globals=globals())
     def found(self, tile, hotel):
@@ -283,10 +516,7 @@ class Board:
                     hotel
 
         """
-        # assert self.valid_found_placement(tile, hotel)
-        self.board[tile] = hotel
-        for c in [c for c in self.adjacent_coords(tile) if self[c] == NoHotel]:
-            self.board[c] = hotel
+        self._found(tile, hotel)
 
     @Precondition(lambda: self.valid_merge_placement(tile, hotel), globals=globals())
     def merge(self, tile, hotel):
@@ -295,11 +525,7 @@ class Board:
         Arguments : tile
                     hotel
         """
-        # assert self.valid_merge_placement(tile, hotel)
-        self.board[tile] = hotel
-        adj_hotels = self.adjacent_hotels(tile)
-        for coord in sum([list(t) for h, t in self.tiles_for_hotels.items() if h in adj_hotels], []):
-            self.board[coord] = hotel
+        self._merge(tile, hotel, self.acquirees(tile, hotel))
 
     @Precondition(lambda: self.valid_grow_placement(tile), globals=globals())
     def grow(self, tile):
@@ -308,15 +534,47 @@ class Board:
         Arguments : tile
 
         """
-        # assert self.valid_grow_placement(tile)
         # this seems wrong, we should also link any adjacent, unaffiliated tiles
         #   with the hotel
-        self.board[tile] = list(self.adjacent_hotels(tile))[0]
+        self._grow(tile, list(self.adjacent_hotels(tile))[0])
+
+    def restore(self, squares):
+        """
+        Undo board modifying commands by putting back the squares they changed
+        Arguments : squares - [(coord, square)], the squares before the commands
+
+        """
+        self._own()
+        sizes = [len(self._square_tiles[h]) for h in hotels]
+        could_found = bool(self._hotels_not_in_play)
+
+        moved = {}
+        for coord, square in squares:
+            moved.setdefault((self.board.get(coord, Empty), square), []).append(coord)
+            if square == Empty:
+                self.board.pop(coord, None)
+            else:
+                self.board[coord] = square
+        for (old, new), tiles in moved.items():
+            self._remove_tiles(old, tiles)
+            self._add_tiles(new, tiles)
+
+        self._hotels_in_play = frozenset([h for h in hotels if self._square_tiles[h]])
+        self._hotels_not_in_play = frozenset(hotels) - self._hotels_in_play
+        if could_found != bool(self._hotels_not_in_play):
+            self._movetypes.clear()
+        self._forget_movetypes([coord for coord, _ in squares])
+        # tiles next to a hotel that stopped (or started) being safe
+        for h, size in zip(hotels, sizes):
+            if (size >= HOTEL_SAFE_SIZE) != (self.hotel_size(h) >= HOTEL_SAFE_SIZE):
+                for coord in self._square_tiles[h]:
+                    for c in adjacencies[coord]:
+                        self._movetypes.pop(c, None)
 
     ###########################################################################
     ### Tile Placement Assertions: ############################################
     ###########################################################################
-    @Precondition(lambda: tile in coords, globals=globals())
+    @Precondition(lambda: tile in coord_set, globals=globals())
     def valid_singleton_placement(self, tile):
         """
         Can the given tile be placed to make a singleton move on this board?
@@ -328,9 +586,9 @@ class Board:
         hotels_not_in_play = self.hotels_not_in_play
         return self.is_space_free(tile) and \
             all([s == Empty or s == NoHotel for s in adj_squares]) and \
-            not (hotels_not_in_play and self.valid_found_placement(tile, self.hotels_not_in_play.pop()))
+            not (hotels_not_in_play and self.valid_found_placement(tile, iter(hotels_not_in_play).next()))
 
-    @Precondition(lambda: tile in coords, globals=globals())
+    @Precondition(lambda: tile in coord_set, globals=globals())
     @Precondition(lambda: hotel in hotels or hotel is None, globals=globals())
     def valid_found_placement(self, tile, hotel):
         """
@@ -350,7 +608,7 @@ class Board:
             len(adj_nohot) >= 1 and \
             all([s == Empty for s in self.adjacent_squares(adj_nohot[0])])
 
-    @Precondition(lambda: tile in coords, globals=globals())
+    @Precondition(lambda: tile in coord_set, globals=globals())
     @Precondition(lambda: hotel in hotels or hotel is None, globals=globals())
     def valid_merge_placement(self, tile, hotel):
         """
@@ -368,7 +626,7 @@ class Board:
             all([not self.is_hotel_safe(h) for h in adj_hot]) and \
             all([not s == NoHotel for s in self.adjacent_squares(tile)])
 
-    @Precondition(lambda: tile in coords, globals=globals())
+    @Precondition(lambda: tile in coord_set, globals=globals())
     def valid_grow_placement(self, tile):
         """
         Can the given tile be placed to grow the adjacent hotel on this board
@@ -382,6 +640,145 @@ class Board:
     ###########################################################################
     ### Internal Function: ####################################################
     ###########################################################################
+    def _set_square(self, coord, square):
+        """
+        Put the given square at coord, whatever was there before, keeping the
+        square indices in sync. Only for building boards, the board modifying
+        commands above keep the indices up to date themselves.
+        Arguments : coord
+                    square
+
+        """
+        self._own()
+        self._remove_tiles(self.board.get(coord, Empty), [coord])
+        self._add_tiles(square, [coord])
+
+        if square == Empty:
+            self.board.pop(coord, None)
+        else:
+            self.board[coord] = square
+
+        self._hotels_in_play = frozenset([h for h in hotels if self._square_tiles[h]])
+        self._hotels_not_in_play = frozenset(hotels) - self._hotels_in_play
+        self._movetypes.clear()
+        self._all_moves = None
+
+    # The board modifying commands without their checks, for callers that know
+    # the move is legal, e.g. from query_all: searches playing many turns.
+    def _singleton(self, tile):
+        """ singleton, unchecked """
+        self._own()
+        self.board[tile] = NoHotel
+        self._add_tiles(NoHotel, [tile])
+        self._forget_movetypes([tile])
+
+    def _found(self, tile, hotel):
+        """ found, unchecked """
+        self._own()
+        adj_nohot = [c for c in adjacencies[tile] if self.board.get(c) == NoHotel]
+        self.board[tile] = hotel
+        for c in adj_nohot:
+            self.board[c] = hotel
+        self._remove_tiles(NoHotel, adj_nohot)
+        self._add_tiles(hotel, [tile] + adj_nohot)
+        self._hotels_in_play = self._hotels_in_play | set([hotel])
+        self._hotels_not_in_play = self._hotels_not_in_play - set([hotel])
+        if self._hotels_not_in_play:
+            self._forget_movetypes([tile] + adj_nohot)
+        else:
+            # nothing left to found, so every FOUND is now a SINGLETON
+            self._movetypes.clear()
+            self._all_moves = None
+
+    def _merge(self, tile, hotel, acquirees):
+        """ merge, unchecked, with the given acquirees (see acquirees) """
+        self._own()
+        acquirer_size = len(self._square_tiles[hotel])
+        relabeled = [tile]
+        self.board[tile] = hotel
+        for acquiree in acquirees:
+            acquired = list(self._square_tiles[acquiree])
+            for coord in acquired:
+                self.board[coord] = hotel
+            relabeled.extend(acquired)
+            self._remove_tiles(acquiree, acquired)
+        self._add_tiles(hotel, relabeled)
+        if not self._hotels_not_in_play:
+            # hotels can be founded again, so SINGLETONs may now be FOUNDs
+            self._movetypes.clear()
+        self._hotels_in_play = self._hotels_in_play - set(acquirees)
+        self._hotels_not_in_play = self._hotels_not_in_play | set(acquirees)
+        self._forget_movetypes(relabeled, hotel, acquirer_size)
+
+    def _grow(self, tile, hotel):
+        """ grow, unchecked, given the adjacent hotel """
+        self._own()
+        grown_size = len(self._square_tiles[hotel])
+        self.board[tile] = hotel
+        self._add_tiles(hotel, [tile])
+        self._forget_movetypes([tile], hotel, grown_size)
+
+    def _own(self):
+        """ stop sharing this board's squares with its forks, before changing them """
+        if self._shared:
+            self.board = copy(self.board)
+            self._square_tiles = copy(self._square_tiles)
+            self._movetypes = copy(self._movetypes)
+            self._shared = False
+
+    def _forget_movetypes(self, changed, grown_hotel=None, old_size=0):
+        """
+        Drop the cached movetypes that changing the squares at the given coords
+        could have affected. If grown_hotel was old_size big before the change
+        and is safe now, tiles next to it may no longer be mergers either.
+        Arguments : changed - [coord]
+                    grown_hotel - hotel or None
+                    old_size - int
+
+        """
+        self._all_moves = None
+        movetypes = self._movetypes
+        for coord in changed:
+            for c in query_neighborhoods[coord]:
+                movetypes.pop(c, None)
+
+        if grown_hotel is not None and old_size < HOTEL_SAFE_SIZE <= len(self._square_tiles[grown_hotel]):
+            for coord in self._square_tiles[grown_hotel]:
+                for c in adjacencies[coord]:
+                    movetypes.pop(c, None)
+
+    def _add_tiles(self, square, tiles):
+        """ index (and hash) the given coords under square, unless it is Empty """
+        if square is not Empty:
+            self._zobrist ^= squares_key(square, tiles)
+            self._thawed(square).update(tiles)
+            self._empty = None
+
+    def _remove_tiles(self, square, tiles):
+        """ stop indexing (and hashing) the given coords under square, unless it is Empty """
+        if square is not Empty:
+            self._zobrist ^= squares_key(square, tiles)
+            self._thawed(square).difference_update(tiles)
+            self._empty = None
+
+    def _thawed(self, square):
+        """ the set of coords with the given square, to write to in place """
+        tiles = self._square_tiles[square]
+        if type(tiles) is not set:
+            tiles = self._square_tiles[square] = set(tiles)
+        return tiles
+
+    def _frozen(self, square):
+        """ the frozenset of coords with the given square, to hand out """
+        tiles = self._square_tiles[square]
+        if type(tiles) is set:
+            tiles = self._square_tiles[square] = frozenset(tiles)
+        return tiles
+
+    def _freeze(self):
+        """ freeze the coords of every square, before sharing them with a copy or fork """
+        for square in self._square_tiles:
+            self._frozen(square)
 
 
 class TestBoard(ut.TestCase):
@@ -515,6 +912,27 @@ class TestBoard(ut.TestCase):
 
         self.assertEquals(self.board_3_hotels.hotel_size(F), 2)
 
+    def test_price_vector(self):
+        for board in [self.empty_board, self.board_3_hotels, self.board_sackson_safe]:
+            self.assertEquals(board.price_vector(),
+                              [calculate_stock_price(h, board.hotel_size(h)) for h in hotels])
+            self.assertEquals(board.price_vector(), [board.stock_price(h) for h in hotels])
+
+    def test_price_vector_after(self):
+        board = Board._board_in_play([(A, ['1A', '2A']), (S, ['4A', '5A', '6A']), (NoHotel, ['1C', '3D'])])
+        moves = [('3A', S), ('3A', A), ('7A', None), ('1B', None), ('2C', W), ('9I', None)]
+        for tile, hotel in moves:
+            placed = copy(board)
+            if hotel in placed.hotels_not_in_play:
+                placed.found(tile, hotel)
+            elif hotel:
+                placed.merge(tile, hotel)
+            elif placed.adjacent_hotels(tile):
+                placed.grow(tile)
+            else:
+                placed.singleton(tile)
+            self.assertEquals(board.price_vector_after(tile, hotel), placed.price_vector())
+
     def test_is_hotel_safe(self):
         self.assertFalse(self.empty_board.is_hotel_safe(F))
 
@@ -556,6 +974,204 @@ class TestBoard(ut.TestCase):
 
         self.assertEquals(self.board_1_hotel.hotel_size(A), self.grow_1_hotel.hotel_size(A))
 
+    def test_hotel_indices_follow_commands(self):
+        b = self.board_found_hotel
+        b.found('1A', S)
+        b.singleton('4A')
+        b.found('5A', W)
+        b.grow('1B')
+        b.merge('3A', S)
+        self.assertEqual(b.tiles_for_hotels, {S: set(['1A', '2A', '1B', '3A', '4A', '5A'])})
+        self.assertEqual(b.hotel_size(S), 6)
+        self.assertEqual(b.hotel_size(W), 0)
+        self.assertEqual(b.hotels_in_play, set([S]))
+        self.assertEqual(b.hotels_not_in_play, set(hotels) - set([S]))
+
+    def test_square_index_follows_commands(self):
+        b = self.board_found_hotel
+        b.singleton('4A')
+        self.assertEqual(b[NoHotel], set(['2A', '4A']))
+        b.found('1A', S)
+        self.assertEqual(b[NoHotel], set(['4A']))
+        self.assertEqual(b[Empty], coord_set - set(['1A', '2A', '4A']))
+        # placing a tile doesn't touch an index of the empty squares
+        self.assertFalse(Empty in b._square_tiles)
+        for square in squares:
+            self.assertEqual(b[square], set([c for c in coords if b[c] == square]))
+
+        # the empty squares are worked out once per change
+        empty = b[Empty]
+        self.assertTrue(b[Empty] is empty)
+        self.assertTrue(copy(b)[Empty] is empty)
+        b.grow('1B')
+        self.assertEqual(b[Empty], empty - set(['1B']))
+        b.restore([('1B', Empty)])
+        self.assertEqual(b[Empty], empty)
+
+    def test_query_cache_follows_random_games(self):
+        rand = Random(6515)
+        for _ in range(2):
+            b = Board()
+            for n, tile in enumerate(rand.sample(coords, 100)):
+                if n % 10 == 0:
+                    for c in coords:
+                        self.assertEqual(b.query(c), b._classify(c))
+                move = b.query(tile)
+                if move == SINGLETON:
+                    b.singleton(tile)
+                elif move == FOUND:
+                    b.found(tile, rand.choice(sorted(b.hotels_not_in_play)))
+                elif move == GROW:
+                    b.grow(tile)
+                elif move == MERGE:
+                    b.merge(tile, rand.choice(b.acquirers(tile)))
+            for c in coords:
+                self.assertEqual(b.query(c), b._classify(c))
+            rebuilt = 0
+            for c, square in b.board.items():
+                rebuilt ^= square_keys[(c, square)]
+            self.assertEqual(hash(b), rebuilt)
+
+    def test_query_all(self):
+        movetypes, adjacent = self.board_2_hotels.query_all()
+        self.assertEqual(movetypes[coord_index['2B']], MERGE)
+        self.assertEqual(sorted(adjacent[coord_index['2B']]), [(S, 3), (W, 3)])
+        self.assertEqual(movetypes[coord_index['4A']], GROW)
+        self.assertEqual(adjacent[coord_index['4A']], [(W, 3)])
+        self.assertEqual(movetypes[coord_index['1A']], INVALID)
+
+        self.board_2_hotels.grow('4A')
+        movetypes, adjacent = self.board_2_hotels.query_all()
+        self.assertEqual(adjacent[coord_index['2B']], [(W, 4), (S, 3)])
+
+    def test_query_all_follows_random_games(self):
+        rand = Random(1313)
+        for _ in range(2):
+            b = Board()
+            for n, tile in enumerate(rand.sample(coords, 100)):
+                if n % 10 == 0:
+                    movetypes, adjacent = b.query_all()
+                    for i, c in enumerate(coords):
+                        self.assertEqual(movetypes[i], b._classify(c))
+                        if movetypes[i] == MERGE:
+                            self.assertEqual(sorted([h for h, s in adjacent[i] if s == adjacent[i][0][1]]),
+                                             sorted(b.acquirers(c)))
+                move = b.query(tile)
+                if move == SINGLETON:
+                    b.singleton(tile)
+                elif move == FOUND:
+                    b.found(tile, rand.choice(sorted(b.hotels_not_in_play)))
+                elif move == GROW:
+                    b.grow(tile)
+                elif move == MERGE:
+                    b.merge(tile, rand.choice(b.acquirers(tile)))
+
+    def test_query_cache_sees_hotel_become_safe(self):
+        b = Board._board_in_play([(S, [c for i, c in enumerate(coords) if i < HOTEL_SAFE_SIZE - 1]),
+                                  (W, ['3C', '4C'])])
+        self.assertEqual(b.query('3B'), MERGE)
+        b.grow('12A')
+        self.assertTrue(b.is_hotel_safe(S))
+        self.assertEqual(b.query('3B'), INVALID)
+
+    def test_query_cache_sees_last_hotel_founded(self):
+        b = Board._board_in_play([(A, ["1A", "2A"]), (C, ["4A", "5A"]), (F, ["7A", "8A"]),
+                                  (I, ["10A", "11A"]), (S, ["1C", "2C"]), (T, ["4C", "5C"]),
+                                  (NoHotel, ["5E", "10E"])])
+        self.assertEqual(b.query('6E'), FOUND)
+        b.found('10F', W)
+        self.assertEqual(b.query('6E'), SINGLETON)
+
+    def test___hash__(self):
+        self.board_2_hotels.merge('2B', W)
+        self.assertEqual(hash(self.board_2_hotels), hash(self.board_merged_2_hotels))
+        self.assertNotEqual(hash(self.board_2_hotels), hash(self.board_1_hotel))
+        self.assertEqual(hash(self.empty_board), 0)
+
+        b = Board()
+        b.singleton('1A')
+        b.found('2A', S)
+        self.assertEqual(hash(b), hash(self.board_founded_sackson))
+        self.assertEqual(b, self.board_founded_sackson)
+
+    def test_fork(self):
+        board = self.board_2_hotels
+        fork = board.fork()
+        self.assertEqual(fork, board)
+        self.assertTrue(fork.board is board.board)
+
+        fork.merge('2B', W)
+        self.assertEqual(fork, self.board_merged_2_hotels)
+        self.assertEqual(board, Board._board_in_play([(W, ['1A', '2A', '3A']),
+                                                      (S, ['1C', '2C', '3C'])]))
+        self.assertEqual(board.query('2B'), MERGE)
+        self.assertEqual(fork.query('2B'), INVALID)
+
+        # the original copies its squares before changing them too
+        fork = board.fork()
+        board.grow('4A')
+        self.assertEqual(fork.hotel_size(W), 3)
+        self.assertEqual(fork.query('4A'), GROW)
+        self.assertEqual(board.query('4A'), INVALID)
+
+    def test_to_bytes(self):
+        for board in [self.empty_board, self.board_2_hotels, self.board_with_all_hotels,
+                      self.board_founded_sackson]:
+            data = board.to_bytes()
+            self.assertEqual(len(data), BOARD_BYTES)
+            unpacked = Board.from_bytes(data)
+            self.assertEqual(unpacked, board)
+            self.assertEqual(hash(unpacked), hash(board))
+            self.assertEqual(unpacked.tiles_for_hotels, board.tiles_for_hotels)
+            self.assertEqual(unpacked[Empty], board[Empty])
+            self.assertEqual(unpacked.query_all(), board.query_all())
+        self.assertEqual(self.empty_board.to_bytes(), '\0' * BOARD_BYTES)
+
+        self.assertRaises(ValueError, Board.from_bytes, '\0')
+        self.assertRaises(ValueError, Board.from_bytes, '\xff' * BOARD_BYTES)
+
+    def test_restore(self):
+        board = self.board_2_hotels
+        before = copy(board)
+        board.merge('2B', W)
+        board.restore([('2B', Empty)] + [(c, S) for c in ['1C', '2C', '3C']])
+        self.assertEqual(board, before)
+        self.assertEqual(hash(board), hash(before))
+        self.assertEqual(board.hotels_in_play, set([W, S]))
+        self.assertEqual(board.query('2B'), MERGE)
+
+        # Tower stops being safe again
+        board = Board._board_in_play([(T, ['%dA' % c for c in range(1, 12)]), (S, ['1C', '2C'])])
+        board.grow('12A')
+        self.assertEqual(board.query('1B'), INVALID)
+        board.restore([('12A', Empty)])
+        self.assertEqual(board.query('1B'), MERGE)
+        for c in coords:
+            self.assertEqual(board.query(c), board._classify(c))
+
+    def test_hotel_indices_are_not_shared_by_copies(self):
+        b = copy(self.board_1_hotel)
+        b.grow('4D')
+        self.assertEqual(self.board_1_hotel.hotel_size(A), 3)
+        self.assertEqual(b.hotel_size(A), 4)
+
+    def test_hotel_indices_grow_in_place(self):
+        b = Board._board_in_play([(A, ['1A', '2A'])])
+        tiles = b[A]
+        b.grow('3A')
+        index = b._square_tiles[A]
+        b.grow('4A')
+        self.assertTrue(b._square_tiles[A] is index)
+        self.assertEqual(tiles, frozenset(['1A', '2A']))
+        self.assertTrue(isinstance(b[A], frozenset))
+
+        fork, copied = b.fork(), copy(b)
+        b.grow('5A')
+        fork.grow('1B')
+        self.assertEqual(b[A], frozenset(['1A', '2A', '3A', '4A', '5A']))
+        self.assertEqual(fork[A], frozenset(['1A', '2A', '3A', '4A', '1B']))
+        self.assertEqual(copied[A], frozenset(['1A', '2A', '3A', '4A']))
+
     ###########################################################################
     ### Board modifying tests: ################################################
     ###########################################################################
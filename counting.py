@@ -0,0 +1,168 @@
+from copy import copy
+from basics import *
+from gametree import GameTree, share_moves
+
+################################################################################
+#### Counting the founding/merging depth-n queries #############################
+################################################################################
+# A query (see elt_to_query_state_orders_and_depth) asks in how many ways a
+# hotel can be founded (or hotels merged) within n turns of a game: the number
+# of sequences of up to n turns whose last tile placement founds (merges).
+# Every turn the current player makes any tile move, any sellback (with
+# distinct outcomes, see GameTree.get_sellbacks), each of the query's buy
+# orders they legally can, or nothing if they can't, and is handed any tile
+# left in the deck.
+#
+# MoveCounter counts those sequences on a single game that it plays moves on
+# and takes them back (GameState.apply_move and undo), remembering the count
+# for each state and number of turns left. A handed out tile only matters to
+# the player who draws it, so while they won't move again within the turns
+# left, one draw is counted for all of them. Likewise sellbacks and buys only
+# change money and shares, which the last turn's tile moves don't depend on, so
+# the turn before it plays one of them for all of them. The game is never
+# forked (see GameState.fork), which would make apply_move copy the deck and
+# players it changes, so the buys come from share_moves.
+#
+#   count = MoveCounter(state, orders, FOUND).count(n)
+#   count_to_xml(count)
+
+QUERY_MOVETYPES = {'founding': FOUND, 'merging': MERGE}
+
+class MoveCounter(object):
+    """
+    Counts the ways a tile move of movetype can be made within a number of
+    turns from a game, with the players buying shares in the given orders
+
+    """
+    def __init__(self, state, orders, movetype):
+        self.state = copy(state)
+        self.orders = [list(order) for order in orders]
+        self.movetype = movetype
+        self.memo = {}
+
+    def count(self, turns):
+        """ the number of sequences of at most turns turns ending with a movetype tile move """
+        if turns <= 0:
+            return 0
+        state = self.state
+        key = (hash(state), tuple([p.name for p in state.players]), turns)
+        count = self.memo.get(key)
+        if count is None:
+            count = self.memo[key] = self._count(turns)
+        return count
+
+    def _count(self, turns):
+        """ count without the memo """
+        state = self.state
+        tree = GameTree(state)
+        movetypes, _ = state.board.query_all()
+        tile_moves = tree.get_tile_moves()
+        count = len([tile for tile, _ in tile_moves if movetypes[coord_index[tile]] == self.movetype])
+        if turns == 1 or len(state.tile_deck) == 0:
+            return count
+
+        # the current player draws again after everyone else has played
+        if turns - 1 < len(state.players):
+            draws, weight = [state.tile_deck[0]], len(state.tile_deck)
+        else:
+            draws, weight = list(state.tile_deck), 1
+
+        for tile, hotel in tile_moves:
+            rest = [(sellback, buy) for sellback in tree.get_sellbacks(tile, hotel)
+                    for buy in self._buys(tile, hotel, sellback)]
+            ways = weight
+            if turns == 2:
+                rest, ways = rest[:1], weight * len(rest)
+            for sellback, buy in rest:
+                for next_tile in draws:
+                    record = state.apply_move(tile, hotel, sellback, buy, next_tile)
+                    count += ways * self.count(turns - 1)
+                    state.undo(record)
+        return count
+
+    def _buys(self, tile, hotel, sellback):
+        """ the orders the current player can make after the tile move and sellback """
+        legal = share_moves(self.state, tile, hotel, sellback)
+        return [order for order in self.orders if order in legal] or [[]]
+
+def count_query(query, state, orders, depth):
+    """
+    Answer a founding/merging query, as elt_to_query_state_orders_and_depth
+    parses them
+
+    Arguments:
+        query - 'founding' or 'merging'
+        state - the GameState the query starts from
+        orders - [[hotel]], the buy orders players make
+        depth - the number of turns
+    Returns:
+        the number of ways, see MoveCounter
+    """
+    return MoveCounter(state, orders, QUERY_MOVETYPES[query]).count(depth)
+
+
+import unittest as ut
+from collections import deque
+from board import Board
+from state import GameState, GameStatePlayer
+class TestMoveCounter(ut.TestCase):
+
+    def naive_count(self, tree, orders, movetype, turns):
+        """ the count, going through every child GameTree """
+        if turns == 0:
+            return 0
+        movetypes, _ = tree.game_state.board.query_all()
+        count = 0
+        for tile, hotel in tree.get_tile_moves():
+            count += movetypes[coord_index[tile]] == movetype
+            if turns == 1 or len(tree.game_state.tile_deck) == 0:
+                continue
+            for sellback in tree.get_sellbacks(tile, hotel):
+                legal = tree.get_share_moves(tile, hotel, sellback)
+                for buy in [order for order in orders if order in legal] or [[]]:
+                    for next_tile in list(tree.get_next_tiles()):
+                        child = tree.apply(tile, hotel, sellback, buy, next_tile)
+                        count += self.naive_count(child, orders, movetype, turns - 1)
+        return count
+
+    def small_game(self, deck_size):
+        """ a game a few turns in, whose deck has deck_size tiles left """
+        board = Board._board_in_play([(A, [t4A, t3A]), (S, [t6A, t7A]), (NoHotel, [t1C, t9D])])
+        players = deque([GameStatePlayer._test_gsplayer("joe", 800, {A: 2}, set([t5A, t2C])),
+                         GameStatePlayer._test_gsplayer("sue", 6000, {S: 1}, set([t10D, t8A])),
+                         GameStatePlayer._test_gsplayer("bob", 300, {}, set([t1B, t12I]))])
+        gs = GameState._game_state_in_progress(players, board)
+        for tile in [t for t in list(gs.tile_deck) if t not in [t1D, t9C, t5B, t11I][:deck_size]]:
+            gs.tile_deck.remove(tile)
+        gs.rehash()
+        return gs
+
+    def test_count_is_exact(self):
+        orders = [[A], [S, S], [W]]
+        for deck_size, most_turns in [(2, 4), (3, 3)]:
+            gs = self.small_game(deck_size)
+            for movetype in [FOUND, MERGE]:
+                for turns in range(1, most_turns + 1):
+                    self.assertEqual(MoveCounter(gs, orders, movetype).count(turns),
+                                     self.naive_count(GameTree(gs), orders, movetype, turns))
+
+    def test_count_leaves_state_alone(self):
+        gs = self.small_game(4)
+        counter = MoveCounter(gs, [[A]], FOUND)
+        before = copy(counter.state)
+        counter.count(3)
+        self.assertEqual(counter.state, before)
+        self.assertEqual(hash(counter.state), hash(before))
+        # nothing forked it, so its moves were made and undone in place
+        self.assertFalse(counter.state._shared_deck or counter.state._shared_players)
+        self.assertFalse(counter.state.board._shared)
+
+    def test_count_query(self):
+        gs = GameState("abc")
+        self.assertEqual(count_query('founding', gs, [[]], 1), 0)
+        self.assertEqual(count_query('merging', gs, [[]], 3), 0)
+        # the second player can found any hotel with 7A if the first placed 6A
+        self.assertEqual(count_query('founding', gs, [[]], 2), 90 * 7)
+
+if __name__ == '__main__':
+    ut.main()
@@ -2,6 +2,13 @@ from copy import deepcopy, copy
 from basics import *
 
 from itertools import chain, combinations, product, imap
+from collections import OrderedDict
+from random import Random
+from functools import partial
+from multiprocessing import Pool
+from weakref import ref
+
+from state import GameState
 
 
 ################################################################################
@@ -49,13 +56,291 @@ from itertools import chain, combinations, product, imap
 ################################################################################
 
 
+# memo of legal_buys, forgotten whenever it grows past LEGAL_BUYS_MEMO_SIZE
+LEGAL_BUYS_MEMO_SIZE = 10000
+_legal_buys_memo = {}
+
+def legal_buys(cash, pool, prices):
+    """
+    The buys in ALL_LEGAL_BUYS that GameState.is_valid_buy allows
+
+    Arguments:
+        cash - the current player's money
+        pool - (count) of each hotel's shares left, indexed by hotel_index
+        prices - (price) of each hotel, as Board.price_vector gives them
+    Returns:
+        [[hotel]] - a list the memo shares, so don't change it
+    """
+    key = (cash, pool, prices)
+    buys = _legal_buys_memo.get(key)
+    if buys is None:
+        if len(_legal_buys_memo) >= LEGAL_BUYS_MEMO_SIZE:
+            _legal_buys_memo.clear()
+        buys = _legal_buys_memo[key] = \
+            [buy for buy in ALL_LEGAL_BUYS
+             if not buy or (len(buy) <= pool[hotel_index[buy[0]]] and prices[hotel_index[buy[0]]]
+                            and len(buy) * prices[hotel_index[buy[0]]] <= cash)]
+    return buys
+
+def tile_moves(state):
+    """ GameTree.get_tile_moves for the given state, without building a GameTree """
+    # the board's movetypes pick out the moves is_valid_move allows
+    board = state.board
+    movetypes, adjacent = board.query_all()
+    moves = []
+    for tile in state.current_player.tiles:
+        i = coord_index[tile]
+        movetype = movetypes[i]
+        if movetype == SINGLETON or movetype == GROW:
+            moves.append((tile, None))
+        elif movetype == FOUND:
+            moves.extend([(tile, h) for h in hotels if h in board.hotels_not_in_play])
+        elif movetype == MERGE:
+            adj_hotels = [h for h, _ in adjacent[i]]
+            moves.extend([(tile, h) for h in hotels if h in adj_hotels])
+    return moves
+
+def share_moves(state, tile, hotel, sellback_map):
+    """
+    GameTree.get_share_moves for the given state, worked out from its pool and
+    the prices after the tile move (see Board.price_vector_after) rather than
+    on a fork of it, which would leave the state sharing its deck and players
+    """
+    movetypes, _ = state.board.query_all()
+    pool = [state.shares_map[h] for h in hotels]
+    if movetypes[coord_index[tile]] == FOUND and pool[hotel_index[hotel]] > FOUND_SHARES:
+        # the founder's shares, see GameState.place_a_tile
+        pool[hotel_index[hotel]] -= FOUND_SHARES
+    prices = tuple(state.board.price_vector_after(tile, hotel))
+    return _buys_after_sellbacks(state, pool, prices, sellback_map)
+
+def _buys_after_sellbacks(state, pool, prices, sellback_map):
+    """
+    legal_buys of the current player of state, after its tile move left the
+    pool and prices given and the sellbacks put their shares back in the pool
+    """
+    current = state.current_player
+    cash = current.money
+    sell_prices = state.board.price_vector() if sellback_map else None
+    for name in sellback_map:
+        player = state.player_with_name(name)
+        # selling a hotel back twice sells nothing more, as with sellback
+        for h in set(sellback_map[name]):
+            k = hotel_index[h]
+            count = player._shares[k]
+            pool[k] += count
+            if player is current:
+                cash += sell_prices[k] * count
+    return list(legal_buys(cash, tuple(pool), prices))
+
+def move_key(tile, maybeHotel, sellbacks, shares, next_tile):
+    """ a hashable version of the move tuple playable_moves returns """
+    return (tile, maybeHotel,
+            tuple(sorted([(name, tuple(hs)) for name, hs in sellbacks.items()])),
+            tuple(shares), next_tile)
+
+
+class TableEntry(object):
+    """
+    What a TranspositionTable knows about one state:
+        tree     - the first GameTree looked up for the state
+        children - {move_key=>GameTree} of the moves applied to it so far, shared
+                   by every path to the state
+        values   - {tag=>value} of whatever searches stored for it
+    """
+    __slots__ = ('tree', 'children', 'values')
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.children = {}
+        self.values = {}
+
+
+class TranspositionTable(object):
+    """
+    A bounded memory of GameTree nodes, so that a state reached by different
+    move orders is expanded once. GameTrees made with a table look their
+    children up in it, and searches store their values for a node in it.
+
+    The table holds at most capacity nodes, counting every state and every
+    child stored for one, and forgets the least recently used states first.
+
+    """
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.size = 0
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, tree):
+        return tree.key in self._entries
+
+    def entry(self, tree):
+        """ the TableEntry for the given tree's state, made if there is none """
+        key = tree.key
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            entry = TableEntry(tree)
+            self.size += 1
+        self._entries[key] = entry
+        self._evict()
+        return entry
+
+    def child(self, tree, move):
+        """
+        Get the GameTree for applying move, a playable_moves tuple, to tree.
+        The child is made at most once for tree's state, and left lazy: its
+        own state is only built, and found to be a transposition of another,
+        once it is looked up itself.
+
+        """
+        entry = self.entry(tree)
+        key = move_key(*move)
+        child = entry.children.get(key)
+        if child is not None:
+            self.hits += 1
+            return child
+        self.misses += 1
+        child = entry.children[key] = tree.apply(*move, lazy=True)
+        self.size += 1
+        self._evict()
+        return child
+
+    def get_value(self, tree, tag, default=None):
+        """ the value a search stored for the given tree's state under tag """
+        entry = self._entries.get(tree.key)
+        if entry is None or tag not in entry.values:
+            return default
+        return self.entry(tree).values[tag]
+
+    def put_value(self, tree, tag, value):
+        """ store a search's value for the given tree's state under tag """
+        self.entry(tree).values[tag] = value
+
+    def clear(self):
+        """ forget every state """
+        self._entries.clear()
+        self.size = 0
+
+    def _evict(self):
+        """ forget the least recently used states until this is within capacity """
+        while self.size > self.capacity and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= 1 + len(entry.children)
+
+
+# the most states of lazy GameTrees kept built at once by each StateCache
+LAZY_STATES = 10000
+
+class StateCache(object):
+    """
+    The lazy GameTrees applied from one root GameTree whose states are built,
+    at most capacity of them. Past that the least recently used trees drop
+    their states, to build them again from their parents if they are used
+    again (see GameTree._drop_state). The trees are held weakly, so a tree no
+    one else refers to goes away along with its state.
+
+    """
+    def __init__(self, capacity=LAZY_STATES):
+        self.capacity = capacity
+        self.builds = 0
+        self._trees = OrderedDict()
+
+    def __len__(self):
+        return len(self._trees)
+
+    def add(self, tree):
+        """ keep the state the given tree just built """
+        self.builds += 1
+        key = id(tree)
+        self._trees[key] = ref(tree, lambda _: self._trees.pop(key, None))
+        while len(self._trees) > self.capacity:
+            _, dropped = self._trees.popitem(last=False)
+            dropped = dropped()
+            if dropped is not None:
+                dropped._drop_state()
+
+    def touch(self, tree):
+        """ mark the given tree's state as the most recently used """
+        self._trees[id(tree)] = self._trees.pop(id(tree))
+
+    def clear(self):
+        """ drop every state, say when memory runs low """
+        for tree in [r() for r in self._trees.values()]:
+            if tree is not None:
+                tree._drop_state()
+        self._trees.clear()
+
+
 class GameTree:
     """ This class represents a node in an Acquire game tree. Contains methods to
     find possible moves and use them to move to other nodes in the tree.
 
+    A GameTree made with a TranspositionTable shares it with its children, and
+    playable_moves(return_applied=True) gets them from it.
+
+    A lazy GameTree (see apply) holds just its parent and the move made from
+    it, and builds its game_state when it is first used. Built states are kept
+    in states, the StateCache shared by every tree applied from the same root,
+    which may drop them again.
+
     """
-    def __init__(self, game_state):
-        self.game_state = game_state
+    def __init__(self, game_state, table=None, parent=None, move=None, states=None):
+        self._game_state = game_state
+        self.table = table
+        self.parent = parent
+        self.move = move
+        self.states = states if states is not None else StateCache()
+        self._key = None
+        self._midturns = {}
+
+    @property
+    def game_state(self):
+        """ this tree's GameState, built from its parent's if it is lazy """
+        state = self._game_state
+        if self.parent is None:
+            return state
+        if state is None:
+            state = self._game_state = GameTree._applied(self.parent.game_state, self.move)
+            self._key = GameTree._state_key(state)
+            self.states.add(self)
+        else:
+            self.states.touch(self)
+        return state
+
+    def _drop_state(self):
+        """
+        forget this lazy tree's state, and what was worked out from it. If the
+        state was changed since it was built (through the GameState commands,
+        or followed by rehash), building it again would lose the change, so
+        this tree keeps it instead and stops being lazy.
+
+        """
+        if GameTree._state_key(self._game_state) != self._key:
+            self.parent = None
+            self._key = None
+            return
+        self._game_state = None
+        self._midturns = {}
+
+    @property
+    def key(self):
+        """
+        the key of this tree's state for a TranspositionTable: its hash along
+        with the seating order, which the hash leaves out
+
+        """
+        if self._key is None:
+            self._key = GameTree._state_key(self.game_state)
+        return self._key
+
+    @staticmethod
+    def _state_key(game_state):
+        """ key, for the given GameState """
+        return hash(game_state), tuple([p.name for p in game_state.players])
 
     def get_tile_moves(self):
         """
@@ -65,18 +350,21 @@ class GameTree:
             (tile, hotel)
 
         """
-        return [(tile, hotel) for tile in self.game_state.current_player.tiles
-                              for hotel in hotels+[None]
-                                if self.game_state.is_valid_move(tile, hotel)]
+        return tile_moves(self.game_state)
 
-    def get_sellbacks(self, tile, hotel):
+    def get_sellbacks(self, tile, hotel, exhaustive=False):
         """
         Return all of the potential hotel sellbacks players might want
         to make for a given tile and hotel placement. This only occurs during
         mergers.
 
+        Selling back a hotel a player has no shares of changes nothing, so
+        unless exhaustive, each player only picks among the acquirees they
+        hold shares of, and the sellbacks have distinct outcomes.
+
         Arguments:
             tile, hotel - a tile move
+            exhaustive - whether to give every player every set of acquirees
         Returns:
             if placing tile, hotel would be a merger:
                 [{playername=>[sellback_hotels]}] TODO: specify this is a generator <3
@@ -86,19 +374,25 @@ class GameTree:
         if self.game_state.board.valid_merge_placement(tile, hotel):
             acquirees = self.game_state.board.acquirees(tile, hotel)
 
-            all_sellbacks = \
-                map(list,
-                    chain(*[combinations(acquirees, c) for c in range(len(acquirees)+1)]))
-            names = [p.name for p in self.game_state.players]
+            def _sellbacks(held):
+                return map(list, chain(*[combinations(held, c) for c in range(len(held)+1)]))
+
+            if exhaustive:
+                all_sellbacks = _sellbacks(acquirees)
+                choices = [product([p.name], all_sellbacks) for p in self.game_state.players]
+            else:
+                choices = [product([p.name], _sellbacks([h for h in acquirees if p.has_shares_of(h)]))
+                           for p in self.game_state.players]
 
-            return imap(dict, product(*(product([n], all_sellbacks) for n in names)))
+            return imap(dict, product(*choices))
         else:
             return [{}]
 
     def get_share_moves(self, tile, hotel, sellback_map):
         """
-        Place the tile and hotel on a newly copied instance of this GameTree's
-        GameState.
+        Place the tile and hotel on a fork of this GameTree's GameState. The
+        fork is made once per tile move, and the sellbacks only change the
+        current player's cash and the pool, so the buys come from legal_buys.
 
         Arguments:
             tile - tile to place
@@ -110,12 +404,21 @@ class GameTree:
 
         Note: Will throw GameStateErrors on invalid input (don't do it)
         """
-        midturn_gs = deepcopy(self.game_state)
-        midturn_gs.place_a_tile(tile, hotel)
-        map(lambda player: midturn_gs.sellback(player, sellback_map[player], self.game_state),
-            sellback_map.keys())
+        midturn_gs, prices = self._midturn(tile, hotel)
+        pool = [midturn_gs.shares_map[h] for h in hotels]
+        return _buys_after_sellbacks(self.game_state, pool, prices, sellback_map)
 
-        return [buy for buy in ALL_LEGAL_BUYS if midturn_gs.is_valid_buy(buy)]
+    def _midturn(self, tile, hotel):
+        """
+        (a fork of this tree's state with the tile move made, its stock prices),
+        kept until playable_moves or branches has gone through every move
+        """
+        midturn = self._midturns.get((tile, hotel))
+        if midturn is None:
+            midturn_gs = self.game_state.fork()
+            midturn_gs.place_a_tile(tile, hotel)
+            midturn = self._midturns[(tile, hotel)] = (midturn_gs, tuple(midturn_gs.board.price_vector()))
+        return midturn
 
     def get_next_tiles(self):
         """
@@ -123,10 +426,66 @@ class GameTree:
         at the end of their turn
 
         Returns:
-            [tile]
+            [tile] - the game state's deck itself, not a copy, so don't change it
 
         """
-        return copy(self.game_state.tile_deck)
+        return self.game_state.tile_deck
+
+    ###########################################################################
+    #### Chance nodes: the tile handed out at the end of a turn ###############
+    ###########################################################################
+    # Every tile left in the deck is equally likely to be handed out. Searches
+    # can weigh the outcomes of a draw by these instead of trying every tile.
+    def next_tile_distribution(self):
+        """
+        Returns:
+            [(tile, probability)] - of each tile in the deck being handed out
+        """
+        deck = self.game_state.tile_deck
+        if len(deck) == 0:
+            return []
+        p = 1.0 / len(deck)
+        return [(tile, p) for tile in deck]
+
+    def approximate_tile_groups(self, board):
+        """
+        Group the tiles in the deck by the kind of tile move they give on the
+        given board: its movetype and the hotels it grows or merges. Pass the
+        board the drawn tile will be played on, such as the board after this
+        turn's tile move, not this tree's.
+
+        This is an approximation, not an exact chance distribution: tiles in
+        a group give the same kind of move on board, but sit in different
+        places, so they can do different things once the board changes and
+        they change the board differently.
+
+        Returns:
+            [([tile], probability)] - of handing out one of the group's tiles,
+                groups in the order of their first tile in the deck
+        """
+        deck = self.game_state.tile_deck
+        movetypes, adjacent = board.query_all()
+        groups = OrderedDict()
+        for tile in deck:
+            i = coord_index[tile]
+            key = (movetypes[i], frozenset([h for h, _ in adjacent.get(i, [])]))
+            groups.setdefault(key, []).append(tile)
+        return [(tiles, float(len(tiles)) / len(deck)) for tiles in groups.values()]
+
+    def sample_next_tiles(self, n, seed=None):
+        """
+        Draw n different tiles from the deck (all of them if it has fewer),
+        for searches that sample the draw rather than enumerate it.
+
+        Arguments:
+            n - the number of draws
+            seed - to make the draws repeatable
+        Returns:
+            [(tile, weight)] - the draws, each weighted equally
+        """
+        deck = list(self.game_state.tile_deck)
+        tiles = Random(seed).sample(deck, min(n, len(deck)))
+        return [(tile, 1.0 / len(tiles)) for tile in tiles]
 
     real_id = lambda x: x
 
@@ -147,7 +506,9 @@ class GameTree:
             sellback_filter - a function that returns a list of sellbacks given a list of sellbacks
             share_moves_filter - a function that returns a list of share moves given a list of share moves
             next_tiles_filter - a function that returns a list of tiles given the list of tiles
-            return_applied - whether or not we return GameTree objects or a move tuple (see below)
+            return_applied - whether or not we return GameTree objects or a move tuple (see below),
+                GameTrees are lazy (see apply), and come from this tree's
+                TranspositionTable if it has one
 
             CONTRACT: A *_filter must take a list and return a subset of its input
 
@@ -165,14 +526,67 @@ class GameTree:
             for sellback in sellback_filter(self.get_sellbacks(tile, maybeHotel)):
                 for shares in share_moves_filter(self.get_share_moves(tile, maybeHotel, sellback)):
                     for next_tile in next_tiles_filter(self.get_next_tiles()):
-                        if return_applied:
-                            yield self.apply(tile, maybeHotel, sellback, shares, next_tile)
+                        if return_applied and self.table is not None:
+                            yield self.table.child(self, (tile, maybeHotel, sellback, shares, next_tile))
+                        elif return_applied:
+                            yield self.apply(tile, maybeHotel, sellback, shares, next_tile, lazy=True)
                         else:
                             yield tile, maybeHotel, sellback, shares, next_tile
+        self._midturns = {}
 
     __iter__ = playable_moves
 
-    def apply(self, tile, maybeHotel, sellbacks, shares, new_tile=None):
+    def branches(self):
+        """
+        Return the moves of this tree's current player short of the tile
+        they are handed: every (tile, maybeHotel, sellbacks, shares)
+        playable_moves goes through
+
+        """
+        for tile, maybeHotel in self.get_tile_moves():
+            for sellback in self.get_sellbacks(tile, maybeHotel):
+                for shares in self.get_share_moves(tile, maybeHotel, sellback):
+                    yield tile, maybeHotel, sellback, shares
+        self._midturns = {}
+
+    def map_branches(self, fn, processes=None):
+        """
+        Call fn(tree, branch) for each of this tree's branches in a pool of
+        worker processes, which get this tree's state packed with to_bytes
+        and send back just fn's results
+
+        Arguments:
+            fn - a module level function (so it can be pickled) of a GameTree
+                and a branch
+            processes - how many workers, one per core by default
+        Returns:
+            [(branch, result)]
+        """
+        data = self.game_state.to_bytes()
+        branches = list(self.branches())
+        pool = Pool(processes)
+        try:
+            results = pool.map(_expand_branch, [(data, branch, fn) for branch in branches])
+        finally:
+            pool.close()
+            pool.join()
+        return zip(branches, results)
+
+    def count_moves(self, depth, processes=None):
+        """
+        Count the sequences of depth moves that can be played from this tree,
+        splitting the branches of its root over worker processes unless
+        processes is 1 (see map_branches)
+
+        """
+        if depth == 0:
+            return 1
+        count_branch = partial(_count_branch, depth=depth)
+        if processes == 1:
+            return sum([count_branch(self, branch) for branch in self.branches()])
+        return sum([count for _, count in self.map_branches(count_branch, processes)])
+
+    def apply(self, tile, maybeHotel, sellbacks, shares, new_tile=None, lazy=False):
         """
         Applies the given move to a game, and returns the new gametree
 
@@ -184,25 +598,36 @@ class GameTree:
             shares - a list of shares to be bought
             new_tile - the tile to be handed out to the player at the end
                 of their turn
+            lazy - whether to apply the move only once the new tree's state
+                is used, so an illegal move raises then
 
         Returns:
-            A GameTree with the state of the game after this apply
+            A GameTree with the state of the game after this apply, sharing
+            this tree's TranspositionTable and StateCache
         """
-        new_gs = deepcopy(self.game_state)
+        move = (tile, maybeHotel, sellbacks, shares, new_tile)
+        if lazy:
+            return GameTree(None, self.table, self, move, self.states)
+        return GameTree(GameTree._applied(self.game_state, move), self.table, states=self.states)
+
+    @staticmethod
+    def _applied(game_state, (tile, maybeHotel, sellbacks, shares, new_tile)):
+        """ a fork of game_state with the move applied """
+        new_gs = game_state.fork()
 
         new_gs.place_a_tile(tile, maybeHotel)
 
         for playername in sellbacks:
-            new_gs.sellback(playername, sellbacks[playername], self.game_state)
+            new_gs.sellback(playername, sellbacks[playername], game_state)
 
         for share in shares:
             new_gs.buy_stock(share)
 
-        new_gs.merge_payout(tile, maybeHotel, self.game_state)
+        new_gs.merge_payout(tile, maybeHotel, game_state)
 
         new_gs.done(new_tile)
 
-        return GameTree(new_gs)
+        return new_gs
 
     ###########################################################################
     #### Faster validity checking methods #####################################
@@ -220,7 +645,23 @@ class GameTree:
         return all([all([h in acquirees for h in hotels]) for hotels in sell_back.values()])
 
 
+###########################################################################
+#### Work for map_branches' worker processes ##############################
+###########################################################################
+def _expand_branch((data, branch, fn)):
+    """ call fn on a branch of the tree for the packed game state data """
+    return fn(GameTree(GameState.from_bytes(data)), branch)
+
+def _count_branch(tree, (tile, maybeHotel, sellbacks, shares), depth):
+    """ count the sequences of depth moves that start with the branch of tree """
+    if depth == 1:
+        return len(tree.get_next_tiles())
+    return sum([tree.apply(tile, maybeHotel, sellbacks, shares, next_tile).count_moves(depth - 1, 1)
+                for next_tile in list(tree.get_next_tiles())])
+
+
 import unittest as ut
+from collections import deque
 from board  import Board
 from state  import GameState, GameStatePlayer
 class TestGameTree(ut.TestCase):
@@ -237,6 +678,76 @@ class TestGameTree(ut.TestCase):
         gt3 = gt2.apply(tile, hotel, keeps, stocks, next_tile)
         self.assertEqual(len(gt3.game_state.board.board), 2)
 
+    def test_apply_leaves_game_state_alone(self):
+        gs = GameState("abc")
+        gs.place_a_tile('1A')
+        gs.place_a_tile('2A', A)
+        gs.done(gs.tile_deck[-1])
+        gt = GameTree(gs)
+        before = deepcopy(gs)
+
+        for tile, hotel, sellbacks, shares, next_tile in list(gt.playable_moves())[::97]:
+            gt2 = gt.apply(tile, hotel, sellbacks, shares, next_tile)
+            self.assertEqual(gt.game_state, before)
+            self.assertEqual(hash(gt.game_state), hash(before))
+            self.assertNotEqual(gt2.game_state, before)
+            self.assertTrue(gt2.game_state.players[0] is gs.players[1])
+
+    def test_transposition_table(self):
+        table = TranspositionTable()
+        gt = GameTree(GameState("abc"), table)
+        first_tile = lambda moves: moves[:1]
+        few_tiles = lambda tiles: list(tiles)[:3]
+        children = list(gt.playable_moves(tile_moves_filter=first_tile, next_tiles_filter=few_tiles,
+                                          return_applied=True))
+        self.assertEqual(len(children), 11 * 3)
+        self.assertEqual(table.misses, len(children))
+        self.assertTrue(all(child.table is table for child in children))
+
+        again = list(gt.playable_moves(tile_moves_filter=first_tile, next_tiles_filter=few_tiles,
+                                       return_applied=True))
+        self.assertTrue(all(a is b for a, b in zip(children, again)))
+        self.assertEqual(table.hits, len(children))
+        # the children are stored without building their states
+        self.assertTrue(all(child._game_state is None for child in children))
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.size, 1 + len(children))
+
+        table.put_value(gt, 'score', 3)
+        self.assertEqual(table.get_value(gt, 'score'), 3)
+        self.assertEqual(table.get_value(children[0], 'score'), None)
+
+    def test_transposition_table_merges_transpositions(self):
+        # no one has Sackson shares, so selling them back changes nothing
+        player = GameStatePlayer._test_gsplayer("joe", 6000, {A: 5}, [t5A])
+        others = [GameStatePlayer._test_gsplayer(name, 6000, {}, tiles)
+                  for name, tiles in [("kerry", ['9I']), ("ryan", [])]]
+        board = Board._board_in_play([(A, [t4A, t3A]), (S, [t6A, t7A])])
+        gt = GameTree(GameState._game_state_in_progress(deque([player] + others), board), TranspositionTable())
+        next_tile = gt.get_next_tiles()[0]
+        children = [gt.table.child(gt, (t5A, A, sellback, [], next_tile))
+                    for sellback in gt.get_sellbacks(t5A, A, exhaustive=True)]
+        self.assertEqual(len(children), 2 ** 3)
+        self.assertEqual(len(gt.table), 1)
+        self.assertTrue(all(gt.table.entry(child) is gt.table.entry(children[0]) for child in children))
+        self.assertEqual(len(gt.table), 2)
+
+        # the transpositions share their children
+        move = children[0].playable_moves().next()
+        self.assertTrue(gt.table.child(children[-1], move) is gt.table.child(children[0], move))
+
+    def test_transposition_table_capacity(self):
+        table = TranspositionTable(capacity=20)
+        gt = GameTree(GameState("abc"), table)
+        for child in gt.playable_moves(next_tiles_filter=lambda tiles: list(tiles)[:2], return_applied=True):
+            self.assertTrue(table.size <= table.capacity)
+            list(child.playable_moves(tile_moves_filter=lambda moves: moves[:1],
+                                      share_moves_filter=lambda moves: moves[:1],
+                                      next_tiles_filter=lambda tiles: list(tiles)[:1],
+                                      return_applied=True))
+            self.assertTrue(table.size <= table.capacity)
+        self.assertEqual(table.size, len(table) + sum([len(e.children) for e in table._entries.values()]))
+
     def test_get_tiles_moves(self):
         gt = GameTree(GameState("abc"))
         tile_moves = gt.get_tile_moves()
@@ -245,6 +756,14 @@ class TestGameTree(ut.TestCase):
         for tile, hotel in tile_moves:
             self.assertTrue(gt.game_state.is_valid_move(tile, hotel))
 
+    def test_get_tile_moves_agrees_with_is_valid_move(self):
+        board = Board._board_in_play([(A, [t4A, t3A]), (S, [t6A, t7A]), (NoHotel, [t1C])])
+        player = GameStatePlayer._test_gsplayer("joe", 6000, {}, set([t5A, t2C, t1D, t5B, t12I]))
+        gs = GameState._game_state_in_progress([player], board)
+        expected = [(tile, hotel) for tile in player.tiles for hotel in hotels+[None]
+                    if gs.is_valid_move(tile, hotel)]
+        self.assertEqual(sorted(GameTree(gs).get_tile_moves()), sorted(expected))
+
     def test_get_share_moves(self):
         gt = GameTree(GameState("abc"))
         tile, hotel = gt.get_tile_moves()[0]
@@ -255,6 +774,71 @@ class TestGameTree(ut.TestCase):
         for shares in share_moves:
             self.assertTrue(gt.game_state.is_valid_buy(shares))
 
+    def test_get_share_moves_after_sellbacks(self):
+        player1 = GameStatePlayer._test_gsplayer("joe", 500, {S:3, W:24}, [t5A])
+        player2 = GameStatePlayer._test_gsplayer("obama", 6000, {S:4}, [])
+        player3 = GameStatePlayer._test_gsplayer("kerry", 6000, {W:1}, [])
+        board = Board._board_in_play([(A, [t4A, t3A, t2A]), (S, [t6A, t7A]), (W, [t5B, t5C])])
+        gs = GameState._game_state_in_progress(deque([player1, player2, player3]), board)
+        gt = GameTree(gs)
+        for sellback in gt.get_sellbacks(t5A, A, exhaustive=True):
+            midturn_gs = deepcopy(gs)
+            midturn_gs.place_a_tile(t5A, A)
+            for name in sellback:
+                midturn_gs.sellback(name, sellback[name], gs)
+            expected = [buy for buy in ALL_LEGAL_BUYS if midturn_gs.is_valid_buy(buy)]
+            self.assertEqual(gt.get_share_moves(t5A, A, sellback), expected)
+            doubled = dict([(name, hs + hs) for name, hs in sellback.items()])
+            self.assertEqual(gt.get_share_moves(t5A, A, doubled), expected)
+        self.assertEqual(len(gt._midturns), 1)
+
+        # the forks are dropped once every move has been gone through
+        self.assertEqual(len(list(gt.branches())), len(list(gt.playable_moves())) / len(gs.tile_deck))
+        self.assertEqual(gt._midturns, {})
+
+    def test_share_moves(self):
+        board = Board._board_in_play([(A, [t4A, t3A]), (S, [t6A, t7A, t8A]), (NoHotel, [t1C, t9D, t11B])])
+        players = deque([GameStatePlayer._test_gsplayer("joe", 800, {A: 2, S: 1}, set([t5A, t2C, t10D, t9A])),
+                         GameStatePlayer._test_gsplayer("sue", 6000, {S: 23}, set([t1B])),
+                         GameStatePlayer._test_gsplayer("bob", 300, {A: 4}, set([t12I]))])
+        gs = GameState._game_state_in_progress(players, board)
+        gt = GameTree(copy(gs))
+        for tile, hotel in gt.get_tile_moves():
+            for sellback in gt.get_sellbacks(tile, hotel, exhaustive=True):
+                self.assertEqual(share_moves(gs, tile, hotel, sellback), gt.get_share_moves(tile, hotel, sellback))
+        # without forking the state
+        self.assertFalse(gs._shared_deck or gs._shared_players or gs.board._shared)
+
+    def test_next_tile_distribution(self):
+        gt = GameTree(GameState("abc"))
+        distribution = gt.next_tile_distribution()
+        self.assertEqual([tile for tile, _ in distribution], list(gt.get_next_tiles()))
+        self.assertAlmostEqual(sum([p for _, p in distribution]), 1.0)
+
+    def test_approximate_tile_groups(self):
+        gt = GameTree(GameState("abc"))
+        self.assertEqual(gt.approximate_tile_groups(gt.game_state.board), [(list(gt.get_next_tiles()), 1.0)])
+
+        board = Board._board_in_play([(A, [t4G, t3G]), (S, [t6D, t7D]), (NoHotel, [t1I])])
+        groups = dict([(tuple(tiles), p) for tiles, p in gt.approximate_tile_groups(board)])
+        self.assertEqual(sorted(sum(map(list, groups), [])), sorted(gt.get_next_tiles()))
+        self.assertAlmostEqual(sum(groups.values()), 1.0)
+        grows_sackson = [tiles for tiles in groups if t8D in tiles][0]
+        self.assertEqual(sorted(grows_sackson), sorted([t5D, t8D, t6C, t7C, t6E, t7E]))
+        self.assertEqual(groups[grows_sackson], 6.0 / len(gt.get_next_tiles()))
+        founds = [tiles for tiles in groups if t2I in tiles][0]
+        self.assertEqual(sorted(founds), sorted([t2I, t1H]))
+        # singletons, founds, growing either hotel and the tiles on the board
+        self.assertEqual(len(groups), 5)
+
+    def test_sample_next_tiles(self):
+        gt = GameTree(GameState("abc"))
+        draws = gt.sample_next_tiles(10, seed=3)
+        self.assertEqual(draws, gt.sample_next_tiles(10, seed=3))
+        self.assertEqual(len(set([tile for tile, _ in draws])), 10)
+        self.assertTrue(all(tile in gt.get_next_tiles() and w == 0.1 for tile, w in draws))
+        self.assertEqual(len(gt.sample_next_tiles(1000)), len(gt.get_next_tiles()))
+
     def test_get_tile_moves(self):
         gt = GameTree(GameState("abc"))
         next_tiles = gt.get_tile_moves()
@@ -266,6 +850,81 @@ class TestGameTree(ut.TestCase):
         self.assertEquals(len(list(gt.playable_moves())), 5940)
         # 5940 = 6 * 11 * 90
 
+    def test_lazy_children(self):
+        gt = GameTree(GameState("abc"))
+        moves = list(gt.playable_moves())[:20]
+        children = list(gt.playable_moves(return_applied=True))[:20]
+        self.assertTrue(all([child._game_state is None for child in children]))
+        for move, child in zip(moves, children):
+            self.assertEqual(child.move, move)
+            self.assertEqual(child.game_state, gt.apply(*move).game_state)
+            self.assertTrue(child.game_state is child.game_state)
+
+    def test_lazy_states_are_bounded(self):
+        gt = GameTree(GameState("abc"))
+        gt.states.capacity = 3
+        children = list(gt.playable_moves(return_applied=True))[:5]
+        grandchild = children[0].apply(*children[0].playable_moves().next(), lazy=True)
+        self.assertTrue(grandchild.states is gt.states)
+
+        before = grandchild.game_state
+        for child in children:
+            child.game_state
+        self.assertEqual(len([c for c in children + [grandchild] if c._game_state is not None]), 3)
+        self.assertEqual(children[0]._game_state, None)
+        self.assertEqual(children[0]._midturns, {})
+        self.assertEqual(grandchild._game_state, None)
+
+        # dropped states are built again from their parents
+        self.assertEqual(grandchild.game_state, before)
+        self.assertEqual(hash(grandchild.game_state), hash(before))
+        gt.states.clear()
+        self.assertEqual(len(gt.states), 0)
+        self.assertTrue(all([c._game_state is None for c in children + [grandchild]]))
+        self.assertEqual(gt.game_state, GameState("abc"))
+
+        # trees no one refers to go away with their states
+        children[-1].game_state
+        self.assertEqual(len(gt.states), 1)
+        del children, child
+        self.assertEqual(len(gt.states), 0)
+        self.assertEqual(len(GameTree(GameState("abc")).states), 0)
+
+    def test_changed_lazy_states_are_kept(self):
+        gt = GameTree(GameState("abc"))
+        gt.states.capacity = 1
+        children = list(gt.playable_moves(return_applied=True))[:3]
+        changed = children[0].game_state
+        changed._add_money(changed.current_player, 100)
+        before = deepcopy(changed)
+
+        for child in children[1:]:
+            child.game_state
+        self.assertTrue(children[0].game_state is changed)
+        self.assertEqual(children[0].game_state, before)
+        self.assertEqual(children[0].parent, None)
+        self.assertEqual(children[0].key, (hash(before), tuple([p.name for p in before.players])))
+        # unchanged states are still dropped
+        self.assertEqual(children[1]._game_state, None)
+        self.assertTrue(children[1].parent is gt)
+
+    def test_count_moves(self):
+        gt = GameTree(GameState("abc"))
+        self.assertEqual(gt.count_moves(0), 1)
+        self.assertEqual(gt.count_moves(1, processes=1), 5940)
+        self.assertEqual(gt.count_moves(1, processes=2), 5940)
+
+    def test_map_branches(self):
+        gs = GameState("abc")
+        gs.place_a_tile('1A')
+        gs.place_a_tile('2A', A)
+        gs.done(gs.tile_deck[-1])
+        gt = GameTree(gs)
+        results = gt.map_branches(partial(_count_branch, depth=1), processes=2)
+        self.assertEqual([branch for branch, _ in results], list(gt.branches()))
+        self.assertTrue(all(count == len(gs.tile_deck) for _, count in results))
+        self.assertEqual(len(results) * len(gs.tile_deck), len(list(gt.playable_moves())))
+
     def test_get_sellbacks_merge(self):
         player1 = GameStatePlayer._test_gsplayer("joe", 6000, {A:5}, [t5A])
         player2 = GameStatePlayer._test_gsplayer("obama", 6000, {S:4}, [])
@@ -276,7 +935,20 @@ class TestGameTree(ut.TestCase):
         board = Board._board_in_play([(A, [t4A, t3A]), (S, [t6A, t7A]), (W, [t5B, t5C])])
         gt = GameTree(GameState._game_state_in_progress([player1, player2, player3, player4, player5, player6], board))
 
-        self.assertEqual(len(list(gt.get_sellbacks(t5A, A))), (2**2)**6)
+        self.assertEqual(len(list(gt.get_sellbacks(t5A, A, exhaustive=True))), (2**2)**6)
+
+        # joe holds neither acquiree, everyone else one of them
+        sellbacks = list(gt.get_sellbacks(t5A, A))
+        self.assertEqual(len(sellbacks), 2**5)
+        self.assertTrue(all(sellback['joe'] == [] for sellback in sellbacks))
+        self.assertTrue(all(gt.is_valid_sell_back(t5A, A, sellback) for sellback in sellbacks))
+        outcomes = set()
+        for sellback in sellbacks:
+            gs = deepcopy(gt.game_state)
+            for name in sellback:
+                gs.sellback(name, sellback[name], gt.game_state)
+            outcomes.add(gs)
+        self.assertEqual(len(outcomes), len(sellbacks))
     def test_get_sellbacks_no_merge(self):
         gt = GameTree(GameState._game_state_in_progress([GameStatePlayer._test_gsplayer("joe", 6000, {A:5}, [t5A])],
                                                          Board()))
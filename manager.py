@@ -222,14 +222,7 @@ class Administrator():
 
     def remove_from_state(self, state, playername):
         """ removes the given player from the given state """
-        gsplayer = state.player_with_name(playername)
-
-        state.players.remove(gsplayer)
-
-        for h, s in gsplayer.shares_map.items():
-            state.shares_map[h] += s
-
-        state.tile_deck.extend(gsplayer.tiles)
+        state.remove_player(playername)
 
     @staticmethod
     def is_game_over(gs, beginning_of_turn=False):
@@ -0,0 +1,68 @@
+from searchplayer import SearchPlayer, TURN_BUDGET
+from basics import *
+from Lib.errors import PlayerError
+from search.expectimax import Expectimax
+
+class ExpectimaxPlayer(SearchPlayer):
+    """
+    This player implements the following strategy:
+        search the turns ahead with an iterative deepening expectimax (see
+        search.expectimax) for as long as TURN_BUDGET allows, keeping all of
+        its shares in mergers as the search assumes everyone does
+
+    """
+    def __init__(self, id, search=None):
+        SearchPlayer.__init__(self, id)
+        self.search = search or Expectimax(time_budget=TURN_BUDGET)
+
+    def _search(self, state):
+        """
+        Contract inherited from SearchPlayer
+        """
+        return self.search.search(state)
+
+
+import unittest as ut
+from collections import deque
+from board import Board
+from state import GameStatePlayer, GameState
+class TestExpectimaxPlayer(ut.TestCase):
+
+    def test_take_turn(self):
+        gs = GameState(['foo', 'bar', 'baz'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I'])])
+        player = ExpectimaxPlayer('foo', Expectimax(max_depth=1))
+
+        tile, hotel, shares = player.take_turn(gs, None)
+
+        self.assertTrue((tile, hotel) in [(t, None) for t in ['1A', '2A', '3A', '4A', '5A', '6A']])
+        self.assertEquals(shares, [A, A])
+
+    def test_merge(self):
+        board = Board._board_in_play([(A, ['3A', '4A']), (S, ['6A', '7A'])])
+        players = deque([GameStatePlayer._test_gsplayer('foo', 6000, {A: 2}, set(['5A'])),
+                         GameStatePlayer._test_gsplayer('bar', 6000, {}, set(['1I']))])
+        gs = GameState._game_state_in_progress(players, board)
+        merged = []
+        def merger_function(tile, hotel):
+            merged.append((tile, hotel))
+            state = GameState.from_bytes(gs.to_bytes())
+            state.place_a_tile(tile, hotel)
+            return state, []
+
+        tile, hotel, shares = ExpectimaxPlayer('foo', Expectimax(max_depth=1)).take_turn(gs, merger_function)
+        self.assertEquals(merged, [(tile, hotel)])
+        self.assertEquals(tile, '5A')
+
+    def test_no_move(self):
+        players = deque([GameStatePlayer._test_gsplayer('foo', 6000, {}, set()),
+                         GameStatePlayer._test_gsplayer('bar', 6000, {}, set(['1I']))])
+        gs = GameState._game_state_in_progress(players, Board())
+        self.assertRaises(PlayerError, ExpectimaxPlayer('foo', Expectimax(max_depth=1)).take_turn, gs, None)
+
+    def test_keep(self):
+        player = ExpectimaxPlayer('foo')
+        self.assertEquals(player.keep(None, [A, S]), [True, True])
+
+if __name__ == '__main__':
+    ut.main()
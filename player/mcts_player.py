@@ -0,0 +1,130 @@
+from copy import copy
+from searchplayer import SearchPlayer, TURN_BUDGET
+from basics import *
+from Lib.errors import PlayerError
+from search.mcts import MCTS, infer_move
+
+class MCTSPlayer(SearchPlayer):
+    """
+    This player implements the following strategy:
+        search the game with a Monte Carlo tree search (see search.mcts) for
+        as long as TURN_BUDGET allows, keeping all of its shares in mergers as
+        the search assumes everyone does. The part of the tree the turns since
+        its last search lead to is kept for the next search. A search with
+        more than one process (see MCTS) uses that many cores.
+
+    Fields:
+        search - the MCTS this player searches with
+        seen   - the states of the game since its last turn, starting with that
+                 turn's, to work out the moves made since from
+    """
+    def __init__(self, id, search=None):
+        SearchPlayer.__init__(self, id)
+        self.search = search or MCTS(time_budget=TURN_BUDGET)
+        self.seen = []
+
+    def setup(self, game_state):
+        """
+        Start a new game with a new search tree
+        """
+        self.search.advance(None)
+        self.seen = []
+
+    def _search(self, state):
+        """
+        Contract inherited from SearchPlayer, searching on from the part of
+        the tree the moves made since the last search lead to
+        """
+        moves = [infer_move(before, after) for before, after in zip(self.seen, self.seen[1:])]
+        self.seen = [copy(state)]
+        return self.search.search(state, moves)
+
+    def inform(self, state):
+        """
+        Remember the state, to work out the move that led to it next turn
+        """
+        if self.seen:
+            self.seen.append(state)
+
+    def end_game(self, score, state):
+        """
+        Stop the search's worker processes
+        """
+        self.search.close()
+
+    def stats(self):
+        """ the statistics of the last search, see MCTS.stats """
+        return self.search.stats()
+
+
+import unittest as ut
+from collections import deque
+from board import Board
+from state import GameStatePlayer, GameState
+class TestMCTSPlayer(ut.TestCase):
+
+    def test_take_turn(self):
+        gs = GameState(['foo', 'bar', 'baz'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I'])])
+        player = MCTSPlayer('foo', MCTS(iterations=30, seed=1))
+
+        tile, hotel, shares = player.take_turn(copy(gs), None)
+
+        self.assertTrue((tile, hotel) in [(t, None) for t in ['1A', '2A', '3A', '4A', '5A', '6A']])
+        self.assertTrue(gs.is_valid_buy(shares))
+        self.assertEqual(player.stats()['iterations'], 30)
+
+    def test_merge(self):
+        board = Board._board_in_play([(A, ['3A', '4A']), (S, ['6A', '7A'])])
+        players = deque([GameStatePlayer._test_gsplayer('foo', 6000, {A: 2}, set(['5A'])),
+                         GameStatePlayer._test_gsplayer('bar', 6000, {}, set(['1I']))])
+        gs = GameState._game_state_in_progress(players, board)
+        merged = []
+        def merger_function(tile, hotel):
+            merged.append((tile, hotel))
+            state = GameState.from_bytes(gs.to_bytes())
+            state.place_a_tile(tile, hotel)
+            return state, []
+
+        tile, hotel, shares = MCTSPlayer('foo', MCTS(iterations=10)).take_turn(copy(gs), merger_function)
+        self.assertEquals(merged, [(tile, hotel)])
+        self.assertEquals(tile, '5A')
+
+    def test_tree_is_kept(self):
+        gs = GameState(['foo', 'bar', 'baz'])
+        player = MCTSPlayer('foo', MCTS(iterations=60, seed=2, determinize=False))
+        player.setup(gs)
+        tile, hotel, shares = player.take_turn(copy(gs), None)
+        kept = player.search.root.children[(tile, hotel, tuple(shares))]
+
+        gs.place_a_tile(tile, hotel)
+        for share in shares:
+            gs.buy_stock(share)
+        gs.done(gs.tile_deck[0])
+        player.inform(copy(gs))
+        self.assertEquals(len(player.seen), 2)
+
+        player.search.iterations = 0
+        player.take_turn(copy(gs), None)
+        self.assertTrue(player.search.root is kept)
+
+    def test_root_parallel(self):
+        gs = GameState(['foo', 'bar', 'baz'])
+        player = MCTSPlayer('foo', MCTS(iterations=20, processes=2))
+        player.take_turn(copy(gs), None)
+        self.assertEqual(player.stats()['iterations'], 20)
+        player.end_game({}, gs)
+        self.assertEqual(player.search._pool, None)
+
+    def test_no_move(self):
+        players = deque([GameStatePlayer._test_gsplayer('foo', 6000, {}, set()),
+                         GameStatePlayer._test_gsplayer('bar', 6000, {}, set(['1I']))])
+        gs = GameState._game_state_in_progress(players, Board())
+        self.assertRaises(PlayerError, MCTSPlayer('foo', MCTS(iterations=10)).take_turn, gs, None)
+
+    def test_keep(self):
+        player = MCTSPlayer('foo')
+        self.assertEquals(player.keep(None, [A, S]), [True, True])
+
+if __name__ == '__main__':
+    ut.main()
@@ -62,9 +62,10 @@ class Player():
         """
         tiles = list(state.current_player.tiles)
         valid_tiles = []
+        movetypes, adjacent = state.board.query_all()
 
         for tile in tiles:
-            query_result = state.board.query(tile)
+            query_result = movetypes[coord_index[tile]]
 
             if SINGLETON == query_result:
                 valid_tiles.append((tile, None, SINGLETON))
@@ -74,7 +75,9 @@ class Player():
                 hotels = list(state.board.hotels_not_in_play)
                 map(valid_tiles.append, [(tile, hotel, FOUND) for hotel in hotels])
             elif MERGE == query_result:
-                map(valid_tiles.append, [(tile, hotel, MERGE) for hotel in state.board.acquirers(tile)])
+                hotel_sizes = adjacent[coord_index[tile]]
+                acquirers = [h for h, size in hotel_sizes if size == hotel_sizes[0][1]]
+                map(valid_tiles.append, [(tile, hotel, MERGE) for hotel in acquirers])
             elif INVALID == query_result:
                 continue
 
@@ -85,14 +88,16 @@ class Player():
 
     def valid_buy_orders(self, state):
         """ returns a list of all valid buy orders for the current player """
+        prices = state.board.price_vector()
+
         def _can_afford_stocks(order):
-            return state.current_player.money >= sum(state.board.stock_price(stock) for stock in order)
+            return state.current_player.money >= sum(prices[hotel_index[stock]] for stock in order)
 
         def _are_available(order):
             return len(order) <= state.shares_map[order[0]] if order != [] else True
 
         def _buyable(order):
-            return all(state.board.stock_price(stock) is not None for stock in order)
+            return all(prices[hotel_index[stock]] is not None for stock in order)
 
         return [order for order in ALL_LEGAL_BUYS
                 if _buyable(order) and _are_available(order) and _can_afford_stocks(order)]
@@ -0,0 +1,53 @@
+from player import Player
+from Lib.errors import PlayerError
+
+# seconds a turn's search may take, leaving the rest of proxyplayer's 3 second
+#   TIMEOUT for copying states and the network
+TURN_BUDGET = 2.0
+
+
+class SearchPlayer(Player):
+    """
+    Convenience class for Players that search the game for their move, keeping
+    all of their shares in mergers as the searches assume everyone does.
+
+    Implementors should implement:
+        _search
+    """
+
+    def take_turn(self, state, merger_function):
+        """
+        Contract inherited from Player, raising a PlayerError if no tile can
+        be placed (as valid_tile_moves does)
+        """
+        move = self._search(state)
+        if move is None:
+            raise PlayerError("No tiles available for this player")
+        tile, hotel, _, shares = move
+
+        if state.board.valid_merge_placement(tile, hotel):
+            state, _ = merger_function(tile, hotel)
+        else:
+            state.place_a_tile(tile, hotel)
+
+        # the others' sellbacks can only put more shares up for sale
+        if not state.is_valid_buy(shares):
+            shares = []
+        return tile, hotel, shares
+
+    def keep(self, state, hotels):
+        """
+        Keep all shares
+        """
+        return [True]*len(hotels)
+
+    def _search(self, state):
+        """
+        What move does the search find for the given turn?
+
+        This is a "protected" method, called by SearchPlayer's implementation of take_turn
+
+        Return:
+            (Tile, maybeHotel, sellbacks, [Hotel]), or None if no tile can be placed
+        """
+        pass
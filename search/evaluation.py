@@ -0,0 +1,36 @@
+from basics import *
+
+################################################################################
+#### Evaluation functions for searches #########################################
+################################################################################
+# An evaluation function takes a GameState and returns {playername=>value},
+# how good the game looks for each of its players, bigger is better.
+
+def final_scores(state):
+    """ each player's score if the game ended now (see GameState.final_scores) """
+    return state.final_scores()
+
+def relative_scores(state):
+    """ each player's final score, less the best final score of the others """
+    scores = state.final_scores()
+    return dict([(name, score - max([0] + [s for n, s in scores.items() if n != name]))
+                 for name, score in scores.items()])
+
+
+import unittest as ut
+from board import Board
+from state import GameState
+class TestEvaluation(ut.TestCase):
+
+    def test_final_scores(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        self.assertEqual(final_scores(gs), dict([(name, STARTING_MONEY) for name in ['jim', 'lori', 'matthias']]))
+
+    def test_relative_scores(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I'])])
+        gs.buy_stock(A)
+        self.assertEqual(relative_scores(gs), {'jim': 3000, 'lori': -3000, 'matthias': -3000})
+
+if __name__ == '__main__':
+    ut.main()
@@ -0,0 +1,252 @@
+from time import time
+from basics import *
+from gametree import GameTree, TranspositionTable
+from evaluation import relative_scores
+
+################################################################################
+#### Iterative deepening expectimax over GameTrees #############################
+################################################################################
+# Searches the turns ahead of a game, one ply per turn. At a player's turn they
+# pick the move (tile move and shares) best for themselves by the evaluation,
+# which values the game for every player at once. The tile handed out at the
+# end of the turn is a chance node: only the player who draws it is affected,
+# so while they won't move again within the search one draw stands for all of
+# them. Otherwise the node goes through every tile in the deck, or a sample of
+# them (sample_next_tiles), or if asked groups them by the kind of move they
+# give on the board after the turn (approximate_tile_groups), which is cheaper
+# but only approximately right. Other players' sellbacks, which are their own
+# decisions, come from a sellback policy.
+#
+# The search deepens one ply at a time until it runs out of time or nodes, and
+# answers with the best move of the deepest search it finished. Values found
+# are kept in a TranspositionTable, with the depth searched, for the deeper
+# searches and later turns to reuse.
+
+class SearchTimeout(Exception):
+    """ raised inside a search when it runs out of time or nodes """
+    pass
+
+def keep_all(tree, tile, hotel):
+    """ the sellback policy where no player sells back any shares """
+    return dict([(p.name, []) for p in tree.game_state.players]) \
+        if tree.game_state.board.valid_merge_placement(tile, hotel) else {}
+
+def founds_and_merges_first(tree, moves):
+    """ order moves with founds and merges first, then those buying the most shares """
+    movetypes, _ = tree.game_state.board.query_all()
+    rank = {MERGE: 0, FOUND: 1, GROW: 2, SINGLETON: 3}
+    return sorted(moves, key=lambda (tile, _, __, shares): (rank.get(movetypes[coord_index[tile]], 4),
+                                                         -len(shares)))
+
+class Expectimax(object):
+    """
+    A depth limited expectimax search with iterative deepening
+
+    Fields:
+        evaluate - function (GameState -> {playername=>value}), see search.evaluation
+        order_moves - function (GameTree, [move] -> [move]) trying likely best moves first
+        sellback_policy - function (GameTree, tile, hotel -> {playername=>[hotel]})
+        time_budget - seconds a search may take, or None
+        node_budget - the nodes a search may visit, or None
+        max_depth - the deepest a search goes, in turns
+        samples - how many draws a chance node samples, None to go through them all
+        group_draws - whether chance nodes weigh approximate groups of draws
+            instead, see GameTree.approximate_tile_groups
+        table - the TranspositionTable the searches keep their values in
+    """
+    def __init__(self, evaluate=relative_scores, order_moves=founds_and_merges_first,
+                 sellback_policy=keep_all, time_budget=None, node_budget=None, max_depth=8,
+                 samples=None, group_draws=False, seed=None, table=None):
+        self.evaluate = evaluate
+        self.order_moves = order_moves
+        self.sellback_policy = sellback_policy
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        self.max_depth = max_depth
+        self.samples = samples
+        self.group_draws = group_draws
+        self.seed = seed
+        self.table = table if table is not None else TranspositionTable()
+        self.nodes = 0
+        self.depth = 0
+        self._deadline = None
+
+    def search(self, state):
+        """
+        Find the current player's best move in the game
+
+        Returns:
+            (tile, maybeHotel, sellbacks, shares) - the best move of the deepest
+                finished search, or None if the current player has no move
+        """
+        tree = GameTree(state, self.table)
+        moves = self.moves(tree)
+        if not moves:
+            return None
+
+        self.nodes = 0
+        self.depth = 0
+        self._deadline = None if self.time_budget is None else time() + self.time_budget
+        best = moves[0]
+        for depth in xrange(1, self.max_depth + 1):
+            try:
+                values = [(self._move_value(tree, move, depth), move) for move in moves]
+            except SearchTimeout:
+                break
+            me = state.current_player.name
+            values.sort(key=lambda (value, _): -value[me])
+            best = values[0][1]
+            self.depth = depth
+            # the next search looks at this one's best moves first
+            moves = [move for _, move in values]
+            if self._game_ends_within(tree, depth):
+                break
+        return best
+
+    def moves(self, tree):
+        """ the moves of the current player of tree, in the order to search them """
+        moves = []
+        for tile, hotel in tree.get_tile_moves():
+            sellback = self.sellback_policy(tree, tile, hotel)
+            moves.extend([(tile, hotel, sellback, shares)
+                          for shares in tree.get_share_moves(tile, hotel, sellback)])
+        return self.order_moves(tree, moves)
+
+    def value(self, tree, depth):
+        """ {playername=>value} of the game of tree, searching depth turns ahead """
+        self._visit()
+        if depth == 0:
+            return self.evaluate(tree.game_state)
+
+        known = self.table.get_value(tree, 'expectimax')
+        if known is not None and known[0] >= depth:
+            return known[1]
+
+        moves = self.moves(tree) if len(tree.game_state.tile_deck) > 0 else []
+        if not moves:
+            # the game is over
+            return self.evaluate(tree.game_state)
+
+        me = tree.game_state.current_player.name
+        best = None
+        for move in moves:
+            value = self._move_value(tree, move, depth)
+            if best is None or value[me] > best[me]:
+                best = value
+        self.table.put_value(tree, 'expectimax', (depth, best))
+        return best
+
+    def _move_value(self, tree, move, depth):
+        """ the expected value of making move in tree: a chance node over the draw """
+        expected = {}
+        for tile, p in self._draws(tree, move, depth):
+            child = self.table.child(tree, move + (tile,))
+            for name, value in self.value(child, depth - 1).items():
+                expected[name] = expected.get(name, 0) + p * value
+        return expected
+
+    def _draws(self, tree, move, depth):
+        """ [(tile, probability)] of the draws the chance node after making move in tree looks at """
+        players = len(tree.game_state.players)
+        if depth - 1 < players:
+            return [(tree.get_next_tiles()[0], 1.0)]
+        if self.samples is not None:
+            return tree.sample_next_tiles(self.samples, self.seed)
+        if self.group_draws:
+            # the drawn tile is played on the board the move leaves
+            board = self.table.child(tree, move + (tree.get_next_tiles()[0],)).game_state.board
+            return [(tiles[0], p) for tiles, p in tree.approximate_tile_groups(board)]
+        return tree.next_tile_distribution()
+
+    def _visit(self):
+        """ count a node, raising SearchTimeout when out of budget """
+        self.nodes += 1
+        if self.node_budget is not None and self.nodes > self.node_budget:
+            raise SearchTimeout()
+        if self._deadline is not None and time() > self._deadline:
+            raise SearchTimeout()
+
+    def _game_ends_within(self, tree, depth):
+        """ whether the deck runs out within depth turns, so searching deeper changes nothing """
+        return len(tree.game_state.tile_deck) < depth
+
+
+import unittest as ut
+from collections import deque
+from board import Board
+from state import GameState, GameStatePlayer
+class TestExpectimax(ut.TestCase):
+
+    def test_search_takes_the_bonus(self):
+        # buying into the only hotel makes jim its majority stockholder
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I'])])
+        search = Expectimax(max_depth=1)
+        tile, hotel, sellbacks, shares = search.search(gs)
+        self.assertEqual(shares, [A, A])
+        self.assertEqual(search.depth, 1)
+
+    def test_search_founds(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.place_a_tile('1A')
+        gs.done(gs.tile_deck[-1])
+        gs.players.rotate(-2)
+        tile, hotel, sellbacks, shares = Expectimax(max_depth=1).search(gs)
+        self.assertEqual(tile, '2A')
+        self.assertTrue(hotel in hotels)
+
+    def test_budgets(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        search = Expectimax(node_budget=500)
+        move = search.search(gs)
+        self.assertTrue(move in search.moves(GameTree(gs)))
+        self.assertEqual(search.depth, 1)
+
+        search = Expectimax(time_budget=0.5)
+        start = time()
+        self.assertTrue(search.search(gs) in search.moves(GameTree(gs)))
+        self.assertTrue(time() - start < 1.5)
+
+    def test_search_leaves_state_alone(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I'])])
+        before = GameState.from_bytes(gs.to_bytes())
+        Expectimax(max_depth=2).search(gs)
+        self.assertEqual(gs, before)
+
+    def test_values_are_reused(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        search = Expectimax(max_depth=2)
+        search.search(gs)
+        nodes = search.nodes
+        search.search(gs)
+        self.assertTrue(search.nodes < nodes)
+
+    def test_draws(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        tree = GameTree(gs)
+        move = Expectimax().moves(tree)[0]
+        search = Expectimax()
+        self.assertEqual(len(search._draws(tree, move, 3)), 1)
+        self.assertEqual(search._draws(tree, move, 4), tree.next_tile_distribution())
+        search = Expectimax(samples=5, seed=1)
+        self.assertEqual(len(search._draws(tree, move, 4)), 5)
+
+    def test_draws_are_grouped_after_the_move(self):
+        # placing 5E makes the deck's tiles next to it found hotels
+        players = deque([GameStatePlayer._test_gsplayer('jim', 6000, {}, set(['5E'])),
+                         GameStatePlayer._test_gsplayer('lori', 6000, {}, set(['1A'])),
+                         GameStatePlayer._test_gsplayer('matthias', 6000, {}, set(['12I']))])
+        gs = GameState._game_state_in_progress(players, Board())
+        tree = GameTree(gs)
+        move = ('5E', None, {}, [])
+        deck = len(gs.tile_deck)
+
+        draws = Expectimax(group_draws=True)._draws(tree, move, 4)
+        self.assertEqual(sorted([p for _, p in draws]), [4.0 / deck, (deck - 4.0) / deck])
+        founds = [tile for tile, p in draws if p == 4.0 / deck][0]
+        self.assertTrue(founds in ['4E', '6E', '5D', '5F'])
+        self.assertAlmostEqual(sum([p for _, p in draws]), 1.0)
+
+if __name__ == '__main__':
+    ut.main()
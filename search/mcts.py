@@ -0,0 +1,486 @@
+from math import log, sqrt
+from random import Random
+from time import time
+from copy import copy
+from basics import *
+from multiprocessing import Pool
+from state import GameState, TileDeck
+from gametree import tile_moves, share_moves
+
+################################################################################
+#### Monte Carlo tree search ###################################################
+################################################################################
+# A UCT search over the moves of a game, (tile, maybeHotel, (shares)), in which
+# everyone keeps their shares in mergers. Each iteration:
+#   - determinizes the game: the searching player can't see the others' tiles,
+#     so they are dealt again from the deck along with them
+#   - walks down the tree, each player picking the move best for them by UCB1
+#     among the moves they can make in this determinization, and adds a node
+#     for a move not tried yet. Since the moves that can be made differ from
+#     one determinization to the next, a node counts how often it could have
+#     been picked rather than how often its parent was visited
+#   - plays random turns from there (a rollout), and scores the game
+#   - adds the score to the nodes it went through
+# Iterations play the turns on one game each, in place, rather than copying
+# the game for every turn. Tiles handed out are drawn at random. The moves come
+# from gametree.tile_moves and share_moves and are played with
+# GameState._play_unchecked, so the turns don't go through the contracts or fork.
+#
+# With more than one process the search is root parallel: each worker grows a
+# tree of its own from the game packed with to_bytes, until the same deadline,
+# and sends back the statistics of its root's moves, which are added up in the
+# root of this search's tree before picking the move.
+
+# weight of UCB1's exploration term, for rewards between 0 and 1
+EXPLORATION = 0.7
+
+# seconds of a parallel search's time budget left for the workers to send back
+#   their statistics
+PARALLEL_MARGIN = 0.05
+
+def win_rewards(state):
+    """ {playername=>reward}: 1 for the player with the best score, split between ties """
+    scores = state.final_scores()
+    best = max(scores.values())
+    winners = [name for name, score in scores.items() if score == best]
+    return dict([(name, 1.0 / len(winners) if name in winners else 0.0) for name in scores])
+
+def infer_move(before, after):
+    """
+    Work out the move the current player of before made to get to after,
+    the game at the end of their turn
+
+    Returns:
+        (tile, maybeHotel, (shares)), or None if it isn't one turn later
+    """
+    placed = set(after.board.board) - set(before.board.board)
+    names = [p.name for p in after.players]
+    if len(placed) != 1 or before.current_player.name not in names:
+        return None
+    tile = placed.pop()
+    movetype = before.board.query(tile)
+    hotel = after.board[tile] if movetype in [FOUND, MERGE] else None
+
+    player_before = before.current_player
+    player_after = after.player_with_name(player_before.name)
+    shares = []
+    for h in hotels:
+        bought = player_after.shares_map[h] - player_before.shares_map[h]
+        if movetype == FOUND and h == hotel and before.shares_map[h] > FOUND_SHARES:
+            bought -= FOUND_SHARES
+        shares.extend([h] * bought)
+    return tile, hotel, tuple(shares)
+
+
+class MCTSNode(object):
+    """
+    A node of the search tree, for a move made from its parent
+
+    Fields:
+        children  - {move=>MCTSNode}
+        visits    - the iterations that went through this node
+        available - the iterations in which its move could have been made
+        rewards   - {playername=>total reward} of the iterations through it
+    """
+    __slots__ = ('children', 'visits', 'available', 'rewards')
+
+    def __init__(self):
+        self.children = {}
+        self.visits = 0
+        self.available = 0
+        self.rewards = {}
+
+    def size(self):
+        """ the number of nodes in the tree below and including this one """
+        return 1 + sum([child.size() for child in self.children.values()])
+
+
+class MCTS(object):
+    """
+    Fields:
+        exploration - weight of UCB1's exploration term
+        rollout_turns - the random turns a rollout plays before scoring the game
+        reward - function (GameState -> {playername=>reward between 0 and 1})
+        determinize - whether to deal the other players' tiles again
+        time_budget - seconds a search may take, or None
+        iterations - the iterations a search may make, or None
+        processes - how many worker processes grow trees, see search
+        root - the tree of the last search, kept for the next one
+    """
+    def __init__(self, exploration=EXPLORATION, rollout_turns=6, reward=win_rewards,
+                 determinize=True, time_budget=None, iterations=None, seed=None, processes=1):
+        if time_budget is None and iterations is None:
+            raise ValueError("a search needs a time budget or a number of iterations")
+        self.exploration = exploration
+        self.rollout_turns = rollout_turns
+        self.reward = reward
+        self.determinize = determinize
+        self.time_budget = time_budget
+        self.iterations = iterations
+        self.processes = processes
+        self.seed = seed
+        self.rng = Random(seed)
+        self.root = MCTSNode()
+        self._stats = {}
+        self._pool = None
+
+    def search(self, state, moves_since=None):
+        """
+        Find the current player's best move in the game. With more than one
+        process, workers each grow their own tree in the time budget (and
+        share the iterations), and the statistics of their roots' moves are
+        added to this tree's root; the tree below the root's moves is then
+        left to the workers and isn't kept for the next search.
+
+        Arguments:
+            state - the game
+            moves_since - the moves made since the last search, starting with its
+                own (see infer_move), to search on from that part of its tree
+        Returns:
+            (tile, maybeHotel, sellbacks, shares) - the most visited move, or None
+                if the current player has no move
+        """
+        self.advance(moves_since)
+        moves = self._moves(state)
+        if not moves:
+            return None
+
+        start = time()
+        if self.processes > 1:
+            done = self._grow_in_parallel(state, start)
+        else:
+            deadline = None if self.time_budget is None else start + self.time_budget
+            done = self._grow(state, deadline, self.iterations)
+
+        tried = [(self.root.children[m].visits, m) for m in moves if m in self.root.children]
+        tile, hotel, shares = max(tried)[1] if tried else moves[0]
+        elapsed = time() - start
+        self._stats = {'iterations': done, 'seconds': elapsed, 'processes': self.processes,
+                       'iterations_per_second': done / elapsed if elapsed else None}
+        sellbacks = dict([(p.name, []) for p in state.players]) \
+            if state.board.valid_merge_placement(tile, hotel) else {}
+        return tile, hotel, sellbacks, list(shares)
+
+    def advance(self, moves):
+        """ make the part of the tree the given moves lead to the root, or start over """
+        node = self.root
+        for move in moves or []:
+            node = node.children.get(move) if node is not None and move is not None else None
+        self.root = node if moves and node is not None else MCTSNode()
+
+    def stats(self):
+        """
+        Returns:
+            dict - the last search's iterations, seconds and iterations per second,
+                the tree's size and visits, and [(move, visits, mean rewards)]
+                of the root's moves, most visited first
+        """
+        moves = sorted([(m, child.visits, dict([(name, r / child.visits) for name, r in child.rewards.items()]))
+                        for m, child in self.root.children.items() if child.visits],
+                       key=lambda (move, visits, _): (visits, move), reverse=True)
+        stats = dict(self._stats)
+        stats.update({'nodes': self.root.size(), 'visits': self.root.visits, 'moves': moves})
+        return stats
+
+    def close(self):
+        """ stop the worker processes, if any were started """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    ###########################################################################
+    #### Root parallel search #################################################
+    ###########################################################################
+    def _grow_in_parallel(self, state, start):
+        """ grow trees in the worker processes, merge their roots into this one and return their iterations """
+        n = self.processes
+        deadline = None if self.time_budget is None else start + self.time_budget - PARALLEL_MARGIN
+        iterations = [None] * n if self.iterations is None else \
+            [self.iterations // n + (i < self.iterations % n) for i in xrange(n)]
+        seeds = [None] * n if self.seed is None else [self.seed + i for i in xrange(n)]
+        settings = {'exploration': self.exploration, 'rollout_turns': self.rollout_turns,
+                    'reward': self.reward, 'determinize': self.determinize}
+        data = state.to_bytes()
+        if self._pool is None:
+            self._pool = Pool(n)
+        results = self._pool.map(_grow_tree, [(data, settings, seeds[i], deadline, iterations[i])
+                                              for i in xrange(n)])
+
+        done = 0
+        for iterated, moves in results:
+            done += iterated
+            self.root.visits += iterated
+            for move, (visits, available, rewards) in moves.items():
+                child = self.root.children.get(move)
+                if child is None:
+                    child = self.root.children[move] = MCTSNode()
+                child.visits += visits
+                child.available += available
+                for name, reward in rewards.items():
+                    child.rewards[name] = child.rewards.get(name, 0.0) + reward
+        return done
+
+    ###########################################################################
+    #### Iterations ###########################################################
+    ###########################################################################
+    def _grow(self, state, deadline, iterations):
+        """ run iterations from the game until the deadline or the iterations are up, and return how many """
+        done = 0
+        while (iterations is None or done < iterations) and (deadline is None or time() < deadline):
+            self._iterate(state)
+            done += 1
+        return done
+
+    def _iterate(self, state):
+        """ run one iteration of the search from the game """
+        game = self._sample(state)
+        node, path = self.root, []
+        while True:
+            moves = self._moves(game)
+            if not moves:
+                break
+            mover = game.current_player.name
+            untried = []
+            for move in moves:
+                child = node.children.get(move)
+                if child is None:
+                    untried.append(move)
+                else:
+                    child.available += 1
+            if untried:
+                move = self.rng.choice(untried)
+                child = node.children[move] = MCTSNode()
+                child.available = 1
+                node = child
+                self._play(game, move)
+                path.append((node, mover))
+                break
+            move = max(moves, key=lambda m: self._ucb(node.children[m], mover))
+            node = node.children[move]
+            self._play(game, move)
+            path.append((node, mover))
+
+        for _ in xrange(self.rollout_turns):
+            if not self._random_turn(game):
+                break
+
+        rewards = self.reward(game)
+        self.root.visits += 1
+        for node, _ in path:
+            node.visits += 1
+            for name, reward in rewards.items():
+                node.rewards[name] = node.rewards.get(name, 0.0) + reward
+
+    def _ucb(self, node, mover):
+        """ UCB1 of the node for the player who moves into it """
+        return node.rewards.get(mover, 0.0) / node.visits + \
+            self.exploration * sqrt(log(node.available) / node.visits)
+
+    def _sample(self, state):
+        """ a copy of the game to play an iteration on, determinized if need be """
+        game = copy(state)
+        if not self.determinize:
+            return game
+        me = state.current_player.name
+        others = [p for p in game.players if p.name != me]
+        hidden = list(game.tile_deck) + [tile for p in others for tile in p.tiles]
+        self.rng.shuffle(hidden)
+        for p in others:
+            dealt = len(p.tiles)
+            p.tiles, hidden = set(hidden[:dealt]), hidden[dealt:]
+        game.tile_deck = TileDeck(hidden)
+        return game
+
+    def _moves(self, game):
+        """ [(tile, maybeHotel, (shares))] of the current player in the game """
+        return [(tile, hotel, tuple(shares))
+                for tile, hotel in tile_moves(game)
+                for shares in share_moves(game, tile, hotel, {})]
+
+    def _play(self, game, (tile, hotel, shares)):
+        """ make the move in the game, with everyone keeping their shares, and deal a random tile if any are left """
+        deck = game.tile_deck
+        game._play_unchecked(tile, hotel, shares, deck[self.rng.randrange(len(deck))] if len(deck) else None)
+
+    def _random_turn(self, game):
+        """ play a random turn of the game, unless it is over """
+        options = tile_moves(game)
+        if not options:
+            return False
+        tile, hotel = self.rng.choice(options)
+        shares = self.rng.choice(share_moves(game, tile, hotel, {}))
+        self._play(game, (tile, hotel, shares))
+        return True
+
+def _grow_tree((data, settings, seed, deadline, iterations)):
+    """ grow a tree in a worker, and return its iterations and {move=>(visits, available, rewards)} of its root """
+    budget = None if deadline is None else deadline - time()
+    mcts = MCTS(time_budget=budget, iterations=iterations, seed=seed, **settings)
+    done = mcts._grow(GameState.from_bytes(data), deadline, iterations)
+    return done, dict([(move, (child.visits, child.available, child.rewards))
+                       for move, child in mcts.root.children.items()])
+
+
+import unittest as ut
+from gametree import GameTree
+from board import Board
+from bitboard import BitBoard
+class TestMCTS(ut.TestCase):
+
+    def test_search(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I'])])
+        mcts = MCTS(iterations=80, seed=1)
+        tile, hotel, sellbacks, shares = mcts.search(gs)
+        self.assertTrue(gs.is_valid_move(tile, hotel))
+        self.assertTrue((tile, hotel, tuple(shares)) in mcts._moves(gs))
+
+        stats = mcts.stats()
+        self.assertEqual(stats['iterations'], 80)
+        self.assertEqual(stats['visits'], 80)
+        self.assertEqual(sum([visits for _, visits, _ in stats['moves']]), 80)
+        self.assertEqual(stats['moves'][0][0], (tile, hotel, tuple(shares)))
+        self.assertTrue(stats['nodes'] > len(stats['moves']))
+
+    def test_search_on_bitboard(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I']), (S, ['4I', '5I'])])
+        gs.current_player.tiles.add('3I')
+        bits = copy(gs)
+        bits.board = BitBoard.from_bytes(gs.board.to_bytes())
+        tile, hotel, sellbacks, shares = MCTS(iterations=50, seed=1).search(bits)
+        self.assertTrue(bits.is_valid_move(tile, hotel))
+
+        # the same turns play out the same on either board
+        board_mcts, bits_mcts = MCTS(iterations=1, seed=7), MCTS(iterations=1, seed=7)
+        for _ in xrange(30):
+            self.assertEqual(board_mcts._random_turn(gs), bits_mcts._random_turn(bits))
+            self.assertEqual(bits.board.to_bytes(), gs.board.to_bytes())
+            self.assertEqual(bits, gs)
+
+    def test_search_leaves_state_alone(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        before = GameState.from_bytes(gs.to_bytes())
+        MCTS(iterations=50, seed=2).search(gs)
+        self.assertEqual(gs, before)
+        self.assertEqual(hash(gs), hash(before))
+
+    def test_time_budget(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        start = time()
+        MCTS(time_budget=0.3).search(gs)
+        self.assertTrue(time() - start < 1.0)
+        self.assertRaises(ValueError, MCTS)
+
+    def test_root_parallel(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I'])])
+        mcts = MCTS(iterations=41, seed=1, processes=2)
+        try:
+            tile, hotel, sellbacks, shares = mcts.search(gs)
+            stats = mcts.stats()
+            self.assertEqual(stats['iterations'], 41)
+            self.assertEqual(stats['visits'], 41)
+            self.assertEqual(sum([visits for _, visits, _ in stats['moves']]), 41)
+            self.assertEqual(stats['moves'][0][0], (tile, hotel, tuple(shares)))
+            self.assertTrue((tile, hotel, tuple(shares)) in mcts._moves(gs))
+
+            mcts.iterations, mcts.time_budget = None, 0.5
+            start = time()
+            mcts.search(gs)
+            self.assertTrue(time() - start < 1.0)
+            self.assertTrue(mcts.stats()['visits'] > 0)
+        finally:
+            mcts.close()
+
+    def test_determinize(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        mcts = MCTS(iterations=1, seed=3)
+        game = mcts._sample(gs)
+        self.assertEqual(game.current_player.tiles, gs.current_player.tiles)
+        self.assertNotEqual(game.players[1].tiles, gs.players[1].tiles)
+        self.assertEqual([len(p.tiles) for p in game.players], [len(p.tiles) for p in gs.players])
+        self.assertEqual(len(game.tile_deck), len(gs.tile_deck))
+        dealt = set(game.tile_deck).union(*[p.tiles for p in game.players])
+        self.assertEqual(dealt, set(gs.tile_deck).union(*[p.tiles for p in gs.players]))
+
+        mcts = MCTS(iterations=1, determinize=False)
+        self.assertEqual(mcts._sample(gs), gs)
+
+        # players out of tiles aren't dealt any
+        gs.players[1].tiles = set()
+        game = MCTS(iterations=1, seed=3)._sample(gs)
+        self.assertEqual([len(p.tiles) for p in game.players], [6, 0, 6])
+        self.assertEqual(len(game.tile_deck), len(gs.tile_deck))
+        self.assertEqual(hash(game), hash(GameState.from_bytes(game.to_bytes())))
+
+    def test_iterations_play_past_the_deck(self):
+        # with the deck empty, the players play out the tiles in their hands
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.tile_deck = TileDeck()
+        mcts = MCTS(iterations=1, seed=8, rollout_turns=0, determinize=False)
+        mcts.search(gs)
+        self.assertEqual(mcts.root.visits, 1)
+        self.assertEqual(len(mcts.root.children), 1)
+        game = copy(gs)
+        while mcts._random_turn(game):
+            pass
+        self.assertEqual([len(p.tiles) for p in game.players], [0, 0, 0])
+
+    def test_moves(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.board = Board._board_in_play([(A, ['1I', '2I']), (S, ['4I', '5I'])])
+        gs.current_player.tiles.add('3I')
+        gs.rehash()
+        mcts = MCTS(iterations=1, seed=6)
+        for _ in xrange(20):
+            tree = GameTree(copy(gs))
+            expected = [(tile, hotel, tuple(shares)) for tile, hotel in tree.get_tile_moves()
+                        for shares in tree.get_share_moves(tile, hotel, {})]
+            self.assertEqual(sorted(mcts._moves(gs)), sorted(expected))
+            self.assertFalse(gs._shared_deck or gs._shared_players)
+            mcts._random_turn(gs)
+
+    def test_rollouts_finish_games(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        mcts = MCTS(iterations=1, seed=4)
+        game = copy(gs)
+        while mcts._random_turn(game):
+            pass
+        self.assertEqual(len(game.tile_deck), 0)
+        self.assertFalse(GameTree(game).get_tile_moves())
+
+    def test_tree_reuse(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        mcts = MCTS(iterations=100, seed=5, determinize=False)
+        move = mcts.search(gs)
+        after = copy(gs)
+        tile, hotel, sellbacks, shares = move
+        after.place_a_tile(tile, hotel)
+        for share in shares:
+            after.buy_stock(share)
+        after.done(after.tile_deck[0])
+        played = infer_move(gs, after)
+        self.assertEqual(played, (tile, hotel, tuple(shares)))
+
+        subtree = mcts.root.children[played]
+        mcts.advance([played])
+        self.assertTrue(mcts.root is subtree)
+        mcts.advance([('1A', None, ())])
+        self.assertEqual(mcts.root.visits, 0)
+
+    def test_infer_move(self):
+        gs = GameState(['jim', 'lori', 'matthias'])
+        gs.place_a_tile('1A')
+        gs.done(gs.tile_deck[0])
+        gs.players.rotate(-2)
+        before = copy(gs)
+        gs.place_a_tile('2A', S)
+        gs.buy_stock(S)
+        gs.done(gs.tile_deck[0])
+        self.assertEqual(infer_move(before, gs), ('2A', S, (S,)))
+        self.assertEqual(infer_move(before, before), None)
+
+if __name__ == '__main__':
+    ut.main()
@@ -1,43 +1,396 @@
-from random import shuffle
-from collections import deque
+from random import shuffle, Random
+from struct import Struct, error as StructError
+from collections import deque, MutableMapping, MutableSet
 from copy import copy, deepcopy
 from Lib.errors import GameStateError
 from basics import *
-from board import Board
+from board import Board, BOARD_BYTES
+from bitboard import BitBoard
 from Lib.decontractors import Precondition, Postcondition
 
+# A GameState's hash is its board's hash xor'd with a key for every fact about
+#   the rest of it: each player's money, shares and tiles, the shares in the
+#   pool and the tiles in the deck. Facts are keyed by player name, not seat,
+#   since GameStates are equal whatever order their players are in.
+HASH_BITS = 63
+_zobrist = Random(4711)
+MONEY_KEY = _zobrist.getrandbits(HASH_BITS)
+POOL_KEY = _zobrist.getrandbits(HASH_BITS)
+share_keys = dict([(h, _zobrist.getrandbits(HASH_BITS)) for h in hotels])
+tile_keys = dict([(c, _zobrist.getrandbits(HASH_BITS)) for c in coords])
+deck_keys = dict([(c, _zobrist.getrandbits(HASH_BITS)) for c in coords])
+
+def _mix(x):
+    """ scramble the int x into a HASH_BITS bit key (the splitmix64 finalizer) """
+    x &= 0xffffffffffffffff
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+    return (x ^ (x >> 31)) >> (64 - HASH_BITS)
+
+def fact_key(name, key, value=0):
+    """ the hash key for the fact that the named player has value of key """
+    return _mix(hash(name) ^ key ^ _mix(value))
+
+# GameState.to_bytes layout, all big endian:
+#   header  - number of players, the board's class (its index in BOARD_TYPES),
+#             the board (see Board.to_bytes), the number of tiles in the deck
+#             and the shares left in the pool for each hotel
+#   deck    - the coord_index of each tile in the deck, in deck order
+#   players - in turn order: the name's length, the name (utf-8), money, the
+#             shares of each hotel and the hand as a tile mask
+# A tile mask has bit coord_index[tile] set for each tile, in TILE_MASK_BYTES.
+TILE_MASK_BYTES = (len(coords) + 7) // 8
+BOARD_TYPES = (Board, BitBoard)
+STATE_HEADER = Struct('>BB{0}sB{1}B'.format(BOARD_BYTES, len(hotels)))
+PLAYER_FIELDS = Struct('>I{0}B{1}s'.format(len(hotels), TILE_MASK_BYTES))
+
+def mask_to_bytes(mask):
+    """ pack a tile mask into TILE_MASK_BYTES """
+    return ('%0*x' % (2 * TILE_MASK_BYTES, mask)).decode('hex')
+
+def bytes_to_mask(data):
+    """ unpack a tile mask """
+    return int(data.encode('hex'), 16)
+
+def rank_stockholders(holdings):
+    """
+    Rank the holders of a hotel's shares.
+
+    Arguments:
+        holdings - [(holder, count)] of the hotel's shares, holders with no
+            shares are left out of the ranking
+    Returns:
+        (ranking, majority, minority): ranking is the [(holder, count)] of the
+        holders, most shares first and ties in holder order, majority and
+        minority are the tuples of holders with the most and the second most
+        shares
+    """
+    ranking = sorted([(who, count) for who, count in holdings if count > 0],
+                     key=lambda (who, count): (-count, who))
+    if not ranking:
+        return (), (), ()
+    most = ranking[0][1]
+    majority = tuple([who for who, count in ranking if count == most])
+    rest = ranking[len(majority):]
+    minority = tuple([who for who, count in rest if count == rest[0][1]]) if rest else ()
+    return ranking, majority, minority
+
+def bonuses(majority, minority, price):
+    """
+    The [(holder, bonus)] paid out for a hotel at price to its majority and
+    minority stockholders (see rank_stockholders). Tied holders split their
+    bonuses, and a tied majority splits the minority bonus too.
+
+    """
+    majority_payout = MAJORITY_PAYOUT_SCALE * price
+    minority_payout = MINORITY_PAYOUT_SCALE * price
+
+    if len(majority) > 1:
+        payout = divide_and_round_integers(majority_payout + minority_payout, len(majority))
+        return [(who, payout) for who in majority]
+
+    paid = [(who, majority_payout) for who in majority]
+    if minority:
+        payout = divide_and_round_integers(minority_payout, len(minority))
+        paid.extend([(who, payout) for who in minority])
+    return paid
+
+def stockholder_bonuses(counts, price):
+    """
+    The majority and minority bonuses paid out for a hotel at price, when the
+    players hold counts shares of it. Players holding no shares get nothing,
+    and tied holders split their bonuses.
+
+    Arguments:
+        counts - [count] of the hotel's shares each player holds
+        price - the hotel's stock price
+    Returns:
+        [(index into counts, bonus)]
+    """
+    _, majority, minority = rank_stockholders(enumerate(counts))
+    return bonuses(majority, minority, price)
+
+def pool_key(hotel, count):
+    """ the hash key for the fact that the pool has count shares of hotel """
+    return _mix(POOL_KEY ^ share_keys[hotel] ^ _mix(count))
+
+
+class SharesView(MutableMapping):
+
+    """
+    shares as a dict(hotel=>count), reading and writing a row of counts in
+    hotels order: a player's, or a GameState's pool. Writes mark the row's
+    owner as edited, for its GameState to rehash (see GameState)
+    """
+    def __init__(self, owner, row):
+        self._owner = owner
+        self._row = row
+
+    def __getitem__(self, hotel):
+        return self._row[hotel_index[hotel]]
+
+    def __setitem__(self, hotel, count):
+        self._row[hotel_index[hotel]] = count
+        self._owner._edited = True
+
+    def __delitem__(self, hotel):
+        self._row[hotel_index[hotel]] = 0
+        self._owner._edited = True
+
+    def __iter__(self):
+        return iter(hotels)
+
+    def __len__(self):
+        return len(hotels)
 
-class GameStatePlayer:
+    def __copy__(self):
+        return dict(self.items())
+    copy = __copy__
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class TilesView(MutableSet):
+
+    """ a player's hand as a set([tile]), reading and writing their tile mask, see SharesView """
+    def __init__(self, player):
+        self._player = player
+
+    @classmethod
+    def _from_iterable(cls, tiles):
+        return set(tiles)
+
+    def __contains__(self, tile):
+        return tile in coord_index and bool(self._player._tiles >> coord_index[tile] & 1)
+
+    def __iter__(self):
+        mask = self._player._tiles
+        while mask:
+            low = mask & -mask
+            yield coords[low.bit_length() - 1]
+            mask ^= low
+
+    def __len__(self):
+        return bin(self._player._tiles).count('1')
+
+    def add(self, tile):
+        self._player._tiles |= 1 << coord_index[tile]
+        self._player._edited = True
+
+    def discard(self, tile):
+        if tile in coord_index:
+            self._player._tiles &= ~(1 << coord_index[tile])
+            self._player._edited = True
+
+    def __copy__(self):
+        return set(self)
+    copy = __copy__
+
+    def __repr__(self):
+        return repr(set(self))
+
+
+class TileDeck(object):
+
+    """
+    The tiles left to hand out, in a list for handout strategies to pick from
+    by index, with each tile's index and a mask of the tiles alongside.
+    Membership, remove and putting back a removed tile are constant time:
+    removing a tile moves the last tile into its place, so the deck's order
+    only matters to the handout strategies. Two decks are equal when they
+    hold the same tiles.
+
+    Fields:
+        _tiles  - [tile]
+        _index  - dict(tile=>index in _tiles)
+        mask    - int with bit coord_index[tile] set for each tile in the deck
+        _edited - whether the deck changed since its GameState last rehashed,
+                  other than through the GameState commands (see GameState)
+    """
+    __slots__ = ('_tiles', '_index', 'mask', '_edited')
+
+    def __init__(self, tiles=()):
+        self._tiles = []
+        self._index = {}
+        self.mask = 0
+        self._edited = True
+        self.extend(tiles)
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __iter__(self):
+        return iter(self._tiles)
+
+    def __getitem__(self, i):
+        return self._tiles[i]
+
+    def __contains__(self, tile):
+        return tile in coord_index and bool(self.mask >> coord_index[tile] & 1)
+
+    def __eq__(self, other):
+        if isinstance(other, TileDeck):
+            return self.mask == other.mask
+        return set(self._tiles) == set(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __copy__(self):
+        deck = TileDeck()
+        deck._tiles = list(self._tiles)
+        deck._index = dict(self._index)
+        deck.mask = self.mask
+        deck._edited = self._edited
+        return deck
+
+    def __deepcopy__(self, _):
+        return self.__copy__()
+
+    def __getstate__(self):
+        return self._tiles
+
+    def __setstate__(self, tiles):
+        self.__init__(tiles)
+
+    def __repr__(self):
+        return repr(self._tiles)
+
+    def append(self, tile):
+        """ put the tile at the end of this deck """
+        self._index[tile] = len(self._tiles)
+        self._tiles.append(tile)
+        self.mask |= 1 << coord_index[tile]
+        self._edited = True
+
+    def extend(self, tiles):
+        """ put the tiles at the end of this deck """
+        for tile in tiles:
+            self.append(tile)
+
+    def remove(self, tile):
+        """ take the tile out of this deck and return the index it was at """
+        self._edited = True
+        return self._remove(tile)
+
+    def insert(self, i, tile):
+        """ put back the tile remove took out at index i, as it was before """
+        self._edited = True
+        self._insert(i, tile)
+
+    def _remove(self, tile):
+        """ remove, for the GameState commands """
+        if tile not in self:
+            raise ValueError("{0} is not in the deck".format(tile))
+        i = self._index.pop(tile)
+        last = self._tiles.pop()
+        if last != tile:
+            self._tiles[i] = last
+            self._index[last] = i
+        self.mask &= ~(1 << coord_index[tile])
+        return i
+
+    def _insert(self, i, tile):
+        """ insert, for the GameState commands """
+        if i < len(self._tiles):
+            moved = self._tiles[i]
+            self._index[moved] = len(self._tiles)
+            self._tiles.append(moved)
+            self._tiles[i] = tile
+        else:
+            self._tiles.append(tile)
+        self._index[tile] = i
+        self.mask |= 1 << coord_index[tile]
+
+
+class GameStatePlayer(object):
+
+    """
+    container class for Acquire players
+
+    Fields:
+        name    - string
+        _money  - number
+        _shares - [count] of each hotel, in hotels order
+        _tiles  - int with bit coord_index[tile] set for each tile in hand
+        _edited - whether money, shares_map or tiles were written since its
+                  GameState last rehashed (see GameState); a new player is,
+                  until a GameState rehashes with it
+
+    money, shares_map and tiles read and write _money, _shares and _tiles as a
+    number, a dict and a set
+    """
+    __slots__ = ('name', '_money', '_shares', '_tiles', '_edited')
 
-    """ container class for Acquire players """
     def __init__(self):
-        self.name = None  # string
-        self.money = None  # number
-        self.shares_map = None  # dict
-        self.tiles = None  # set
+        self.name = None
+        self._money = None
+        self._shares = [0] * len(hotels)
+        self._tiles = 0
+        self._edited = True
+
+    def _get_money(self):
+        return self._money
+
+    def _set_money(self, money):
+        self._money = money
+        self._edited = True
+
+    money = property(_get_money, _set_money)
+
+    def _get_shares_map(self):
+        return SharesView(self, self._shares)
+
+    def _set_shares_map(self, shares_map):
+        self._shares = [shares_map.get(h, 0) for h in hotels]
+        self._edited = True
+
+    shares_map = property(_get_shares_map, _set_shares_map)
+
+    def _get_tiles(self):
+        return TilesView(self)
+
+    def _set_tiles(self, tiles):
+        mask = 0
+        for tile in tiles:
+            mask |= 1 << coord_index[tile]
+        self._tiles = mask
+        self._edited = True
+
+    tiles = property(_get_tiles, _set_tiles)
 
     def __eq__(self, other):
         if isinstance(other, GameStatePlayer):
             return self.name == other.name and \
-                   self.money == other.money and \
-                   self.shares_map == other.shares_map and \
-                   self.tiles == other.tiles
+                   self._money == other._money and \
+                   self._shares == other._shares and \
+                   self._tiles == other._tiles
         else:
             return False
 
+    def __ne__(self, other):
+        return not self == other
+
     def __hash__(self):
-        return hash(self.name) ^ \
-               hash(self.money) ^ \
-               hash(frozenset(self.shares_map.items())) ^ \
-               hash(frozenset(self.tiles))
+        # players are kept in sets while their fields change, and equal players
+        #   have equal names
+        return hash(self.name)
+
+    def __getstate__(self):
+        return self.name, self._money, self._shares, self._tiles
 
+    def __setstate__(self, state):
+        self.name, self._money, self._shares, self._tiles = state
+        self._edited = True
 
     def __copy__(self):
         player = GameStatePlayer()
         player.name = self.name
-        player.money = self.money
-        player.shares_map = copy(self.shares_map)
-        player.tiles = copy(self.tiles)
+        player._money = self._money
+        player._shares = list(self._shares)
+        player._tiles = self._tiles
+        player._edited = self._edited
         return player
 
     def __deepcopy__(self, _):
@@ -64,21 +417,37 @@ class GameStatePlayer:
     @Precondition(lambda: hotel in hotels, globals=globals())
     def has_shares_of(self, hotel):
         """ returns whether this player has shares of given hotel """
-        return self.shares_map[hotel] > 0
+        return self._shares[hotel_index[hotel]] > 0
 
     @Precondition(lambda: hotel in hotels, globals=globals())
     def add_shares(self, hotel, count):
         """ adds count number of shares to this player's number of shares """
-        self.shares_map[hotel] += count
+        self._shares[hotel_index[hotel]] += count
+        self._edited = True
 
     def remove_all_shares(self, hotel):
         """ removes all hotel shares from this player """
-        self.shares_map[hotel] = 0
+        self._shares[hotel_index[hotel]] = 0
+        self._edited = True
 
 
-class GameState:
+class GameState(object):
 
-    """ represents a state in an Acquire Game """
+    """
+    represents a state in an Acquire Game
+
+    players is kept indexed by name (in _players_by_name), so code that
+    replaces players in place, rather than assigning players or going
+    through the GameState commands, must assign players again afterwards.
+
+    The GameState commands also keep the game's hash and its stockholder
+    rankings up to date as they go. Changing the players' money, shares or
+    tiles, the pool or the deck any other way (through money, the shares_map
+    and tiles views, the deck's methods or by assigning players, the pool or
+    the deck) marks them as edited, and the hash and the rankings are then
+    worked out again from scratch the next time they are needed (see
+    _sync). Changing only the seating, like players.rotate, changes neither.
+    """
 
     def __init__(self, player_names, handout=lambda x: x[-1], fake_init=False):
         """ starts a new game of acquire and does all necessary setup.
@@ -95,41 +464,144 @@ class GameState:
         if fake_init:
             return
 
+        self._zobrist = 0
+        self._edited = True
+        self._shared_deck = False
+        self._shared_players = set()
         self.board = Board()
 
-        self.tile_deck = copy(coords)
-        self.tile_deck.sort(key=tile_sortkey, reverse=True)
+        self.tile_deck = TileDeck(sorted(coords, key=tile_sortkey, reverse=True))
 
-        self.players = deque([])
+        players = deque([])
         for name in player_names:
             player = GameStatePlayer()
-            self.players.append(player)
+            players.append(player)
             player.name = name
             player.money = STARTING_MONEY
             player.shares_map = dict([(h, 0) for h in hotels])
             player.tiles = set([])
+        self.players = players
+        for player in players:
             [self._give_player_tile(player, handout(self.tile_deck)) for _ in xrange(6)]
 
         self.shares_map = dict([(h, INITIAL_SHARES_PER_HOTEL) for h in hotels])
+        self.rehash()
 
     def __eq__(self, other):
         if isinstance(other, GameState):
-            return set(self.players) == set(other.players) and \
+            return hash(self) == hash(other) and \
+                   set(self.players) == set(other.players) and \
                    self.tile_deck == other.tile_deck and \
-                   self.shares_map == other.shares_map and \
+                   self._pool == other._pool and \
                    self.board == other.board
         else:
             return False
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        """
+        Zobrist hash of this game, kept up to date by the GameState commands
+        and the Board's, and worked out again after other edits (see
+        GameState). The seating order is left out.
+
+        """
+        self._sync()
+        return self._zobrist ^ hash(self.board)
+
 
     def __copy__(self):
+        self._sync()
         new_state = GameState([], fake_init=True)
         new_state.board = copy(self.board)
-        new_state.tile_deck = copy(self.tile_deck)
+        new_state._tile_deck = copy(self._tile_deck)
         new_state.players = deque([copy(p) for p in self.players])
-        new_state.shares_map = copy(self.shares_map)
+        new_state._pool = list(self._pool)
+        new_state._zobrist = self._zobrist
+        new_state._rankings = list(self._rankings)
+        new_state._edited = False
+        new_state._shared_deck = False
+        new_state._shared_players = set()
         return new_state
 
+    def fork(self):
+        """
+        Copy this game for applying a move to, without copying its board, deck
+        or players: the copy shares them with this game until one of the two
+        changes them, which then copies just the part it changes first (see
+        _own_deck and _own_player). Unlike copy, the result must only be
+        changed through GameState commands.
+
+        """
+        self._sync()
+        new_state = GameState([], fake_init=True)
+        new_state.board = self.board.fork()
+        new_state._tile_deck = self._tile_deck
+        new_state.players = copy(self.players)
+        new_state._pool = list(self._pool)
+        new_state._zobrist = self._zobrist
+        new_state._rankings = list(self._rankings)
+        new_state._edited = False
+        self._shared_deck = new_state._shared_deck = True
+        self._shared_players = set([id(p) for p in self.players])
+        new_state._shared_players = set(self._shared_players)
+        return new_state
+
+    def to_bytes(self):
+        """
+        Pack this game into a few hundred bytes, see STATE_HEADER. from_bytes
+        gives back the same class of board and the deck in the same order.
+
+        """
+        data = [STATE_HEADER.pack(len(self.players), BOARD_TYPES.index(self.board.__class__),
+                                  self.board.to_bytes(), len(self._tile_deck), *self._pool),
+                str(bytearray([coord_index[tile] for tile in self._tile_deck]))]
+        for player in self.players:
+            name = player.name.encode('utf-8') if isinstance(player.name, unicode) else player.name
+            data.append(chr(len(name)) + name)
+            data.append(PLAYER_FIELDS.pack(player.money,
+                                           *(player._shares + [mask_to_bytes(player._tiles)])))
+        return ''.join(data)
+
+    @staticmethod
+    def from_bytes(data):
+        """ Unpack a game packed by to_bytes, raising a ValueError on bad data """
+        try:
+            header = STATE_HEADER.unpack_from(data)
+            state = GameState([], fake_init=True)
+            state.board = BOARD_TYPES[header[1]].from_bytes(header[2])
+            offset = STATE_HEADER.size
+            deck = bytearray(data[offset:offset + header[3]])
+            if len(deck) != header[3] or len(set(deck)) != len(deck):
+                raise ValueError("not a packed game state")
+            state.tile_deck = TileDeck([coords[i] for i in deck])
+            state.shares_map = dict(zip(hotels, header[4:]))
+            players = deque([])
+
+            offset += len(deck)
+            for _ in xrange(header[0]):
+                name_length = ord(data[offset])
+                player = GameStatePlayer()
+                player.name = data[offset + 1:offset + 1 + name_length]
+                offset += 1 + name_length
+                fields = PLAYER_FIELDS.unpack_from(data, offset)
+                offset += PLAYER_FIELDS.size
+                player.money = fields[0]
+                player._shares = list(fields[1:-1])
+                player._tiles = bytes_to_mask(fields[-1])
+                players.append(player)
+            state.players = players
+        except (StructError, IndexError):
+            raise ValueError("not a packed game state")
+        if offset != len(data):
+            raise ValueError("{0} bytes left over after the game state".format(len(data) - offset))
+
+        state._shared_deck = False
+        state._shared_players = set()
+        state.rehash()
+        return state
+
     def printgs(self):
         """ print this state in a somewhat human readable way """
         # TODO: make this pretty
@@ -184,17 +656,59 @@ class GameState:
                 raise GameStateError("too many shares have been allocated \
                                      in this game state")
 
+        state.rehash()
         return state
 
     #########################################################################
     # GameState Properties: #################################################
     #########################################################################
+    def _get_players(self):
+        return self._players
+
+    def _set_players(self, players):
+        self._players = players
+        self._players_by_name = dict([(p.name, p) for p in reversed(players)])
+        self._edited = True
+
+    players = property(_get_players, _set_players,
+                       doc=""" this game's GameStatePlayers, in turn order """)
+
+    def _get_tile_deck(self):
+        return self._tile_deck
+
+    def _set_tile_deck(self, tile_deck):
+        self._tile_deck = tile_deck
+        self._edited = True
+
+    tile_deck = property(_get_tile_deck, _set_tile_deck,
+                         doc=""" this game's TileDeck, the tiles left to hand out """)
+
+    def _get_shares_map(self):
+        return SharesView(self, self._pool)
+
+    def _set_shares_map(self, shares_map):
+        self._pool = [shares_map.get(h, 0) for h in hotels]
+        self._edited = True
+
+    shares_map = property(_get_shares_map, _set_shares_map,
+                          doc=""" the shares left in this game's pool, as a dict(hotel=>count) """)
+
     @property
     @Postcondition(lambda: isinstance(__return__, GameStatePlayer) and self.players[0]==__return__, globals=globals())
     def current_player(self):
         """ returns this game's current player """
         return self.players[0]
 
+    @property
+    def shares_matrix(self):
+        """
+        returns the players x hotels matrix of shares, in turn and hotels
+        order. The rows are copies: change shares through the players'
+        shares_map
+
+        """
+        return [list(p._shares) for p in self.players]
+
     #########################################################################
     # GameState Queries: ####################################################
     #########################################################################
@@ -202,7 +716,7 @@ class GameState:
     @Postcondition(lambda: isinstance(__return__, GameStatePlayer), globals=globals())
     def player_with_name(self, name):
         """ Get the player in this game with the given name """
-        return [p for p in self.players if p.name == name][0]
+        return self._players_by_name[name]
 
     @Precondition(lambda: hotel in hotels, globals=globals())
     @Postcondition(lambda: all(p in self.players and p.shares_map>0 and p.shares_map[hotel]==s for p, s in __return__))
@@ -213,8 +727,8 @@ class GameState:
         in that hotel
 
         """
-        return [(p, p.shares_map[hotel])
-                for p in self.players if p.has_shares_of(hotel)]
+        k = hotel_index[hotel]
+        return [(p, p._shares[k]) for p in self.players if p._shares[k] > 0]
 
     @Precondition(lambda: hotel in hotels, globals=globals())
     @Postcondition(lambda: isinstance(__return__, set)
@@ -225,9 +739,8 @@ class GameState:
         given hotel
 
         """
-        players_with_stocks = self.players_with_stocks(hotel)
-        max_stocks = max([s for p, s in players_with_stocks])
-        return set([p for p, s in players_with_stocks if s == max_stocks])
+        self._sync()
+        return set([self._players_by_name[name] for name in self._rankings[hotel_index[hotel]][1]])
 
     @Precondition(lambda: hotel in hotels, globals=globals())
     @Postcondition(lambda: isinstance(__return__, set)
@@ -240,50 +753,42 @@ class GameState:
         in the hotel
 
         """
-        not_majority_shareholders = \
-            [(p, s) for p, s in self.players_with_stocks(hotel)
-             if p not in self.majority_stockholders(hotel)]
-        if len(not_majority_shareholders) == 0:
-            return set([])
-        max_stocks = max([s for p, s in not_majority_shareholders])
-        return set([p for p, s in not_majority_shareholders if s == max_stocks])
+        self._sync()
+        return set([self._players_by_name[name] for name in self._rankings[hotel_index[hotel]][2]])
 
-    def final_scores(self):
+    @Precondition(lambda: hotel in hotels, globals=globals())
+    def stockholder_ranking(self, hotel):
         """
-        Returns the final scores of this game
-        Game must be finished
+        returns the [(playername, share_count)] of the players in this game
+        with stocks in the given hotel, most stocks first and ties by name
 
-        Returns:
-            dict[playerid -> score]
         """
-        # since payouts mutate state, leave this state intact and modify this guy
-        final_state = deepcopy(self)
-        return dict([(p.name, final_state._final_score(p))
-                     for p in final_state.players])
+        self._sync()
+        return list(self._rankings[hotel_index[hotel]][0])
 
-    @Postcondition(lambda: isinstance(__return__, int))
-    def _final_score(self, player):
+    def final_scores(self):
         """
-        returns the score of this player
-
-        Arguments:
-            player - a GameStatePlayer in this game
+        Returns the final scores of this game, without changing it: each
+        player's money, plus the bonuses for every hotel on the board with
+        shares out, plus the market value of all their stocks
+        Game must be finished
 
         Returns:
-            integer
-            score = players money + the market value of all their stocks
+            dict[playerid -> score]
         """
-
-        #payout merger bonus for all hotels
-        for hotel in hotels:
-            price = self.board.stock_price(hotel)
-            if price is not None and self.shares_map[hotel] < INITIAL_SHARES_PER_HOTEL:
-                self.payout(hotel, price, self)
-
-        return (player.money +
-                sum([self.board.stock_price(share) * player.shares_map[share]
-                     for share in player.shares_map
-                     if self.board.stock_price(share) is not None]))
+        players = list(self.players)
+        scores = [p.money for p in players]
+        for k, price in enumerate(self.board.price_vector()):
+            hotel = hotels[k]
+            if price is None:
+                continue
+            counts = [p._shares[k] for p in players]
+            for i, count in enumerate(counts):
+                scores[i] += price * count
+            if self.shares_map[hotel] < INITIAL_SHARES_PER_HOTEL:
+                for i, bonus in stockholder_bonuses(counts, price):
+                    scores[i] += bonus
+        return dict(zip([p.name for p in players], scores))
 
     #########################################################################
     # GameState Commands: ###################################################
@@ -319,9 +824,9 @@ class GameState:
                 # currently is no stock is available
                 # the founding player recieves nothing
                 if self.shares_map[hotel] > FOUND_SHARES:
-                    self.current_player.add_shares(hotel, FOUND_SHARES)
-                    self.shares_map[hotel] -= FOUND_SHARES
+                    self._move_shares(player, hotel, FOUND_SHARES)
 
+        player = self._own_player(self.current_player)
         move_type = self.board.query(coord)
 
         if SINGLETON == move_type:
@@ -343,7 +848,7 @@ class GameState:
         elif INVALID == move_type:
             raise GameStateError("illegal tile placement")
 
-        self.current_player.tiles.remove(coord)
+        self._take_player_tile(player, coord)
 
     def sellback(self, name, sell_hotels, initial_state):
         """
@@ -355,19 +860,21 @@ class GameState:
             sell_hotels - a list of hotels to sell
             initial_state - a state providing information about hotel costs
         """
-        player = self.player_with_name(name)
+        self._sellback(name, sell_hotels, initial_state.board.price_vector())
+
+    def _sellback(self, name, sell_hotels, prices):
+        """ sellback, at the given prices (see Board.price_vector) """
+        player = self._own_player(self.player_with_name(name))
         for hotel in sell_hotels:
             if player.has_shares_of(hotel):
-                hotel_price = initial_state.board.stock_price(hotel)
+                hotel_price = prices[hotel_index[hotel]]
 
                 # TODO: remove this
                 assert hotel_price is not None
 
                 stocks_amount = player.shares_map[hotel]
-                player.money += hotel_price * stocks_amount
-
-                self.shares_map[hotel] += stocks_amount
-                player.remove_all_shares(hotel)
+                self._add_money(player, hotel_price * stocks_amount)
+                self._move_shares(player, hotel, -stocks_amount)
 
     @Precondition(lambda: self.is_valid_buy([hotel]), globals=globals())
     def buy_stock(self, hotel):
@@ -383,9 +890,9 @@ class GameState:
         if self.current_player.money < stock_price:
             raise GameStateError("current player can't afford stock for "+hotel)
 
-        self.shares_map[hotel] -= 1
-        self.current_player.money -= stock_price
-        self.current_player.shares_map[hotel] += 1
+        player = self._own_player(self.current_player)
+        self._add_money(player, -stock_price)
+        self._move_shares(player, hotel, 1)
 
     @Precondition(lambda: tile in coords and maybeHotel in hotels+[None], globals=globals())
     def merge_payout(self, tile, maybeHotel, initial_state, end_of_game=False):
@@ -399,19 +906,26 @@ class GameState:
         Effects:
             Adds money to players in this state according to merge payout rules
         """
+        for name, money in self._merge_payouts(tile, maybeHotel, initial_state):
+            self._add_money(self.player_with_name(name), money)
+
+    def _merge_payouts(self, tile, maybeHotel, initial_state):
+        """ the [(name, money)] merge_payout pays out, without paying it """
         if not initial_state.board.valid_merge_placement(tile, maybeHotel):
-            return
+            return []
 
         acquirer = maybeHotel
         acquirees = initial_state.board.acquirees(tile, acquirer)
 
+        payouts = []
         for acquiree in acquirees:
 
             stock_price = initial_state.board.stock_price(acquiree)
             # TODO: Remove this...
             assert stock_price is not None
 
-            self.payout(acquiree, stock_price, initial_state)
+            payouts.extend(self._payouts(acquiree, stock_price, initial_state))
+        return payouts
 
     def payout(self, hotel, price, state):
         """
@@ -422,38 +936,14 @@ class GameState:
             price - price of the hotel
             state - state to determine the majority/minority stockholders from
         """
+        for name, money in self._payouts(hotel, price, state):
+            self._add_money(self.player_with_name(name), money)
 
-        def to_current_player(player):
-            """ returns the player from this gamestate with player's name """
-            return self.player_with_name(player.name)
-
-        majority_stockholders = \
-            [to_current_player(p)
-             for p in state.majority_stockholders(hotel)]
-        minority_stockholders = \
-            [to_current_player(p)
-             for p in state.minority_stockholders(hotel)]
-        majority_payout = MAJORITY_PAYOUT_SCALE * price
-        minority_payout = MINORITY_PAYOUT_SCALE * price
-
-        if len(majority_stockholders) == 1:
-            player = majority_stockholders.pop()
-            player.money += majority_payout
-            if len(minority_stockholders) == 1:
-                player = minority_stockholders.pop()
-                player.money += minority_payout
-            elif len(minority_stockholders) > 1:
-                payout = \
-                    divide_and_round_integers(minority_payout,
-                                              len(minority_stockholders))
-                for player in minority_stockholders:
-                    player.money += payout
-        else:
-            payout = \
-             divide_and_round_integers(majority_payout + minority_payout,
-                                               len(majority_stockholders))
-            for player in majority_stockholders:
-                player.money += payout
+    def _payouts(self, hotel, price, state):
+        """ the [(name, money)] payout pays out, without paying it """
+        state._sync()
+        _, majority, minority = state._rankings[hotel_index[hotel]]
+        return bonuses(majority, minority, price)
 
     @Precondition(lambda: self.is_valid_done(tile), globals=globals())
     def done(self, tile):
@@ -472,11 +962,258 @@ class GameState:
 
         self.players.rotate(-1)
 
+    def apply_move(self, tile, hotel, sellbacks, shares, next_tile):
+        """
+        Play a whole turn on this game in place, as GameTree.apply does on a
+        fork: place the tile, sell back, buy shares, pay out any merger and
+        hand the current player next_tile. The move must be legal.
+
+        Arguments:
+            tile, hotel - a tile move
+            sellbacks - {playername=>[sellback_hotels]}
+            shares - [hotel], the shares to buy
+            next_tile - the tile to hand out at the end of the turn
+        Returns:
+            an undo record, for undo to take the move back with
+        """
+        board = self.board
+        payouts = self._merge_payouts(tile, hotel, self)
+        prices = board.price_vector()
+
+        movetype = board.query(tile)
+        squares = [(tile, Empty)]
+        if movetype == FOUND:
+            squares.extend([(c, NoHotel) for c in board.adjacent_coords(tile) if board[c] == NoHotel])
+        elif movetype == MERGE:
+            for acquiree in board.acquirees(tile, hotel):
+                squares.extend([(c, acquiree) for c in board[acquiree]])
+
+        journal = self._journal = []
+        try:
+            self.place_a_tile(tile, hotel)
+            for name in sellbacks:
+                self._sellback(name, sellbacks[name], prices)
+            for share in shares:
+                self.buy_stock(share)
+            for name, money in payouts:
+                self._add_money(self.player_with_name(name), money)
+            self.done(next_tile)
+        finally:
+            self._journal = None
+        return squares, journal
+
+    def undo(self, record):
+        """
+        Take back the move apply_move returned the given undo record for. Moves
+        have to be undone latest first.
+
+        """
+        squares, journal = record
+        self.players.rotate(1)
+        for undo, name, args in reversed(journal):
+            undo(self, self.player_with_name(name), *args)
+        self.board.restore(squares)
+
+    def _play_unchecked(self, tile, hotel, shares, next_tile):
+        """
+        Play a whole turn on this game in place with everyone keeping their
+        shares, as apply_move does without sellbacks, but without checking the
+        move or keeping an undo record: for searches playing many turns, whose
+        moves are legal because they come from Board.query_all and legal_buys.
+
+        Arguments:
+            tile, hotel - a tile move
+            shares - [hotel], the shares to buy
+            next_tile - the tile to hand out at the end of the turn, from the
+                deck, or None when the deck is empty
+        """
+        board = self.board
+        movetypes, adjacent = board.query_all()
+        i = coord_index[tile]
+        movetype = movetypes[i]
+
+        payouts = []
+        if movetype == MERGE:
+            prices = board.price_vector()
+            acquirees = [h for h, _ in adjacent[i] if h != hotel]
+            for acquiree in acquirees:
+                payouts.extend(self._payouts(acquiree, prices[hotel_index[acquiree]], self))
+            board._merge(tile, hotel, acquirees)
+        elif movetype == FOUND:
+            board._found(tile, hotel)
+        elif movetype == GROW:
+            board._grow(tile, adjacent[i][0][0])
+        else:
+            board._singleton(tile)
+
+        player = self._own_player(self.players[0])
+        if movetype == FOUND and self.shares_map[hotel] > FOUND_SHARES:
+            self._move_shares(player, hotel, FOUND_SHARES)
+        self._take_player_tile(player, tile)
+        prices = board.price_vector()
+        for share in shares:
+            self._add_money(player, -prices[hotel_index[share]])
+            self._move_shares(player, share, 1)
+        for name, money in payouts:
+            self._add_money(self._players_by_name[name], money)
+        if next_tile is not None:
+            self._deal_tile(player, next_tile)
+        self.players.rotate(-1)
+
+    @Precondition(lambda: name in [p.name for p in self.players])
+    def remove_player(self, name):
+        """
+        take the named player out of this game, putting their shares back in
+        the pool and their tiles back in the deck
+
+        """
+        player = self.player_with_name(name)
+        self.players.remove(player)
+        self.players = self.players
+
+        for h, s in player.shares_map.items():
+            self.shares_map[h] += s
+
+        self._own_deck()
+        self.tile_deck.extend(player.tiles)
+        self.rehash()
+
+    #########################################################################
+    # GameState Internal Commands: ##########################################
+    #########################################################################
+    # Every change to a player, the pool or the deck goes through these, which
+    # keep the hash and the stockholder rankings up to date and, during apply_move, journal their inverse
+    # as (function, playername, args) for undo.
+    _journal = None
+
     @Precondition(lambda: tile in self.tile_deck and player in self.players)
     def _give_player_tile(self, player, tile):
         """ gives the player in this game the tile and removes it from the deck """
-        player.tiles.add(tile)
-        self.tile_deck.remove(tile)
+        self._deal_tile(player, tile)
+
+    def _deal_tile(self, player, tile):
+        """ _give_player_tile, unchecked """
+        player = self._own_player(player)
+        player._tiles |= 1 << coord_index[tile]
+        self._own_deck()
+        index = self._tile_deck._remove(tile)
+        self._zobrist ^= fact_key(player.name, tile_keys[tile]) ^ deck_keys[tile]
+        if self._journal is not None:
+            self._journal.append((GameState._return_player_tile, player.name, (tile, index)))
+
+    def _return_player_tile(self, player, tile, index):
+        """ takes the tile from the player in this game and puts it back in the deck at index """
+        player = self._own_player(player)
+        player._tiles &= ~(1 << coord_index[tile])
+        self._own_deck()
+        self._tile_deck._insert(index, tile)
+        self._zobrist ^= fact_key(player.name, tile_keys[tile]) ^ deck_keys[tile]
+
+    def _take_player_tile(self, player, tile):
+        """ removes the tile from the player in this game's hand """
+        player = self._own_player(player)
+        player._tiles &= ~(1 << coord_index[tile])
+        self._zobrist ^= fact_key(player.name, tile_keys[tile])
+        if self._journal is not None:
+            self._journal.append((GameState._add_player_tile, player.name, (tile,)))
+
+    def _add_player_tile(self, player, tile):
+        """ puts the tile (not from the deck) back in the player in this game's hand """
+        player = self._own_player(player)
+        player._tiles |= 1 << coord_index[tile]
+        self._zobrist ^= fact_key(player.name, tile_keys[tile])
+
+    def _add_money(self, player, amount):
+        """ give the player in this game amount (maybe negative) money """
+        player = self._own_player(player)
+        self._zobrist ^= fact_key(player.name, MONEY_KEY, player._money)
+        player._money += amount
+        self._zobrist ^= fact_key(player.name, MONEY_KEY, player._money)
+        if self._journal is not None:
+            self._journal.append((GameState._add_money, player.name, (-amount,)))
+
+    def _move_shares(self, player, hotel, count):
+        """ move count (maybe negative) shares of hotel from the pool to the player in this game """
+        player = self._own_player(player)
+        k = hotel_index[hotel]
+        self._zobrist ^= self._shares_key(player, hotel) ^ pool_key(hotel, self._pool[k])
+        player._shares[k] += count
+        self._pool[k] -= count
+        self._zobrist ^= self._shares_key(player, hotel) ^ pool_key(hotel, self._pool[k])
+        self._rerank(player, hotel)
+        if self._journal is not None:
+            self._journal.append((GameState._move_shares, player.name, (hotel, -count)))
+
+    def _own_deck(self):
+        """ stop sharing this game's deck with its forks, before changing it """
+        if self._shared_deck:
+            self._tile_deck = copy(self._tile_deck)
+            self._shared_deck = False
+
+    def _own_player(self, player):
+        """
+        Returns this game's own copy of the given player of this game, copying
+        it in first if it is shared with a fork. Commands get players through
+        this before changing them, so that they change the copy.
+
+        """
+        if id(player) not in self._shared_players:
+            return player
+        self._shared_players.discard(id(player))
+        own = copy(player)
+        for i, p in enumerate(self.players):
+            if p is player:
+                self.players[i] = own
+        if self._players_by_name.get(own.name) is player:
+            self._players_by_name[own.name] = own
+        return own
+
+    @staticmethod
+    def _shares_key(player, hotel):
+        """ the hash key for the player's shares of hotel, none hash to 0 """
+        count = player._shares[hotel_index[hotel]]
+        return fact_key(player.name, share_keys[hotel], count) if count else 0
+
+    def rehash(self):
+        """
+        compute the hash of this game's players, pool and deck, and its
+        stockholder rankings, from scratch, after they were changed other
+        than through the GameState commands
+
+        """
+        key = 0
+        for player in self.players:
+            key ^= fact_key(player.name, MONEY_KEY, player._money)
+            for hotel in hotels:
+                key ^= self._shares_key(player, hotel)
+            for tile in player.tiles:
+                key ^= fact_key(player.name, tile_keys[tile])
+            player._edited = False
+        for hotel, count in zip(hotels, self._pool):
+            key ^= pool_key(hotel, count)
+        for tile in self._tile_deck:
+            key ^= deck_keys[tile]
+        self._tile_deck._edited = False
+        self._edited = False
+        self._zobrist = key
+        self._rank_all()
+
+    def _sync(self):
+        """ rehash this game if anything in it was edited since it last did """
+        if self._edited or self._tile_deck._edited or any([p._edited for p in self._players]):
+            self.rehash()
+
+    def _rank_all(self):
+        """ rank the stockholders of every hotel in this game from scratch """
+        self._rankings = [rank_stockholders([(p.name, p._shares[k]) for p in self.players])
+                          for k in xrange(len(hotels))]
+
+    def _rerank(self, player, hotel):
+        """ update the ranking of hotel's stockholders after the player's shares of it changed """
+        k = hotel_index[hotel]
+        ranking = [(name, count) for name, count in self._rankings[k][0] if name != player.name]
+        ranking.append((player.name, player._shares[k]))
+        self._rankings[k] = rank_stockholders(ranking)
 
     #########################################################################
     # GameState Queries: ####################################################
@@ -510,13 +1247,14 @@ class GameState:
             if len(set(shares)) > 1:
                 return False
 
+        prices = self.board.price_vector()
         for share in shares:
             # share must be available
             if shares.count(share) > self.shares_map[share]:
                 return False
 
             # player can afford all shares
-            cost = self.board.stock_price(share)
+            cost = prices[hotel_index[share]]
             if cost and cost <= cash:
                 cash -= cost
             else:
@@ -562,10 +1300,29 @@ class TestGameState(unittest.TestCase):
         pass
 
     def test_majority_stockholders(self):
-        pass
+        gs = self.gs
+        gs.board = Board._board_in_play([(A, ['2A', '3A'])])
+        self.assertEqual(gs.majority_stockholders(A), set())
+        gs.buy_stock(A)
+        self.assertEqual(gs.majority_stockholders(A), set([gs.player_with_name('jim')]))
+        gs.done(gs.tile_deck[0])
+        gs.buy_stock(A)
+        self.assertEqual(gs.majority_stockholders(A),
+                         set([gs.player_with_name('jim'), gs.player_with_name('lori')]))
 
     def test_minority_stockholders(self):
-        pass
+        gs = self.gs
+        gs.board = Board._board_in_play([(A, ['2A', '3A'])])
+        gs.buy_stock(A)
+        gs.buy_stock(A)
+        gs.done(gs.tile_deck[0])
+        gs.buy_stock(A)
+        gs.done(gs.tile_deck[0])
+        gs.buy_stock(A)
+        self.assertEqual(gs.minority_stockholders(A),
+                         set([gs.player_with_name('lori'), gs.player_with_name('matthias')]))
+        gs.sellback('jim', [A], gs)
+        self.assertEqual(gs.minority_stockholders(A), set())
 
     #
     # Tests for External Commands:
@@ -691,6 +1448,318 @@ class TestGameState(unittest.TestCase):
         self.assertEquals(gs.players[1].money, STARTING_MONEY)
         self.assertEquals(gs.players[2].money, STARTING_MONEY)
 
+    def test___hash__(self):
+        gs = self.gs
+        gs.place_a_tile('4A')
+        gs.place_a_tile('5A', 'Imperial')
+        gs.buy_stock('Imperial')
+        gs.done(gs.tile_deck[0])
+        gs.place_a_tile('7A')
+        gs.place_a_tile('8A', 'Worldwide')
+        gs.done(gs.tile_deck[0])
+        gs.done(gs.tile_deck[0])
+
+        initial_gs = deepcopy(gs)
+        self.assertEqual(hash(initial_gs), hash(gs))
+        self.assertEqual(initial_gs, gs)
+
+        gs.place_a_tile('6A', 'Imperial')
+        gs.merge_payout('6A', 'Imperial', initial_gs)
+        gs.sellback('jim', ['Worldwide'], initial_gs)
+        gs.done(gs.tile_deck[0])
+        self.assertNotEqual(hash(initial_gs), hash(gs))
+        self.assertNotEqual(initial_gs, gs)
+
+        incremental = hash(gs)
+        gs.rehash()
+        self.assertEqual(incremental, hash(gs))
+
+    def test_rehash(self):
+        # direct changes are noticed without a rehash
+        gs = self.gs
+        gs.board = Board._board_in_play([(A, ['1I', '2I'])])
+        gs.players[1].shares_map[A] = 2
+        gs.shares_map[A] -= 2
+        expected = GameState(['jim', 'lori', 'matthias'])
+        expected.board = Board._board_in_play([(A, ['1I', '2I'])])
+        expected.players.rotate(-1)
+        expected.buy_stock(A)
+        expected.buy_stock(A)
+        expected.players[0].money = STARTING_MONEY
+        expected.players.rotate(1)
+        self.assertEqual(gs, expected)
+        self.assertEqual(hash(gs), hash(expected))
+        self.assertEqual(gs.majority_stockholders(A), set([gs.players[1]]))
+        incremental = hash(gs)
+        gs.rehash()
+        self.assertEqual(incremental, hash(gs))
+
+        # copies made after an edit through a view hash like the original
+        other = copy(gs)
+        gs.shares_map[A] = 3
+        other.shares_map[A] = 3
+        self.assertEqual(gs, copy(other))
+        self.assertEqual(hash(gs), hash(copy(other)))
+        other.rehash()
+        self.assertEqual(gs, other)
+        self.assertEqual(hash(gs), hash(other))
+        other.players[0].tiles.pop()
+        self.assertNotEqual(gs, other)
+        other.tile_deck.remove(other.tile_deck[-1])
+        other.players[2].money += 1
+        self.assertNotEqual(hash(gs), hash(other))
+
+        # the seating doesn't need a rehash
+        gs.players.rotate(-1)
+        incremental = hash(gs)
+        gs.rehash()
+        self.assertEqual(incremental, hash(gs))
+
+    def test_fork(self):
+        gs = self.gs
+        fork = gs.fork()
+        self.assertEqual(fork, gs)
+        self.assertTrue(fork.tile_deck is gs.tile_deck)
+
+        fork.place_a_tile('1A')
+        fork.done(fork.tile_deck[-1])
+        self.assertEqual(gs, GameState(['jim', 'lori', 'matthias']))
+        self.assertEqual(len(fork.tile_deck), len(gs.tile_deck) - 1)
+        self.assertEqual(gs.board['1A'], Empty)
+        self.assertFalse(fork.players[-1] is gs.players[0])
+        self.assertTrue(fork.players[0] is gs.players[1])
+
+        # the original copies what it changes too
+        fork = gs.fork()
+        gs.place_a_tile('2A')
+        self.assertEqual(fork, GameState(['jim', 'lori', 'matthias']))
+        self.assertEqual(fork.current_player.tiles, set(['1A', '2A', '3A', '4A', '5A', '6A']))
+
+        incremental = hash(fork)
+        fork.rehash()
+        self.assertEqual(incremental, hash(fork))
+
+    def test_apply_move_and_undo(self):
+        gs = self.gs
+        gs.board = Board._board_in_play([(A, ['2A', '3A', '4A', '5A']), (S, ['1B', '1C', '2C'])])
+        gs.players[1].shares_map[A] = 3
+        gs.players[2].shares_map[S] = 2
+        gs.shares_map[A] -= 3
+        gs.shares_map[S] -= 2
+        gs.players[0].tiles.remove('2A')
+        gs.players[0].tiles.add('7A')
+        gs.rehash()
+        before = deepcopy(gs)
+
+        expected = deepcopy(gs)
+        expected.place_a_tile('1A', S)
+        expected.sellback('lori', [A], before)
+        expected.buy_stock(S)
+        expected.merge_payout('1A', S, before)
+        expected.done(expected.tile_deck[3])
+
+        record = gs.apply_move('1A', S, {'lori': [A]}, [S], gs.tile_deck[3])
+        self.assertEqual(gs, expected)
+        self.assertEqual([p.name for p in gs.players], [p.name for p in expected.players])
+        self.assertEqual(hash(gs), hash(expected))
+
+        gs.undo(record)
+        self.assertEqual(gs, before)
+        self.assertEqual([p.name for p in gs.players], [p.name for p in before.players])
+        self.assertEqual([p.money for p in gs.players], [p.money for p in before.players])
+        self.assertEqual(gs.board[S], set(['1B', '1C', '2C']))
+        self.assertEqual(hash(gs), hash(before))
+
+    def test_play_unchecked(self):
+        gs = self.gs
+        gs.board = Board._board_in_play([(A, ['2A', '3A', '4A', '5A']), (S, ['1B', '1C', '2C'])])
+        gs.players[1].shares_map[A] = 3
+        gs.players[2].shares_map[S] = 2
+        gs.shares_map[A] -= 3
+        gs.shares_map[S] -= 2
+        gs.players[0].tiles.remove('2A')
+        gs.players[0].tiles.add('7A')
+        gs.players[0].tiles.add('9I')
+        gs.rehash()
+
+        # a merger, a singleton, a found and a grow
+        for tile, hotel, shares in [('1A', S, [S]), ('9I', None, []), ('7A', None, []), ('8A', T, [T, T]), ('3B', None, [S])]:
+            gs.current_player.tiles.add(tile)
+            gs.rehash()
+            before = deepcopy(gs)
+            expected = deepcopy(gs)
+            expected.apply_move(tile, hotel, {}, shares, expected.tile_deck[3])
+            gs._play_unchecked(tile, hotel, shares, gs.tile_deck[3])
+            self.assertEqual(gs, expected)
+            self.assertEqual([p.name for p in gs.players], [p.name for p in expected.players])
+            self.assertEqual(list(gs.tile_deck), list(expected.tile_deck))
+            self.assertEqual(hash(gs), hash(expected))
+            self.assertEqual(gs.board.query_all(), expected.board.query_all())
+        self.assertEqual(gs.board[S], set(['1A', '1B', '1C', '2C', '2A', '3A', '4A', '5A', '3B']))
+        self.assertEqual(gs.board[T], set(['7A', '8A']))
+
+    def test_undo_walks_back_a_game(self):
+        gs = self.gs
+        states, records = [], []
+        for tile, hotel, shares in [('1A', None, []), ('7A', None, []), ('1B', A, []), ('2A', None, [A])]:
+            states.append(deepcopy(gs))
+            records.append(gs.apply_move(tile, hotel, {}, shares, gs.tile_deck[-1]))
+        self.assertEqual(gs.board[A], set(['1A', '1B', '2A']))
+        for state, record in reversed(zip(states, records)):
+            gs.undo(record)
+            self.assertEqual(gs, state)
+            self.assertEqual(list(gs.tile_deck), list(state.tile_deck))
+
+    def test_to_bytes(self):
+        gs = self.gs
+        gs.apply_move('1A', None, {}, [], gs.tile_deck[-1])
+        gs.apply_move('7A', None, {}, [], gs.tile_deck[-1])
+        gs.apply_move('1B', A, {}, [], gs.tile_deck[-1])
+        gs.apply_move('2A', None, {}, [A, A], gs.tile_deck[0])
+
+        data = gs.to_bytes()
+        unpacked = GameState.from_bytes(data)
+        self.assertEqual(unpacked, gs)
+        self.assertEqual(hash(unpacked), hash(gs))
+        self.assertEqual([p.name for p in unpacked.players], [p.name for p in gs.players])
+        self.assertEqual(list(unpacked.tile_deck), list(gs.tile_deck))
+        self.assertEqual(unpacked.to_bytes(), data)
+        self.assertTrue(unpacked.board.__class__ is Board)
+
+        # the board's class and the deck's order come back as they were
+        gs.board = BitBoard.from_bytes(gs.board.to_bytes())
+        gs.tile_deck = TileDeck(reversed(list(gs.tile_deck)))
+        unpacked = GameState.from_bytes(gs.to_bytes())
+        self.assertTrue(unpacked.board.__class__ is BitBoard)
+        self.assertEqual(unpacked.board, gs.board)
+        self.assertEqual(list(unpacked.tile_deck), list(gs.tile_deck))
+        self.assertEqual(unpacked, gs)
+
+        self.assertRaises(ValueError, GameState.from_bytes, data[:-1])
+        self.assertRaises(ValueError, GameState.from_bytes, data + '\0')
+
+    def test_tile_deck(self):
+        deck = TileDeck(['3A', '2A', '1A', '1B'])
+        self.assertEqual(deck.remove('2A'), 1)
+        self.assertEqual(list(deck), ['3A', '1B', '1A'])
+        self.assertFalse('2A' in deck)
+        self.assertRaises(ValueError, deck.remove, '2A')
+        self.assertEqual(deck, TileDeck(['1A', '1B', '3A']))
+        self.assertEqual(deck, ['1A', '1B', '3A'])
+
+        deck.insert(1, '2A')
+        self.assertEqual(list(deck), ['3A', '2A', '1A', '1B'])
+        self.assertEqual(deck.remove('1B'), 3)
+        deck.insert(3, '1B')
+        self.assertEqual(list(deck), ['3A', '2A', '1A', '1B'])
+        self.assertTrue('1B' in deck and deck[-1] == '1B' and len(deck) == 4)
+
+    def test_player_views(self):
+        player = GameStatePlayer._test_gsplayer('joe', 6000, {A: 5}, ['5A', '1B'])
+        self.assertEqual(player.shares_map, dict([(h, 5 if h == A else 0) for h in hotels]))
+        self.assertEqual(player.tiles, set(['5A', '1B']))
+
+        player.shares_map[S] += 2
+        player.tiles.add('3C')
+        player.tiles.remove('5A')
+        self.assertRaises(KeyError, player.tiles.remove, '5A')
+        self.assertEqual(player._shares, [5, 0, 0, 0, 2, 0, 0])
+        self.assertEqual(player._tiles, 1 << coord_index['1B'] | 1 << coord_index['3C'])
+
+        other = copy(player)
+        other.tiles.add('4D')
+        other.shares_map[S] = 0
+        self.assertEqual(player.tiles, set(['1B', '3C']))
+        self.assertEqual(player.shares_map[S], 2)
+        self.assertNotEqual(other, player)
+
+    def test_shares_matrix(self):
+        gs = self.gs
+        gs.place_a_tile('1A')
+        gs.place_a_tile('2A', A)
+        gs.buy_stock(A)
+        self.assertEqual(gs.shares_matrix, [[2, 0, 0, 0, 0, 0, 0], [0] * 7, [0] * 7])
+        self.assertEqual([p for p, _ in gs.players_with_stocks(A)], [gs.players[0]])
+
+    def test_player_with_name(self):
+        gs = self.gs
+        self.assertTrue(gs.player_with_name('lori') is gs.players[1])
+        gs.done(gs.tile_deck[-1])
+        self.assertTrue(gs.player_with_name('lori') is gs.players[0])
+
+        fork = gs.fork()
+        fork.sellback('matthias', [], gs)
+        fork._add_money(fork.player_with_name('matthias'), 100)
+        self.assertTrue(fork.player_with_name('matthias') is fork.players[1])
+        self.assertFalse(fork.player_with_name('matthias') is gs.player_with_name('matthias'))
+        self.assertEqual(gs.player_with_name('matthias').money, STARTING_MONEY)
+
+        gs.remove_player('lori')
+        self.assertFalse('lori' in gs._players_by_name)
+        self.assertTrue(deepcopy(gs).player_with_name('jim') is not gs.player_with_name('jim'))
+        self.assertEqual(deepcopy(gs).player_with_name('jim'), gs.player_with_name('jim'))
+
+    def test_stockholder_ranking(self):
+        gs = self.gs
+        gs.board = Board._board_in_play([(A, ['2A', '3A', '4A', '5A']), (S, ['1B', '1C', '2C'])])
+        gs.players[1].shares_map[A] = 3
+        gs.players[2].shares_map[A] = 3
+        gs.shares_map[A] -= 6
+        gs.players[0].tiles.remove('2A')
+        gs.players[0].tiles.add('7A')
+        gs.rehash()
+        self.assertEqual(gs.stockholder_ranking(A), [('lori', 3), ('matthias', 3)])
+        self.assertEqual(gs.stockholder_ranking(S), [])
+
+        record = gs.apply_move('1A', S, {'lori': [A]}, [S, S], gs.tile_deck[0])
+        self.assertEqual(gs.stockholder_ranking(A), [('matthias', 3)])
+        self.assertEqual(gs.stockholder_ranking(S), [('jim', 2)])
+        self.assertEqual(gs._rankings, deepcopy(gs)._rankings)
+
+        gs.undo(record)
+        self.assertEqual(gs.stockholder_ranking(A), [('lori', 3), ('matthias', 3)])
+        self.assertEqual(gs.stockholder_ranking(S), [])
+
+        gs.remove_player('matthias')
+        self.assertEqual(gs.stockholder_ranking(A), [('lori', 3)])
+        self.assertEqual(gs.minority_stockholders(A), set())
+
+    def test_stockholder_bonuses(self):
+        self.assertEqual(stockholder_bonuses([0, 0, 0], 300), [])
+        self.assertEqual(stockholder_bonuses([0, 4, 0], 300), [(1, 3000)])
+        self.assertEqual(sorted(stockholder_bonuses([3, 1, 2, 2], 300)), [(0, 3000), (2, 750), (3, 750)])
+        self.assertEqual(sorted(stockholder_bonuses([3, 3, 1], 300)), [(0, 2250), (1, 2250)])
+        self.assertEqual(sorted(stockholder_bonuses([2, 2, 2], 300)), [(0, 1500), (1, 1500), (2, 1500)])
+
+    def test_final_scores(self):
+        gs = self.gs
+        gs.board = Board._board_in_play([(A, ['2A', '3A', '4A', '5A']), (S, ['1C', '2C', '3C'])])
+        gs.players[0].shares_map[A] = 3
+        gs.players[1].shares_map[A] = 2
+        gs.players[1].shares_map[S] = 2
+        gs.players[2].shares_map[S] = 1
+        gs.shares_map[A] -= 5
+        gs.shares_map[S] -= 3
+        gs.rehash()
+        before = deepcopy(gs)
+
+        self.assertEqual(gs.final_scores(), {'jim': 8000 + 5000 + 3 * 500,
+                                             'lori': 8000 + 2500 + 3000 + 2 * 500 + 2 * 300,
+                                             'matthias': 8000 + 1500 + 300})
+        self.assertEqual(gs, before)
+        self.assertEqual([p.money for p in gs.players], [STARTING_MONEY] * 3)
+
+    def test_remove_player(self):
+        gs = self.gs
+        gs.place_a_tile('1A')
+        gs.remove_player('lori')
+        self.assertEqual([p.name for p in gs.players], ['jim', 'matthias'])
+        self.assertEqual(len(gs.tile_deck), len(coords) - 12)
+
+        incremental = hash(gs)
+        gs.rehash()
+        self.assertEqual(incremental, hash(gs))
+
     def test_merge_payout_multiple_majority_one_minority(self):
         gs = self.gs
         gs.board = Board._board_in_play([(A,['2A', '3A', '4A', '5A']), (S,['1B', '1C', '2C'])])
@@ -721,3 +1790,21 @@ class TestGameState(unittest.TestCase):
         self.assertEquals(gs.players[0].money, 13000)
         self.assertEquals(gs.players[1].money, 9250)
         self.assertEquals(gs.players[2].money, 9250)
+
+    def test_merge_payout_after_shares_map_edits(self):
+        gs = self.gs
+        gs.board = Board._board_in_play([(A,['2A', '3A', '4A', '5A']), (S,['1B', '1C', '2C'])])
+        gs.players[0].shares_map[A] = 3
+        self.assertEqual(gs.majority_stockholders(A), set([gs.players[0]]))
+
+        # the rankings follow edits made after they were last read
+        gs.players[0].shares_map[A] = 0
+        gs.players[1].shares_map[A] = 4
+        gs.players[2].shares_map[A] = 1
+        self.assertEqual(gs.majority_stockholders(A), set([gs.players[1]]))
+        gs.players[2].shares_map[A] = 2
+        gs.merge_payout('1A', 'Sackson', gs)
+
+        self.assertEquals(gs.players[0].money, STARTING_MONEY)
+        self.assertEquals(gs.players[1].money, STARTING_MONEY + 5000)
+        self.assertEquals(gs.players[2].money, STARTING_MONEY + 2500)